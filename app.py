@@ -1,15 +1,32 @@
 # app.py
+import argparse
 import asyncio
+import functools
+import hashlib
+import heapq
+import hmac
+import io
+import ipaddress
+import itertools
 import json
+import math
+import multiprocessing
 import os
 import random
 import re
+import signal
+import socket
+import sqlite3
+import tarfile
+import tempfile
 import time
+import urllib.error
+import urllib.request
 import uuid
 import zipfile
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
-from contextlib import asynccontextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+from contextlib import asynccontextmanager, contextmanager, nullcontext
 from fastapi import FastAPI, Request, Form, UploadFile, File, HTTPException, BackgroundTasks
 from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
@@ -24,11 +41,39 @@ import glob
 import shutil
 import threading
 from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 # ==================== SYSTEM CONFIGURATION ====================
 # ==================== SYSTEM CONFIGURATION ====================
 class TTSConfig:
     SETTINGS_FILE = "tts_settings.json"
+    CACHE_INDEX_FILE = "cache_index.db"
+    
+    # Cache backend: "local" (thư mục audio_cache) hoặc "http" (cache server dùng chung)
+    CACHE_BACKEND = os.environ.get("TTS_CACHE_BACKEND", "local")
+    CACHE_REMOTE_URL = os.environ.get("TTS_CACHE_URL", "http://127.0.0.1:8100")
+    CACHE_REMOTE_TIMEOUT = 5
+    # Token dùng chung cho PUT/DELETE lên cache server (header X-Cache-Token); server bind ra
+    # ngoài loopback bắt buộc phải có token
+    CACHE_REMOTE_TOKEN = os.environ.get("TTS_CACHE_TOKEN", "")
+    CACHE_SERVER_MAX_ENTRY_BYTES = 16 * 1024 * 1024  # PUT lớn hơn bị từ chối (413)
+    # Lock file cũ hơn giá trị này (giây) được coi là bị bỏ rơi
+    CACHE_LOCK_TIMEOUT = 60
+    # Entry được đọc/ghi trong khoảng này (giây) không bị chọn để evict: người gọi dùng trực tiếp
+    # đường dẫn cache, phải đủ dài để decode/link xong (deadline_ms tối đa 30s)
+    CACHE_EVICTION_GRACE = 120
+    # Tăng khi thay đổi cách xử lý/encode audio để snapshot cũ bị bỏ qua
+    CACHE_FORMAT_VERSION = 1
+    # Snapshot import khi khởi động (đường dẫn file hoặc URL export của node khác)
+    CACHE_SNAPSHOT = os.environ.get("TTS_CACHE_SNAPSHOT", "")
+    
+    # TTL theo class (giây), None = không hết hạn (pinned)
+    CACHE_TTL_CLASSES = {
+        "short": 3600,
+        "default": 86400,
+        "long": 7 * 86400,
+        "pinned": None
+    }
     
     LANGUAGES = {
         "Vietnamese": [
@@ -499,6 +544,89 @@ class TTSConfig:
     
     OUTPUT_FORMATS = ["mp3", "wav"]
     
+    # Giới hạn mỗi job (giảm cho Render): số câu single voice, số lượt hội thoại multi-voice / Q&A
+    MAX_SENTENCES = 50
+    MAX_DIALOGUES = 20
+    MAX_QA_DIALOGUES = 10
+    
+    # Circuit breaker cho edge-tts
+    CIRCUIT_FAILURE_THRESHOLD = 5      # số lỗi liên tiếp để mở circuit
+    CIRCUIT_RESET_TIMEOUT = 30         # giây trước khi thử lại (half-open)
+    CIRCUIT_HALF_OPEN_PROBES = 1       # số request thăm dò khi half-open
+    NEGATIVE_CACHE_TTL = 60            # giây không gọi lại upstream cho câu vừa lỗi
+    
+    # Ghép audio từ cụm từ đã cache (opt-in, chỉ cho voice/setting cho phép)
+    PHRASE_REUSE_VOICES = [v for v in os.environ.get("TTS_PHRASE_REUSE_VOICES", "").split(",") if v]
+    PHRASE_REUSE_MIN_WORDS = 3     # prefix chung tối thiểu để ghép
+    PHRASE_REUSE_MAX_RATE = 10     # |rate| tối đa (%)
+    PHRASE_REUSE_MAX_PITCH = 10    # |pitch| tối đa (Hz)
+    PHRASE_REUSE_CROSSFADE = 15    # ms
+    
+    # Giới hạn request đồng thời tới edge-tts (toàn process)
+    UPSTREAM_MAX_CONCURRENT = 2
+    # Số slot luôn để dành cho job interactive (warm-up không được dùng)
+    UPSTREAM_RESERVED_INTERACTIVE = 1
+    # Lập lịch theo câu trong mỗi lane: "fair" (chia đều giữa các client) hoặc "fifo"
+    SCHEDULER_POLICY = os.environ.get("TTS_SCHEDULER_POLICY", "fair")
+    # Proxy tin cậy (IP/CIDR, cách nhau bằng dấu phẩy): chỉ request đi qua chúng mới được định danh
+    # client bằng X-Client-ID / X-Forwarded-For; còn lại dùng IP kết nối (fair-share, admission)
+    TRUSTED_PROXIES = [p.strip() for p in os.environ.get("TTS_TRUSTED_PROXIES", "").split(",") if p.strip()]
+    # Job không chỉ định priority: <= số câu này vào lane interactive, còn lại là bulk
+    SCHEDULER_INTERACTIVE_MAX_SENTENCES = 5
+    
+    # Job queue bền vững (SQLite)
+    JOBS_DB_FILE = "jobs.db"
+    JOB_LEASE_SECONDS = 60         # lease không được gia hạn -> worker coi như đã chết
+    JOB_HEARTBEAT_INTERVAL = 10    # giây giữa các lần gia hạn lease
+    JOB_MAX_ATTEMPTS = 3           # số lần chạy lại job khi worker chết giữa chừng
+    JOB_CONCURRENCY = 4            # số job chạy song song trong một worker
+    JOB_RESERVED_INTERACTIVE = 1   # slot job chỉ dành cho lane interactive
+    JOB_POLL_INTERVAL = 0.5        # giây giữa các lần kiểm tra hàng đợi
+    CHECKPOINT_DIR = "checkpoints" # audio từng câu của job đang chạy (để resume sau restart)
+    UPLOAD_DIR = "uploads"         # tài liệu tải lên của job chờ/chạy, được đọc dần khi xử lý
+    UPLOAD_CHUNK_SIZE = 1024 * 1024
+    # Số process worker riêng cho synthesis; 0 = chạy job ngay trong process API.
+    # Mỗi worker có limiter upstream riêng (UPSTREAM_MAX_CONCURRENT mỗi process)
+    WORKER_PROCESSES = int(os.environ.get("TTS_WORKER_PROCESSES", "0"))
+    
+    # Task: tiến độ qua Server-Sent Events, thời gian giữ và dọn task đã kết thúc
+    TASK_EVENTS_INTERVAL = 0.5     # giây giữa các lần đọc job store
+    TASK_EVENTS_KEEPALIVE = 15     # giây, comment giữ kết nối qua proxy
+    TASK_STATUS_BATCH_LIMIT = 500  # số task tối đa mỗi lần gọi /api/tasks/status
+    TASK_TTL = int(os.environ.get("TTS_TASK_TTL", "3600"))  # giây giữ task đã kết thúc
+    TASK_SWEEP_INTERVAL = 300      # giây giữa các lần sweeper xóa task hết hạn
+    # Giây giữ ánh xạ Idempotency-Key -> task (retry trong khoảng này không tạo job mới)
+    IDEMPOTENCY_TTL = int(os.environ.get("TTS_IDEMPOTENCY_TTL", "86400"))
+    
+    # Fast path: job nhỏ (hoặc đã có đủ trong cache) chạy ngay trong request, không qua queue
+    SYNC_MAX_UNITS = int(os.environ.get("TTS_SYNC_MAX_UNITS", "2"))
+    SYNC_MAX_CACHED_UNITS = 20     # job lớn hơn nhưng mọi câu đã có trong cache
+    
+    # deadline_ms: ngừng chờ câu sớm hơn deadline để kịp ghép/export phần đã xong:
+    # MARGIN giây + PER_UNIT giây mỗi câu đã xong, không quá MAX_SHARE của deadline
+    DEADLINE_ASSEMBLY_MARGIN = 0.25
+    DEADLINE_ASSEMBLY_PER_UNIT = 0.02
+    DEADLINE_ASSEMBLY_MAX_SHARE = 0.5
+    MAX_DEADLINE_MS = int(os.environ.get("TTS_MAX_DEADLINE_MS", "30000"))
+    # Câu bị bỏ lại sau deadline tiếp tục chạy ở background tối đa chừng này câu mỗi client
+    DEADLINE_MAX_BACKGROUND_UNITS = int(os.environ.get("TTS_DEADLINE_MAX_BACKGROUND_UNITS", "20"))
+    
+    # Batch API
+    BATCH_MAX_ITEMS = 2000
+    BATCH_ITEM_CONCURRENCY = 4     # số item của một batch xử lý song song
+    
+    # Chuẩn hóa văn bản: token (chuỗi không có khoảng trắng) dài hơn giới hạn này không đưa qua
+    # các lượt email/website (log, base64... dán vào không làm treo CPU); các lượt số/ký hiệu vẫn chạy
+    NORMALIZE_MAX_TOKEN = int(os.environ.get("TTS_NORMALIZE_MAX_TOKEN", "128"))
+    
+    # Admission control: vượt giới hạn -> 429 + Retry-After theo throughput hiện tại
+    ADMISSION_MAX_QUEUED_JOBS = int(os.environ.get("TTS_MAX_QUEUED_JOBS", "200"))
+    ADMISSION_MAX_QUEUED_SENTENCES = int(os.environ.get("TTS_MAX_QUEUED_SENTENCES", "5000"))
+    ADMISSION_MAX_CLIENT_JOBS = int(os.environ.get("TTS_MAX_CLIENT_JOBS", "10"))
+    ADMISSION_THROUGHPUT_WINDOW = 300   # giây dùng để đo số câu xử lý được mỗi giây
+    ADMISSION_DEFAULT_RETRY_AFTER = 30  # giây khi chưa đo được throughput
+    ADMISSION_MAX_RETRY_AFTER = 600
+    
     # Default pause settings (in milliseconds)
     DEFAULT_PAUSE_SETTINGS = {
         ".": 500,
@@ -512,326 +640,1060 @@ class TTSConfig:
     }
 
 # ==================== TASK MANAGER ====================
+class IdempotencyConflictError(Exception):
+    """Idempotency-Key đã được dùng cho một request khác"""
+
+class TaskRecord:
+    """Bản ghi task gọn (slots, timestamp dạng epoch); result/params chỉ parse JSON khi dùng"""
+    __slots__ = ("id", "type", "status", "progress", "message", "priority", "client_id",
+                 "units", "attempts", "created_at", "updated_at", "_result", "_params", "_playable")
+    
+    def __init__(self, row):
+        self.id = row["id"]
+        self.type = row["type"]
+        self.status = row["status"]
+        self.progress = row["progress"]
+        self.message = row["message"]
+        self.priority = row["priority"]
+        self.client_id = row["client_id"]
+        self.units = row["units"]
+        self.attempts = row["attempts"]
+        self.created_at = row["created_at"]
+        self.updated_at = row["updated_at"]
+        self._result = row["result"]
+        self._params = row["params"]
+        self._playable = row["playable"]
+    
+    @classmethod
+    def transient(cls, task_type: str, params: dict, priority: int, client_id: str) -> "TaskRecord":
+        """Job chạy ngay trong request (fast path), không lưu vào job store"""
+        now = time.time()
+        return cls({
+            "id": None, "type": task_type, "status": "running", "progress": 0, "message": None,
+            "priority": priority, "client_id": client_id, "units": 0, "attempts": 0,
+            "created_at": now, "updated_at": now, "result": None,
+            "params": json.dumps(params), "playable": None
+        })
+    
+    @property
+    def result(self) -> Optional[dict]:
+        return json.loads(self._result) if self._result else None
+    
+    @property
+    def params(self) -> dict:
+        return json.loads(self._params) if self._params else {}
+    
+    @property
+    def playable(self) -> Optional[dict]:
+        """Phần output đã phát được khi job còn đang chạy (xem ProgressiveOutput)"""
+        return json.loads(self._playable) if self._playable else None
+
 class TaskManager:
-    def __init__(self):
-        self.tasks = {}
+    """Job store/queue bền vững trên SQLite (WAL).
+    
+    Trạng thái: pending -> running -> completed | failed, hoặc cancelled khi bị hủy
+    (worker giữ job đang chạy thấy trạng thái này và dừng job). Job đang chạy giữ lease
+    (lease_owner, lease_expires) được worker gia hạn bằng heartbeat; lease hết hạn
+    nghĩa là worker đã chết, job được đưa lại hàng đợi (tối đa JOB_MAX_ATTEMPTS lần).
+    """
+    TERMINAL_STATES = ("completed", "failed", "cancelled")
+    
+    def __init__(self, db_path: str = TTSConfig.JOBS_DB_FILE):
         self.executor = ThreadPoolExecutor(max_workers=2)  # Giảm workers cho Render
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                id TEXT PRIMARY KEY,
+                type TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                progress INTEGER NOT NULL DEFAULT 0,
+                message TEXT,
+                result TEXT,
+                params TEXT,
+                playable TEXT,
+                priority INTEGER NOT NULL DEFAULT 0,
+                client_id TEXT,
+                units INTEGER NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                lease_owner TEXT,
+                lease_expires REAL,
+                heartbeat_at REAL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_tasks_status
+                ON tasks (status, created_at);
+            CREATE INDEX IF NOT EXISTS idx_tasks_created
+                ON tasks (created_at);
+            CREATE INDEX IF NOT EXISTS idx_tasks_updated
+                ON tasks (updated_at, id);
+            CREATE TABLE IF NOT EXISTS task_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                task_id TEXT NOT NULL,
+                event TEXT NOT NULL,
+                data TEXT,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_task_events_task
+                ON task_events (task_id, id);
+            CREATE TABLE IF NOT EXISTS workers (
+                worker_id TEXT PRIMARY KEY,
+                heartbeat_at REAL NOT NULL,
+                status TEXT
+            );
+            CREATE TABLE IF NOT EXISTS idempotency_keys (
+                key TEXT PRIMARY KEY,
+                task_id TEXT NOT NULL,
+                request_hash TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_idempotency_created
+                ON idempotency_keys (created_at);
+        """)
+        self._ensure_columns({
+            "priority": "INTEGER NOT NULL DEFAULT 0",
+            "client_id": "TEXT",
+            "units": "INTEGER NOT NULL DEFAULT 0",
+            "playable": "TEXT"
+        })
     
-    def create_task(self, task_id: str, task_type: str):
-        self.tasks[task_id] = {
-            "id": task_id,
-            "type": task_type,
-            "status": "pending",
-            "progress": 0,
-            "message": "Task created",
-            "result": None,
-            "created_at": datetime.now(),
-            "updated_at": datetime.now()
-        }
+    def _ensure_columns(self, columns: dict):
+        """Thêm cột mới vào jobs.db tạo bởi phiên bản cũ"""
+        existing = {row["name"] for row in self.conn.execute("PRAGMA table_info(tasks)")}
+        for name, definition in columns.items():
+            if name not in existing:
+                self.conn.execute(f"ALTER TABLE tasks ADD COLUMN {name} {definition}")
+    
+    def _execute(self, sql: str, params: tuple = ()):
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+    
+    def create_task(self, task_id: str, task_type: str, params: dict = None,
+                    priority: int = 0, client_id: str = None, units: int = 0,
+                    idempotency_key: str = None, request_hash: str = None) -> str:
+        """Tạo task; với idempotency_key đã gắn task còn sống thì trả về ID task đó.
+        
+        Kiểm tra key và tạo task trong cùng transaction, hai retry đồng thời
+        không thể tạo hai job.
+        """
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                if idempotency_key:
+                    existing = self._find_idempotent(idempotency_key, request_hash, now)
+                    if existing is not None:
+                        self.conn.execute("COMMIT")
+                        return existing
+                    self.conn.execute("""
+                        INSERT OR REPLACE INTO idempotency_keys (key, task_id, request_hash, created_at)
+                        VALUES (?, ?, ?, ?)
+                    """, (idempotency_key, task_id, request_hash, now))
+                self.conn.execute("""
+                    INSERT INTO tasks (id, type, status, progress, message, params, priority, client_id,
+                                       units, created_at, updated_at)
+                    VALUES (?, ?, 'pending', 0, 'Task created', ?, ?, ?, ?, ?, ?)
+                """, (task_id, task_type, json.dumps(params) if params is not None else None,
+                      priority, client_id, units, now, now))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
         return task_id
     
+    def find_idempotent(self, idempotency_key: str, request_hash: str) -> Optional[str]:
+        """ID task đã tạo với key này trong IDEMPOTENCY_TTL (None nếu chưa có/đã hết hạn)"""
+        with self.lock:
+            return self._find_idempotent(idempotency_key, request_hash, time.time())
+    
+    def _find_idempotent(self, idempotency_key: str, request_hash: str, now: float) -> Optional[str]:
+        # Key trỏ tới task đã bị xóa (clear_finished, xóa task) coi như hết hạn
+        row = self.conn.execute("""
+            SELECT k.task_id, k.request_hash FROM idempotency_keys k
+            JOIN tasks t ON t.id = k.task_id
+            WHERE k.key = ? AND k.created_at >= ?
+        """, (idempotency_key, now - TTSConfig.IDEMPOTENCY_TTL)).fetchone()
+        if row is None:
+            return None
+        if row["request_hash"] != request_hash:
+            raise IdempotencyConflictError(row["task_id"])
+        return row["task_id"]
+    
     def update_task(self, task_id: str, status: str = None, progress: int = None, 
-                   message: str = None, result: dict = None):
-        if task_id in self.tasks:
-            if status:
-                self.tasks[task_id]["status"] = status
-            if progress is not None:
-                self.tasks[task_id]["progress"] = progress
-            if message:
-                self.tasks[task_id]["message"] = message
-            if result:
-                self.tasks[task_id]["result"] = result
-            self.tasks[task_id]["updated_at"] = datetime.now()
+                   message: str = None, result: dict = None, playable: dict = None):
+        fields = []
+        values = []
+        if status:
+            fields.append("status = ?")
+            values.append(status)
+            if status in self.TERMINAL_STATES:
+                fields.append("lease_owner = NULL, lease_expires = NULL")
+        if progress is not None:
+            fields.append("progress = ?")
+            values.append(progress)
+        if message:
+            fields.append("message = ?")
+            values.append(message)
+        if result:
+            fields.append("result = ?")
+            values.append(json.dumps(result))
+        if playable is not None:
+            fields.append("playable = ?")
+            values.append(json.dumps(playable))
+        fields.append("updated_at = ?")
+        values.append(time.time())
+        # Task đã hủy không bị ghi đè bởi job vẫn đang kết thúc
+        self._execute(f"UPDATE tasks SET {', '.join(fields)} WHERE id = ? AND status != 'cancelled'",
+                      (*values, task_id))
     
     def get_task(self, task_id: str):
-        return self.tasks.get(task_id)
+        rows = self._execute("SELECT * FROM tasks WHERE id = ?", (task_id,))
+        return TaskRecord(rows[0]) if rows else None
+    
+    @staticmethod
+    def _compact(row, include_result: bool = False) -> dict:
+        record = {
+            "id": row["id"],
+            "status": row["status"],
+            "progress": row["progress"],
+            "message": row["message"],
+            "updated_at": row["updated_at"]
+        }
+        if row["playable"]:
+            record["playable"] = json.loads(row["playable"])
+        if include_result and row["result"]:
+            record["result"] = json.loads(row["result"])
+        return record
+    
+    def get_tasks(self, task_ids: List[str], include_result: bool = False) -> List[dict]:
+        """Trạng thái rút gọn của nhiều task trong một truy vấn"""
+        records = []
+        for start in range(0, len(task_ids), 500):
+            chunk = task_ids[start:start + 500]
+            rows = self._execute(f"""
+                SELECT id, status, progress, message, result, playable, updated_at FROM tasks
+                WHERE id IN ({', '.join('?' * len(chunk))})
+            """, tuple(chunk))
+            records.extend(self._compact(row, include_result) for row in rows)
+        return records
+    
+    def tasks_changed_since(self, updated_at: float, task_id: str = "", limit: int = 200,
+                            include_result: bool = False) -> List[dict]:
+        """Task thay đổi sau cursor (updated_at, id), theo thứ tự cursor"""
+        rows = self._execute("""
+            SELECT id, status, progress, message, result, playable, updated_at FROM tasks
+            WHERE (updated_at, id) > (?, ?)
+            ORDER BY updated_at, id LIMIT ?
+        """, (updated_at, task_id, limit))
+        return [self._compact(row, include_result) for row in rows]
+    
+    def claim_next(self, worker_id: str, lease_seconds: float = TTSConfig.JOB_LEASE_SECONDS,
+                   max_priority: int = None) -> Optional[dict]:
+        """Lấy job pending kế tiếp và gắn lease cho worker (atomic giữa các process).
+        
+        Thứ tự: lane ưu tiên, rồi client đang có ít job chạy nhất, rồi job cũ nhất.
+        """
+        now = time.time()
+        priority_filter = "AND t.priority <= ?" if max_priority is not None else ""
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(f"""
+                    SELECT t.id FROM tasks t
+                    WHERE t.status = 'pending' {priority_filter}
+                    ORDER BY t.priority,
+                             (SELECT COUNT(*) FROM tasks r
+                              WHERE r.status = 'running' AND r.client_id IS t.client_id),
+                             t.created_at
+                    LIMIT 1
+                """, (max_priority,) if max_priority is not None else ()).fetchone()
+                if row is None:
+                    self.conn.execute("COMMIT")
+                    return None
+                self.conn.execute("""
+                    UPDATE tasks
+                    SET status = 'running', attempts = attempts + 1, lease_owner = ?,
+                        lease_expires = ?, heartbeat_at = ?, updated_at = ?
+                    WHERE id = ?
+                """, (worker_id, now + lease_seconds, now, now, row["id"]))
+                task = self.conn.execute("SELECT * FROM tasks WHERE id = ?", (row["id"],)).fetchone()
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return TaskRecord(task)
+    
+    def add_event(self, task_id: str, event: str, data: dict):
+        self._execute("""
+            INSERT INTO task_events (task_id, event, data, created_at) VALUES (?, ?, ?, ?)
+        """, (task_id, event, json.dumps(data), time.time()))
+    
+    def get_events(self, task_id: str, after_id: int = 0) -> List[dict]:
+        rows = self._execute("""
+            SELECT id, event, data FROM task_events WHERE task_id = ? AND id > ? ORDER BY id
+        """, (task_id, after_id))
+        return [{"id": row["id"], "event": row["event"], "data": json.loads(row["data"])} for row in rows]
+    
+    def request_cancel(self, task_id: str) -> Optional[str]:
+        """Hủy job pending/running; trả về trạng thái trước đó (None nếu không có task)"""
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute("SELECT status FROM tasks WHERE id = ?", (task_id,)).fetchone()
+                if row and row["status"] in ("pending", "running"):
+                    self.conn.execute("""
+                        UPDATE tasks SET status = 'cancelled', message = 'Cancelling', updated_at = ?
+                        WHERE id = ?
+                    """, (time.time(), task_id))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return row["status"] if row else None
+    
+    def cancelled_jobs(self, worker_id: str) -> List[str]:
+        """Job của worker đã bị hủy nhưng còn giữ lease (chưa dừng xong)"""
+        rows = self._execute("""
+            SELECT id FROM tasks WHERE lease_owner = ? AND status = 'cancelled'
+        """, (worker_id,))
+        return [row["id"] for row in rows]
+    
+    def mark_cancelled(self, task_id: str):
+        """Worker đã dừng job bị hủy và dọn file"""
+        self._execute("""
+            UPDATE tasks SET lease_owner = NULL, lease_expires = NULL,
+                             message = 'Task cancelled', updated_at = ?
+            WHERE id = ? AND status = 'cancelled'
+        """, (time.time(), task_id))
+    
+    def heartbeat(self, task_id: str, worker_id: str,
+                  lease_seconds: float = TTSConfig.JOB_LEASE_SECONDS) -> bool:
+        """Gia hạn lease; False nếu worker không còn giữ job"""
+        now = time.time()
+        with self.lock:
+            cursor = self.conn.execute("""
+                UPDATE tasks SET lease_expires = ?, heartbeat_at = ?
+                WHERE id = ? AND lease_owner = ? AND status = 'running'
+            """, (now + lease_seconds, now, task_id, worker_id))
+            return cursor.rowcount > 0
+    
+    def release(self, task_id: str, worker_id: str):
+        """Trả job về hàng đợi khi worker dừng có kiểm soát (không tính là một lần thử)"""
+        self._execute("""
+            UPDATE tasks
+            SET status = 'pending', attempts = MAX(attempts - 1, 0), lease_owner = NULL,
+                lease_expires = NULL, message = 'Requeued after worker shutdown', updated_at = ?
+            WHERE id = ? AND lease_owner = ? AND status = 'running'
+        """, (time.time(), task_id, worker_id))
+    
+    def recover_expired_leases(self, max_attempts: int = TTSConfig.JOB_MAX_ATTEMPTS) -> int:
+        """Đưa job có lease hết hạn (worker chết) về pending, hoặc failed nếu đã thử quá nhiều"""
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                failed = self.conn.execute("""
+                    UPDATE tasks
+                    SET status = 'failed', lease_owner = NULL, lease_expires = NULL,
+                        message = 'Error: worker lost after ' || attempts || ' attempt(s)', updated_at = ?
+                    WHERE status = 'running' AND lease_expires < ? AND attempts >= ?
+                """, (now, now, max_attempts)).rowcount
+                requeued = self.conn.execute("""
+                    UPDATE tasks
+                    SET status = 'pending', lease_owner = NULL, lease_expires = NULL,
+                        message = 'Requeued after worker was lost', updated_at = ?
+                    WHERE status = 'running' AND lease_expires < ?
+                """, (now, now)).rowcount
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return failed + requeued
+    
+    def load(self, client_id: str = None) -> dict:
+        """Tải hiện tại cho admission control: job chờ, câu chưa xử lý, job của client"""
+        row = self._execute("""
+            SELECT COALESCE(SUM(status = 'pending'), 0) AS queued_jobs,
+                   COALESCE(SUM(units), 0) AS queued_sentences,
+                   COALESCE(SUM(client_id IS ?), 0) AS client_jobs
+            FROM tasks WHERE status IN ('pending', 'running')
+        """, (client_id,))[0]
+        return dict(row)
+    
+    def throughput(self, window: float = TTSConfig.ADMISSION_THROUGHPUT_WINDOW) -> float:
+        """Số câu hoàn thành mỗi giây trong khoảng window gần nhất"""
+        row = self._execute("""
+            SELECT COALESCE(SUM(units), 0) AS units FROM tasks
+            WHERE updated_at > ? AND status = 'completed'
+        """, (time.time() - window,))[0]
+        return row["units"] / window
+    
+    def queue_stats(self) -> dict:
+        """Số job pending/running theo lane"""
+        rows = self._execute("""
+            SELECT status, priority, COUNT(*) AS count FROM tasks
+            WHERE status IN ('pending', 'running') GROUP BY status, priority
+        """)
+        stats = {}
+        for row in rows:
+            lane = stats.setdefault(UpstreamLimiter.lane_name(row["priority"]), {"pending": 0, "running": 0})
+            lane[row["status"]] += row["count"]
+        return stats
+    
+    def record_worker_status(self, worker_id: str, status: dict):
+        self._execute("""
+            INSERT INTO workers (worker_id, heartbeat_at, status) VALUES (?, ?, ?)
+            ON CONFLICT(worker_id) DO UPDATE SET heartbeat_at = excluded.heartbeat_at,
+                                                 status = excluded.status
+        """, (worker_id, time.time(), json.dumps(status)))
+    
+    def remove_worker(self, worker_id: str):
+        self._execute("DELETE FROM workers WHERE worker_id = ?", (worker_id,))
+    
+    def worker_statuses(self, max_age: float = TTSConfig.JOB_LEASE_SECONDS) -> List[dict]:
+        """Trạng thái các worker còn heartbeat gần đây"""
+        rows = self._execute("""
+            SELECT * FROM workers WHERE heartbeat_at >= ? ORDER BY worker_id
+        """, (time.time() - max_age,))
+        return [
+            {
+                "worker_id": row["worker_id"],
+                "heartbeat_at": datetime.fromtimestamp(row["heartbeat_at"]).isoformat(),
+                **(json.loads(row["status"]) if row["status"] else {})
+            }
+            for row in rows
+        ]
     
     def cleanup_old_tasks(self, hours_old: int = 1):
-        """Cleanup tasks older than specified hours"""
-        cutoff_time = datetime.now() - timedelta(hours=hours_old)
-        to_delete = []
+        """Cleanup finished tasks older than specified hours"""
+        self.sweep_expired(hours_old * 3600, batch_size=None)
+    
+    def sweep_expired(self, ttl: float = TTSConfig.TASK_TTL, batch_size: Optional[int] = 500) -> int:
+        """Xóa task đã kết thúc trước now - ttl (theo updated_at: job chờ/chạy lâu vẫn được giữ
+        đủ ttl sau khi xong), theo index updated_at và theo lô.
+        
+        Task còn được Idempotency-Key chưa hết hạn trỏ tới được giữ lại (retry vẫn nhận task gốc).
+        """
+        cutoff_time = time.time() - ttl
+        idempotency_cutoff = time.time() - TTSConfig.IDEMPOTENCY_TTL
+        self._execute("DELETE FROM idempotency_keys WHERE created_at < ?", (idempotency_cutoff,))
+        states = ', '.join('?' * len(self.TERMINAL_STATES))
+        deleted = 0
+        while True:
+            limit = f"LIMIT {int(batch_size)}" if batch_size else ""
+            count = self._delete_tasks(f"""
+                id IN (SELECT id FROM tasks
+                       WHERE updated_at < ? AND status IN ({states})
+                         AND id NOT IN (SELECT task_id FROM idempotency_keys WHERE created_at >= ?)
+                       ORDER BY updated_at {limit})
+            """, (cutoff_time, *self.TERMINAL_STATES, idempotency_cutoff))
+            deleted += count
+            if not batch_size or count < batch_size:
+                break
+        # Worker đã dừng mà không kịp tự xóa
+        self._execute("DELETE FROM workers WHERE heartbeat_at < ?", (cutoff_time,))
+        return deleted
+    
+    def clear_finished(self):
+        """Xóa toàn bộ task đã kết thúc (job đang chờ/chạy được giữ lại)"""
+        self._delete_tasks(f"""
+            status IN ({', '.join('?' * len(self.TERMINAL_STATES))})
+        """, self.TERMINAL_STATES)
+    
+    def _delete_tasks(self, condition: str, params: tuple):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute(f"""
+                    DELETE FROM task_events WHERE task_id IN (SELECT id FROM tasks WHERE {condition})
+                """, params)
+                count = self.conn.execute(f"DELETE FROM tasks WHERE {condition}", params).rowcount
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return count
+
+# ==================== CIRCUIT BREAKER ====================
+class UpstreamUnavailableError(Exception):
+    """edge-tts đang lỗi (circuit breaker mở), chỉ phục vụ từ cache"""
+
+class CircuitBreaker:
+    """Circuit breaker cho upstream: closed -> open sau N lỗi liên tiếp -> half-open thăm dò"""
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    
+    def __init__(self, failure_threshold: int = TTSConfig.CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout: float = TTSConfig.CIRCUIT_RESET_TIMEOUT,
+                 half_open_probes: int = TTSConfig.CIRCUIT_HALF_OPEN_PROBES):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_probes = half_open_probes
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probes_in_flight = 0
+        self.total_rejected = 0
+    
+    def is_open(self) -> bool:
+        """True nếu request mới chắc chắn bị từ chối (fail fast, không cần chờ slot)"""
+        if self.state == self.OPEN:
+            return time.time() - self.opened_at < self.reset_timeout
+        if self.state == self.HALF_OPEN:
+            return self.probes_in_flight >= self.half_open_probes
+        return False
+    
+    def allow_request(self) -> bool:
+        if self.state == self.OPEN and time.time() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self.probes_in_flight = 0
         
-        for task_id, task_data in self.tasks.items():
-            if task_data["created_at"] < cutoff_time:
-                to_delete.append(task_id)
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.HALF_OPEN and self.probes_in_flight < self.half_open_probes:
+            self.probes_in_flight += 1
+            return True
+        
+        self.total_rejected += 1
+        return False
+    
+    def record_success(self):
+        if self.state == self.HALF_OPEN:
+            self.probes_in_flight = max(0, self.probes_in_flight - 1)
+            print("Upstream recovered, closing circuit breaker")
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+    
+    def release_probe(self):
+        """Request bị hủy giữa chừng: không tính là thành công hay lỗi"""
+        if self.state == self.HALF_OPEN:
+            self.probes_in_flight = max(0, self.probes_in_flight - 1)
+    
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN:
+            self.probes_in_flight = max(0, self.probes_in_flight - 1)
+            self._open()
+        elif self.state == self.CLOSED and self.consecutive_failures >= self.failure_threshold:
+            self._open()
+    
+    def _open(self):
+        if self.state != self.OPEN:
+            print(f"Upstream failing ({self.consecutive_failures} consecutive errors), opening circuit breaker")
+        self.state = self.OPEN
+        self.opened_at = time.time()
+    
+    def snapshot(self) -> dict:
+        retry_in = 0
+        if self.state == self.OPEN:
+            retry_in = max(0, round(self.reset_timeout - (time.time() - self.opened_at), 1))
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "retry_in_seconds": retry_in,
+            "rejected_requests": self.total_rejected
+        }
+
+# ==================== UPSTREAM LIMITER ====================
+class DeadlineExceededError(Exception):
+    """Câu chưa xong khi tới deadline của request (vẫn được tạo tiếp ở background)"""
+
+class UpstreamLimiter:
+    """Scheduler cho request tới edge-tts, cấp slot theo từng câu.
+    
+    Lane ưu tiên tuyệt đối (interactive > bulk > background, background không bao giờ
+    chiếm hết slot). Trong một lane, policy "fair" chia slot đều giữa các client bằng
+    start-time fair queuing nên câu của job ngắn xen kẽ với job dài; "fifo" theo thứ tự đến.
+    Câu của request có deadline_ms vào lane riêng trên interactive, theo deadline sớm nhất.
+    """
+    PRIORITY_DEADLINE = -1
+    PRIORITY_INTERACTIVE = 0
+    PRIORITY_BULK = 5
+    PRIORITY_BACKGROUND = 10
+    LANES = {
+        "interactive": PRIORITY_INTERACTIVE,
+        "bulk": PRIORITY_BULK,
+        "background": PRIORITY_BACKGROUND
+    }
+    POLICIES = ("fair", "fifo")
+    
+    def __init__(self, max_concurrent: int = TTSConfig.UPSTREAM_MAX_CONCURRENT,
+                 reserved_interactive: int = TTSConfig.UPSTREAM_RESERVED_INTERACTIVE,
+                 policy: str = TTSConfig.SCHEDULER_POLICY):
+        self.max_concurrent = max(1, max_concurrent)
+        # Background không bao giờ chiếm hết slot
+        self.max_background = max(1, self.max_concurrent - reserved_interactive)
+        self.policy = policy if policy in self.POLICIES else "fair"
+        self.active = 0
+        self.active_background = 0
+        self.waiters = []  # heap (priority, tag, seq, future, client_id, enqueued_at)
+        self.seq = 0
+        # Fair queuing: tag của câu vừa được cấp slot (theo lane) và tag cuối của mỗi client
+        self.virtual_time = {}
+        self.client_tags = {}
+        self.lane_stats = {}
+    
+    @classmethod
+    def lane_name(cls, priority: int) -> str:
+        if priority <= cls.PRIORITY_DEADLINE:
+            return "deadline"
+        for name, value in sorted(cls.LANES.items(), key=lambda item: -item[1]):
+            if priority >= value:
+                return name
+        return "interactive"
+    
+    def _tag(self, priority: int, client_id: Optional[str]) -> int:
+        if self.policy != "fair":
+            return 0
+        key = (priority, client_id or "anonymous")
+        tag = max(self.virtual_time.get(priority, 0), self.client_tags.get(key, 0)) + 1
+        self.client_tags[key] = tag
+        if len(self.client_tags) > 1000:
+            # Client đã tụt sau virtual time không cần nhớ tag nữa
+            self.client_tags = {k: t for k, t in self.client_tags.items()
+                                if t > self.virtual_time.get(k[0], 0)}
+        return tag
+    
+    def _can_grant(self, priority: int) -> bool:
+        if self.active >= self.max_concurrent:
+            return False
+        if priority >= self.PRIORITY_BACKGROUND:
+            return self.active_background < self.max_background
+        return True
+    
+    def _grant(self, priority: int, tag: int = 0, waited: float = 0.0):
+        self.active += 1
+        if priority >= self.PRIORITY_BACKGROUND:
+            self.active_background += 1
+        self.virtual_time[priority] = max(self.virtual_time.get(priority, 0), tag)
+        stats = self.lane_stats.setdefault(priority, {"active": 0, "granted": 0, "wait_total": 0.0})
+        stats["active"] += 1
+        stats["granted"] += 1
+        stats["wait_total"] += waited
+    
+    def _dispatch(self):
+        """Cấp slot cho các waiter theo thứ tự ưu tiên"""
+        deferred = []
+        while self.waiters and self.active < self.max_concurrent:
+            item = heapq.heappop(self.waiters)
+            priority, tag, _, future, _, enqueued_at = item
+            if future.done():
+                continue
+            if self._can_grant(priority):
+                self._grant(priority, tag, time.monotonic() - enqueued_at)
+                future.set_result(True)
+            else:
+                deferred.append(item)
+        for item in deferred:
+            heapq.heappush(self.waiters, item)
+    
+    async def acquire(self, priority: int = PRIORITY_INTERACTIVE, client_id: str = None,
+                      deadline: float = None) -> int:
+        """Chờ slot, trả về lane thực sự được cấp (truyền lại cho release).
+        
+        Với deadline (time.monotonic) câu chờ trong lane deadline theo EDF; tới deadline mà
+        vẫn chưa có slot thì bị bỏ khỏi lane đó và chờ tiếp ở background (chỉ để lấp cache).
+        """
+        if deadline is not None:
+            if await self._wait_for_slot(self.PRIORITY_DEADLINE, deadline, client_id,
+                                         timeout=deadline - time.monotonic()):
+                return self.PRIORITY_DEADLINE
+            priority = self.PRIORITY_BACKGROUND
+        await self._wait_for_slot(priority, self._tag(priority, client_id), client_id)
+        return priority
+    
+    async def _wait_for_slot(self, priority: int, tag, client_id: Optional[str],
+                             timeout: float = None) -> bool:
+        has_earlier_waiter = any(p <= priority and not f.done() for p, _, _, f, _, _ in self.waiters)
+        if not has_earlier_waiter and self._can_grant(priority):
+            self._grant(priority, tag)
+            return True
+        if timeout is not None and timeout <= 0:
+            return False
         
-        for task_id in to_delete:
-            del self.tasks[task_id]
+        future = asyncio.get_running_loop().create_future()
+        self.seq += 1
+        heapq.heappush(self.waiters, (priority, tag, self.seq, future, client_id, time.monotonic()))
+        try:
+            await asyncio.wait({future}, timeout=timeout)
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(priority)
+            future.cancel()
+            raise
+        if future.done():
+            return True
+        # Hết thời gian chờ: waiter bị bỏ qua khi dispatch
+        future.cancel()
+        return False
+    
+    def release(self, priority: int = PRIORITY_INTERACTIVE):
+        self.active -= 1
+        if priority >= self.PRIORITY_BACKGROUND:
+            self.active_background -= 1
+        self.lane_stats[priority]["active"] -= 1
+        self._dispatch()
+    
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_INTERACTIVE, client_id: str = None,
+                   deadline: float = None):
+        granted = await self.acquire(priority, client_id, deadline)
+        try:
+            yield
+        finally:
+            self.release(granted)
+    
+    def snapshot(self) -> dict:
+        lanes = {}
+        waiting_by_client = {}
+        for priority, _, _, future, client_id, _ in self.waiters:
+            if future.done():
+                continue
+            lane = lanes.setdefault(self.lane_name(priority), {"active": 0, "waiting": 0, "granted": 0})
+            lane["waiting"] += 1
+            client = client_id or "anonymous"
+            waiting_by_client[client] = waiting_by_client.get(client, 0) + 1
+        for priority, stats in self.lane_stats.items():
+            lane = lanes.setdefault(self.lane_name(priority), {"active": 0, "waiting": 0, "granted": 0})
+            lane["active"] += stats["active"]
+            lane["granted"] += stats["granted"]
+            lane["avg_wait_ms"] = round(stats["wait_total"] / stats["granted"] * 1000, 1) if stats["granted"] else 0.0
+        return {
+            "policy": self.policy,
+            "max_concurrent": self.max_concurrent,
+            "max_background": self.max_background,
+            "active": self.active,
+            "lanes": lanes,
+            "waiting_by_client": waiting_by_client
+        }
 
 # ==================== TEXT PROCESSOR ====================
 class TextProcessor:
+    DIGIT_WORDS = {
+        '0': 'zero', '1': 'one', '2': 'two', '3': 'three', '4': 'four',
+        '5': 'five', '6': 'six', '7': 'seven', '8': 'eight', '9': 'nine'
+    }
+    ONES_WORDS = ('', 'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine',
+                  'ten', 'eleven', 'twelve', 'thirteen', 'fourteen', 'fifteen', 'sixteen',
+                  'seventeen', 'eighteen', 'nineteen')
+    TENS_WORDS = ('', '', 'twenty', 'thirty', 'forty', 'fifty', 'sixty', 'seventy',
+                  'eighty', 'ninety')
+    SCALE_WORDS = ('', 'thousand', 'million', 'billion', 'trillion')
+    # Số lượng số/năm/giờ khác nhau được nhớ kết quả đọc
+    NUMBER_WORDS_CACHE_SIZE = 4096
+    
+    # Ký tự đại diện cho "có chữ số" trong tập trigger (mọi chữ số Unicode mà \d khớp)
+    DIGIT_TRIGGER = '0'
+    CURRENCY_SYMBOLS = '$€£¥₩₽'
+    OPERATOR_SYMBOLS = '+×*÷/=><'
+    
+    TEMPERATURE_UNITS = {
+        'C': 'degrees Celsius',
+        'F': 'degrees Fahrenheit',
+        'N': 'degrees north',
+        'S': 'degrees south',
+        'E': 'degrees east', 
+        'W': 'degrees west',
+        '': 'degrees'
+    }
+    
+    MEASUREMENT_UNITS = {
+        'km/h': 'kilometers per hour',
+        'mph': 'miles per hour',
+        'kg': 'kilograms',
+        'g': 'grams',
+        'cm': 'centimeters',
+        'm': 'meter',
+        'mm': 'millimeters',
+        'L': 'liter',
+        'l': 'liter',
+        'ml': 'milliliter',
+        'mL': 'milliliter',
+        'h': 'hour',
+        'min': 'minute',
+        's': 'second'
+    }
+    PLURAL_UNITS = {'L', 'l', 'mL', 'ml'}
+    
+    CURRENCY_NAMES = {
+        '$': 'dollars',
+        '€': 'euros',
+        '£': 'pounds',
+        '¥': 'yen',
+        '₩': 'won',
+        '₽': 'rubles'
+    }
+    
+    MATH_OPERATORS = {
+        '+': 'plus',
+        '-': 'minus',
+        '×': 'times',
+        '*': 'times',
+        '÷': 'divided by',
+        '/': 'divided by',
+        '=': 'equals',
+        '>': 'is greater than',
+        '<': 'is less than'
+    }
+    
+    SYMBOL_NAMES = {
+        '@': 'at',
+        '#': 'number',
+        '&': 'and',
+        '_': 'underscore'
+    }
+    
+    # Các lượt chuẩn hóa theo đúng thứ tự pipeline: (tên, pattern đã biên dịch, converter, triggers, probe).
+    # triggers là các nhóm ký tự mà văn bản phải có (mỗi nhóm ít nhất một ký tự) thì lượt đó mới có thể khớp;
+    # probe (nếu có) là pattern rẻ mà mọi match của lượt đều chứa, dùng để bỏ qua pattern đắt.
+    NORMALIZATION_RULES = (
+        ("email", re.compile(r'\b[\w.+-]+@[\w.-]+\.[a-zA-Z]{2,}\b'), "_convert_email", ('@', '.'), None),
+        ("website", re.compile(r'\b(?![\w.-]*@)((?:https?://)?(?:www\.)?[\w.-]+\.[a-z]{2,}(?:[/?=&#][\w.-]*)*)\b',
+                               re.IGNORECASE), "_convert_website", ('.',), re.compile(r'\.[a-z]{2}', re.IGNORECASE)),
+        ("phone", re.compile(r'\b(\d{3})[-. ]?(\d{3})[-. ]?(\d{4})\b'), "_convert_phone", (DIGIT_TRIGGER,), None),
+        ("temperature", re.compile(r'(-?(?<!\d)\d+)°([NSEWCFnsewcf]?)', re.IGNORECASE), "_convert_temperature", ('°',), None),
+        ("degree", re.compile(r'°'), "_convert_degree", ('°',), None),
+        ("measurement", re.compile(r'(-?(?<!\d)\d+(?:\.\d*)?)\s*({})s?\b'.format('|'.join(re.escape(key) for key in MEASUREMENT_UNITS)),
+                                   re.IGNORECASE), "_convert_measurement", (DIGIT_TRIGGER,), None),
+        ("currency", re.compile(r'([$€£¥₩₽])(\d+(?:\.\d+)?)(?=\s|$|\.|,|;)'), "_convert_currency",
+         (CURRENCY_SYMBOLS, DIGIT_TRIGGER), None),
+        ("percentage", re.compile(r'(?<!\d)(\d+(?:\.\d*)?)%'), "_convert_percentage", ('%', DIGIT_TRIGGER), None),
+        ("range", re.compile(r'(?<!\d)(\d+)\s*-\s*(\d+)(?!\s*[=+×*÷/><])'), "_convert_range", ('-', DIGIT_TRIGGER), None),
+        ("subtraction", re.compile(r'(?<!\d)(\d+)\s*-\s*(\d+)(?=\s*[=+×*÷/><])'), "_convert_subtraction",
+         ('-', OPERATOR_SYMBOLS, DIGIT_TRIGGER), None),
+        ("operation", re.compile(r'(?<!\d)(\d+)\s*([+×*÷/=><])\s*(\d+)'), "_convert_operation",
+         (OPERATOR_SYMBOLS, DIGIT_TRIGGER), None),
+        ("fraction", re.compile(r'(?<!\d)(\d+)/(\d+)'), "_convert_fraction", ('/', DIGIT_TRIGGER), None),
+        ("time", re.compile(r'\b(\d{1,2}):(\d{2})(?::(\d{2}))?\s*(AM|PM|am|pm)?\b'), "_convert_time",
+         (':', DIGIT_TRIGGER), None),
+        ("year", re.compile(r'\b(1[0-9]{3}|2[0-9]{3})\b'), "_convert_year", ('12',), None),
+        ("two_digit_year", re.compile(r'\b([0-9]{2})\b'), "_convert_two_digit_year", ('0123456789',), None),
+        ("mention", re.compile(r'@(\w+)'), "_convert_mention", ('@',), None),
+        ("hash_number", re.compile(r'#(\d+)'), "_convert_hash_number", ('#', DIGIT_TRIGGER), None),
+        ("symbol", re.compile(r'[@#&_]'), "_convert_symbol", ('@#&_',), None)
+    )
+    
+    # Lượt có pattern quay lui theo độ dài token (email/URL): chỉ chạy trên token không quá dài.
+    # Các lượt còn lại neo đầu dãy số nên mỗi lần thử khớp đã tuyến tính, chạy trên toàn văn bản.
+    TOKEN_BOUNDED_RULES = frozenset({"email", "website"})
+    RE_OVERLONG_TOKEN = re.compile(r'(?<!\S)(\S{%d,})' % (TTSConfig.NORMALIZE_MAX_TOKEN + 1))
+    
+    # Số (có thể có dấu phẩy hàng nghìn và phần thập phân) cho numbers_to_words
+    RE_NUMBER = re.compile(r'(?<!\d)\d+(?:,\d{3})*(?:\.\d+)?')
+    
+    # Tách câu: viết tắt kiểu "Mr." / "A." không kết thúc câu
+    RE_ABBREVIATION = re.compile(r'(?<!\w)([A-Z][a-z]*\.)(?=\s)')
+    RE_SENTENCE_SPLIT = re.compile(r'(?<=[.!?])\s+')
+    
+    # Dòng mở đầu một lượt hội thoại của job multi-voice / Q&A
+    RE_MULTI_VOICE_TURN = re.compile(r'^(CHAR\d+|NARRATOR):\s*(.+)', re.IGNORECASE)
+    RE_QA_TURN = re.compile(r'^(Q|A):\s*(.+)', re.IGNORECASE)
+    
+    RE_TAB = re.compile(r'[\r\t]')
+    RE_SPACES = re.compile(r' +')
+    RE_PUNCTUATION = re.compile(r'(\s)([,.!?])')
+    
     @staticmethod
     def clean_text(text: str) -> str:
         text = TextProcessor._process_special_cases(text)
         
-        re_tab = re.compile(r'[\r\t]')
-        re_spaces = re.compile(r' +')
-        re_punctuation = re.compile(r'(\s)([,.!?])')
-        
-        text = re_tab.sub(' ', text)
-        text = re_spaces.sub(' ', text)
-        text = re_punctuation.sub(r'\2', text)
+        text = TextProcessor.RE_TAB.sub(' ', text)
+        text = TextProcessor.RE_SPACES.sub(' ', text)
+        text = TextProcessor.RE_PUNCTUATION.sub(r'\2', text)
         return text.strip()
 
     @staticmethod
     def _process_special_cases(text: str) -> str:
-        """Pipeline xử lý đặc biệt với thứ tự tối ưu"""
-        text = TextProcessor._process_emails(text)
-        text = TextProcessor._process_websites(text)
-        text = TextProcessor._process_phone_numbers(text)
-        text = TextProcessor._process_temperatures(text)
-        text = TextProcessor._process_measurements(text)
-        text = TextProcessor._process_currency(text)
-        text = TextProcessor._process_percentages(text)
-        text = TextProcessor._process_math_operations(text)
-        text = TextProcessor._process_times(text)
-        text = TextProcessor._process_years(text)
-        text = TextProcessor._process_special_symbols(text)
-        
+        """Chuẩn hóa email, URL, số, đơn vị, ký hiệu... bằng các lượt đã biên dịch sẵn"""
+        parts = TextProcessor.RE_OVERLONG_TOKEN.split(text)
+        if len(parts) == 1:
+            return TextProcessor._apply_rules(text, TextProcessor._compiled_rules())
+        # email/website đứng đầu pipeline: chạy trên từng đoạn, bỏ qua token quá dài (phần tử lẻ),
+        # rồi chạy các lượt còn lại trên văn bản đã ghép lại
+        bounded = TextProcessor._compiled_rules(True)
+        text = ''.join(part if index % 2 else TextProcessor._apply_rules(part, bounded)
+                       for index, part in enumerate(parts))
+        return TextProcessor._apply_rules(text, TextProcessor._compiled_rules(False))
+    
+    @staticmethod
+    def _apply_rules(text: str, rules: tuple) -> str:
+        present = TextProcessor._trigger_chars(text)
+        for pattern, converter, triggers, probe in rules:
+            # Bỏ qua lượt không thể khớp: văn bản thiếu một nhóm ký tự kích hoạt của nó
+            if any(present.isdisjoint(group) for group in triggers):
+                continue
+            if probe is not None and not probe.search(text):
+                continue
+            text = pattern.sub(converter, text)
         return text
     
     @staticmethod
-    def _process_emails(text: str) -> str:
+    def _trigger_chars(text: str) -> set:
+        """Tập ký tự của văn bản, quét một lần.
+        
+        Các converter chỉ sinh chữ, khoảng trắng và dấu câu (hoặc trả lại chính phần đã khớp),
+        nên tập này đủ để quyết định lượt nào có thể khớp trong suốt pipeline.
+        """
+        present = set(text)
+        if TextProcessor.DIGIT_TRIGGER not in present and any(c.isdecimal() for c in present):
+            present.add(TextProcessor.DIGIT_TRIGGER)
+        return present
+    
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def _compiled_rules(token_bounded: Optional[bool] = None):
+        """(pattern, converter, triggers, probe) theo thứ tự pipeline, tra converter một lần cho cả tiến trình.
+        
+        token_bounded=True/False chỉ lấy các lượt trong/ngoài TOKEN_BOUNDED_RULES.
+        """
+        return tuple((pattern, getattr(TextProcessor, converter), triggers, probe)
+                     for name, pattern, converter, triggers, probe in TextProcessor.NORMALIZATION_RULES
+                     if token_bounded is None or (name in TextProcessor.TOKEN_BOUNDED_RULES) == token_bounded)
+    
+    @staticmethod
+    def _convert_email(match) -> str:
         """Process emails with correct English pronunciation"""
-        def convert_email(match):
-            full_email = match.group(0)
-            processed = (full_email
-                        .replace('@', ' at ')
-                        .replace('.', ' dot ')
-                        .replace('-', ' dash ')
-                        .replace('_', ' underscore ')
-                        .replace('+', ' plus ')
-                        .replace('/', ' slash ')
-                        .replace('=', ' equals '))
-            return processed
-
-        email_pattern = r'\b[\w.+-]+@[\w.-]+\.[a-zA-Z]{2,}\b'
-        return re.sub(email_pattern, convert_email, text)
+        return (match.group(0)
+                .replace('@', ' at ')
+                .replace('.', ' dot ')
+                .replace('-', ' dash ')
+                .replace('_', ' underscore ')
+                .replace('+', ' plus ')
+                .replace('/', ' slash ')
+                .replace('=', ' equals '))
 
     @staticmethod
-    def _process_websites(text: str) -> str:
+    def _convert_website(match) -> str:
         """Process websites with correct English pronunciation"""
-        def convert_website(match):
-            url = match.group(1)
-            return (url.replace('.', ' dot ')
-                     .replace('-', ' dash ')
-                     .replace('_', ' underscore ')
-                     .replace('/', ' slash ')
-                     .replace('?', ' question mark ')
-                     .replace('=', ' equals ')
-                     .replace('&', ' ampersand '))
-
-        website_pattern = r'\b(?![\w.-]*@)((?:https?://)?(?:www\.)?[\w.-]+\.[a-z]{2,}(?:[/?=&#][\w.-]*)*)\b'
-        return re.sub(website_pattern, convert_website, text, flags=re.IGNORECASE)
+        return (match.group(1).replace('.', ' dot ')
+                 .replace('-', ' dash ')
+                 .replace('_', ' underscore ')
+                 .replace('/', ' slash ')
+                 .replace('?', ' question mark ')
+                 .replace('=', ' equals ')
+                 .replace('&', ' ampersand '))
 
     @staticmethod
-    def _process_temperatures(text: str) -> str:
-        """Process temperatures and cardinal directions"""
-        def temp_to_words(temp, unit):
-            temp_text = TextProcessor._number_to_words(temp)
-            unit = unit.upper() if unit else ''
-            
-            unit_map = {
-                'C': 'degrees Celsius',
-                'F': 'degrees Fahrenheit',
-                'N': 'degrees north',
-                'S': 'degrees south',
-                'E': 'degrees east', 
-                'W': 'degrees west',
-                '': 'degrees'
-            }
-            unit_text = unit_map.get(unit, f'degrees {unit}')
-            
-            return f"{temp_text} {unit_text}"
-        
-        text = re.sub(
-            r'(-?\d+)°([NSEWCFnsewcf]?)',
-            lambda m: temp_to_words(m.group(1), m.group(2)),
-            text,
-            flags=re.IGNORECASE
-        )
-        
-        text = re.sub(r'°', ' degrees ', text)
-        return text
+    def _convert_phone(match) -> str:
+        """Đọc số điện thoại từng chữ số"""
+        return ', '.join(' '.join(TextProcessor._digit_to_word(d) for d in part) for part in match.groups())
 
     @staticmethod
-    def _process_measurements(text: str) -> str:
-        """Xử lý đơn vị đo lường"""
-        units_map = {
-            'km/h': 'kilometers per hour',
-            'mph': 'miles per hour',
-            'kg': 'kilograms',
-            'g': 'grams',
-            'cm': 'centimeters',
-            'm': 'meter',
-            'mm': 'millimeters',
-            'L': 'liter',
-            'l': 'liter',
-            'ml': 'milliliter',
-            'mL': 'milliliter',
-            'h': 'hour',
-            'min': 'minute',
-            's': 'second'
-        }
-    
-        plural_units = {'L', 'l', 'mL', 'ml'}
-    
-        def measurement_to_words(value, unit):
-            try:
-                unit_lower = unit.lower()
-                unit_text = units_map.get(unit, units_map.get(unit_lower, unit))
-    
-                if '.' in value:
-                    integer, decimal = value.split('.')
-                    value_text = (
-                        f"{TextProcessor._number_to_words(integer)} "
-                        f"point {' '.join(TextProcessor._digit_to_word(d) for d in decimal)}"
-                    )
-                else:
-                    value_text = TextProcessor._number_to_words(value)
-    
-                if float(value) != 1 and unit in units_map and unit not in plural_units:
-                    unit_text += 's'
-    
-                return f"{value_text} {unit_text}"
-            except:
-                return f"{value}{unit}"
-    
-        text = re.sub(
-            r'(-?\d+\.?\d*)\s*({})s?\b'.format('|'.join(re.escape(key) for key in units_map.keys())),
-            lambda m: measurement_to_words(m.group(1), m.group(2)),
-            text,
-            flags=re.IGNORECASE
-        )
-        return text
-    
+    def _convert_temperature(match) -> str:
+        """Nhiệt độ và hướng (độ bắc/nam/đông/tây)"""
+        temp, unit = match.groups()
+        temp_text = TextProcessor._number_to_words(temp)
+        unit = unit.upper() if unit else ''
+        unit_text = TextProcessor.TEMPERATURE_UNITS.get(unit, f'degrees {unit}')
+        return f"{temp_text} {unit_text}"
+
     @staticmethod
-    def _process_currency(text: str) -> str:
-        """Xử lý tiền tệ"""
-        currency_map = {
-            '$': 'dollars',
-            '€': 'euros',
-            '£': 'pounds',
-            '¥': 'yen',
-            '₩': 'won',
-            '₽': 'rubles'
-        }
-    
-        def currency_to_words(value, symbol):
-            if value.endswith('.'):
-                value = value[:-1]
-                return f"{TextProcessor._number_to_words(value)} {currency_map.get(symbol, '')}."
-    
+    def _convert_degree(match) -> str:
+        return ' degrees '
+
+    @staticmethod
+    def _convert_measurement(match) -> str:
+        """Xử lý đơn vị đo lường"""
+        value, unit = match.groups()
+        units_map = TextProcessor.MEASUREMENT_UNITS
+        try:
+            unit_lower = unit.lower()
+            unit_text = units_map.get(unit, units_map.get(unit_lower, unit))
+
             if '.' in value:
-                integer_part, decimal_part = value.split('.')
-                decimal_part = decimal_part.ljust(2, '0')
-                return (
-                    f"{TextProcessor._number_to_words(integer_part)} {currency_map.get(symbol, '')} "
-                    f"and {TextProcessor._number_to_words(decimal_part)} cents"
+                integer, decimal = value.split('.')
+                value_text = (
+                    f"{TextProcessor._number_to_words(integer)} "
+                    f"point {' '.join(TextProcessor._digit_to_word(d) for d in decimal)}"
                 )
-    
-            return f"{TextProcessor._number_to_words(value)} {currency_map.get(symbol, '')}"
-    
-        text = re.sub(
-            r'([$€£¥₩₽])(\d+(?:\.\d+)?)(?=\s|$|\.|,|;)',
-            lambda m: currency_to_words(m.group(2), m.group(1)),
-            text
-        )
-    
-        return text
+            else:
+                value_text = TextProcessor._number_to_words(value)
+
+            if float(value) != 1 and unit in units_map and unit not in TextProcessor.PLURAL_UNITS:
+                unit_text += 's'
+
+            return f"{value_text} {unit_text}"
+        except:
+            return f"{value}{unit}"
 
     @staticmethod
-    def _process_percentages(text: str) -> str:
-        """Xử lý phần trăm"""
-        text = re.sub(
-            r'(\d+\.?\d*)%',
-            lambda m: f"{TextProcessor._number_to_words(m.group(1))} percent",
-            text
-        )
-        return text
+    def _convert_currency(match) -> str:
+        """Xử lý tiền tệ"""
+        symbol, value = match.groups()
+        currency = TextProcessor.CURRENCY_NAMES.get(symbol, '')
+        if value.endswith('.'):
+            value = value[:-1]
+            return f"{TextProcessor._number_to_words(value)} {currency}."
+
+        if '.' in value:
+            integer_part, decimal_part = value.split('.')
+            decimal_part = decimal_part.ljust(2, '0')
+            return (
+                f"{TextProcessor._number_to_words(integer_part)} {currency} "
+                f"and {TextProcessor._number_to_words(decimal_part)} cents"
+            )
+
+        return f"{TextProcessor._number_to_words(value)} {currency}"
 
     @staticmethod
-    def _process_math_operations(text: str) -> str:
-        """Xử lý các phép toán và khoảng số"""
-        math_map = {
-            '+': 'plus',
-            '-': 'minus',
-            '×': 'times',
-            '*': 'times',
-            '÷': 'divided by',
-            '/': 'divided by',
-            '=': 'equals',
-            '>': 'is greater than',
-            '<': 'is less than'
-        }
-    
-        text = re.sub(
-            r'(\d+)\s*-\s*(\d+)(?!\s*[=+×*÷/><])',
-            lambda m: f"{TextProcessor._number_to_words(m.group(1))} to {TextProcessor._number_to_words(m.group(2))}",
-            text
-        )
-    
-        text = re.sub(
-            r'(\d+)\s*-\s*(\d+)(?=\s*[=+×*÷/><])',
-            lambda m: f"{TextProcessor._number_to_words(m.group(1))} minus {TextProcessor._number_to_words(m.group(2))}",
-            text
-        )
-    
-        text = re.sub(
-            r'(\d+)\s*([+×*÷/=><])\s*(\d+)',
-            lambda m: (f"{TextProcessor._number_to_words(m.group(1))} "
-                      f"{math_map.get(m.group(2), m.group(2))} "
-                      f"{TextProcessor._number_to_words(m.group(3))}"),
-            text
-        )
-    
-        text = re.sub(
-            r'(\d+)/(\d+)',
-            lambda m: (f"{TextProcessor._number_to_words(m.group(1))} "
-                      f"divided by {TextProcessor._number_to_words(m.group(2))}"),
-            text
-        )
-    
-        return text
+    def _convert_percentage(match) -> str:
+        return f"{TextProcessor._number_to_words(match.group(1))} percent"
 
     @staticmethod
-    def _process_special_symbols(text: str) -> str:
-        """Xử lý các ký hiệu đặc biệt"""
-        symbol_map = {
-            '@': 'at',
-            '#': 'number',
-            '&': 'and',
-            '_': 'underscore'
-        }
+    def _convert_range(match) -> str:
+        start, end = match.groups()
+        return f"{TextProcessor._number_to_words(start)} to {TextProcessor._number_to_words(end)}"
 
-        text = re.sub(
-            r'@(\w+)',
-            lambda m: f"at {m.group(1)}",
-            text
-        )
+    @staticmethod
+    def _convert_subtraction(match) -> str:
+        left, right = match.groups()
+        return f"{TextProcessor._number_to_words(left)} minus {TextProcessor._number_to_words(right)}"
 
-        text = re.sub(
-            r'#(\d+)',
-            lambda m: f"number {TextProcessor._number_to_words(m.group(1))}",
-            text
-        )
+    @staticmethod
+    def _convert_operation(match) -> str:
+        left, operator, right = match.groups()
+        return (f"{TextProcessor._number_to_words(left)} "
+                f"{TextProcessor.MATH_OPERATORS.get(operator, operator)} "
+                f"{TextProcessor._number_to_words(right)}")
 
-        for symbol, replacement in symbol_map.items():
-            text = text.replace(symbol, f' {replacement} ')
+    @staticmethod
+    def _convert_fraction(match) -> str:
+        numerator, denominator = match.groups()
+        return (f"{TextProcessor._number_to_words(numerator)} "
+                f"divided by {TextProcessor._number_to_words(denominator)}")
 
-        return text
+    @staticmethod
+    def _convert_time(match) -> str:
+        return TextProcessor._time_to_words(*match.groups())
 
     @staticmethod
-    def _process_times(text: str) -> str:
-        """Xử lý thời gian"""
-        text = re.sub(
-            r'\b(\d{1,2}):(\d{2})(?::(\d{2}))?\s*(AM|PM|am|pm)?\b',
-            lambda m: TextProcessor._time_to_words(m.group(1), m.group(2), m.group(3), m.group(4)),
-            text
-        )
-        return text
+    def _convert_year(match) -> str:
+        return TextProcessor._year_to_words(match.group(1))
+
+    @staticmethod
+    def _convert_two_digit_year(match) -> str:
+        return TextProcessor._two_digit_year_to_words(match.group(1))
+
+    @staticmethod
+    def _convert_mention(match) -> str:
+        return f"at {match.group(1)}"
+
+    @staticmethod
+    def _convert_hash_number(match) -> str:
+        return f"number {TextProcessor._number_to_words(match.group(1))}"
+
+    @staticmethod
+    def _convert_symbol(match) -> str:
+        return f' {TextProcessor.SYMBOL_NAMES[match.group(0)]} '
     
     @staticmethod
+    @functools.lru_cache(maxsize=NUMBER_WORDS_CACHE_SIZE)
     def _time_to_words(hour: str, minute: str, second: str = None, period: str = None) -> str:
         hour_int = int(hour)
         minute_int = int(minute)
@@ -854,23 +1716,7 @@ class TextProcessor:
             return f"{hour_text} {minute_text}{second_text}{period_text}"
 
     @staticmethod
-    def _process_years(text: str) -> str:
-        """Xử lý các năm"""
-        text = re.sub(
-            r'\b(1[0-9]{3}|2[0-9]{3})\b',
-            lambda m: TextProcessor._year_to_words(m.group(1)),
-            text
-        )
-    
-        text = re.sub(
-            r'\b([0-9]{2})\b',
-            lambda m: TextProcessor._two_digit_year_to_words(m.group(1)),
-            text
-        )
-    
-        return text
-
-    @staticmethod
+    @functools.lru_cache(maxsize=NUMBER_WORDS_CACHE_SIZE)
     def _year_to_words(year: str) -> str:
         if len(year) != 4:
             return year
@@ -890,45 +1736,14 @@ class TextProcessor:
             return "zero zero"
         if num_int < 10:
             return f"oh {TextProcessor._digit_to_word(num[1])}"
-    
-        ones = ['', 'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine',
-                'ten', 'eleven', 'twelve', 'thirteen', 'fourteen', 'fifteen', 'sixteen',
-                'seventeen', 'eighteen', 'nineteen']
-        tens = ['', '', 'twenty', 'thirty', 'forty', 'fifty', 'sixty', 'seventy', 
-               'eighty', 'ninety']
-    
-        if num_int < 20:
-            return ones[num_int]
-    
-        ten, one = divmod(num_int, 10)
-        if one == 0:
-            return tens[ten]
-        return f"{tens[ten]} {ones[one]}"        
-
-    @staticmethod
-    def _process_phone_numbers(text: str) -> str:
-        """Xử lý số điện thoại"""
-        phone_pattern = r'\b(\d{3})[-. ]?(\d{3})[-. ]?(\d{4})\b'
-    
-        def phone_to_words(match):
-            groups = match.groups()
-            parts = []
-            for part in groups:
-                digits = ' '.join([TextProcessor._digit_to_word(d) for d in part])
-                parts.append(digits)
-            return ', '.join(parts)
-    
-        return re.sub(phone_pattern, phone_to_words, text)
+        return TextProcessor._words_below_thousand()[num_int]
 
     @staticmethod
     def _digit_to_word(digit: str) -> str:
-        digit_map = {
-            '0': 'zero', '1': 'one', '2': 'two', '3': 'three', '4': 'four',
-            '5': 'five', '6': 'six', '7': 'seven', '8': 'eight', '9': 'nine'
-        }
-        return digit_map.get(digit, digit)
+        return TextProcessor.DIGIT_WORDS.get(digit, digit)
 
     @staticmethod
+    @functools.lru_cache(maxsize=NUMBER_WORDS_CACHE_SIZE)
     def _number_to_words(number: str) -> str:
         num_str = number.replace(',', '')
     
@@ -948,59 +1763,97 @@ class TextProcessor:
         if num == 0:
             return 'zero'
         
-        units = ['', 'thousand', 'million', 'billion', 'trillion']
+        below_thousand = TextProcessor._words_below_thousand()
         words = []
         level = 0
         
         while num > 0:
-            chunk = num % 1000
+            num, chunk = divmod(num, 1000)
             if chunk != 0:
-                words.append(TextProcessor._convert_less_than_thousand(chunk) + ' ' + units[level])
-            num = num // 1000
+                words.append(below_thousand[chunk] + ' ' + TextProcessor.SCALE_WORDS[level])
             level += 1
         
         return ' '.join(reversed(words)).strip()
 
     @staticmethod
-    def _convert_less_than_thousand(num: int) -> str:
-        ones = ['', 'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine',
-                'ten', 'eleven', 'twelve', 'thirteen', 'fourteen', 'fifteen', 'sixteen',
-                'seventeen', 'eighteen', 'nineteen']
-        tens = ['', '', 'twenty', 'thirty', 'forty', 'fifty', 'sixty', 'seventy', 
-               'eighty', 'ninety']
+    @functools.lru_cache(maxsize=None)
+    def _words_below_thousand() -> Tuple[str, ...]:
+        """Bảng chữ cho 0-999 (0 -> ''), dựng một lần cho cả tiến trình"""
+        ones, tens = TextProcessor.ONES_WORDS, TextProcessor.TENS_WORDS
+        words = []
+        for num in range(1000):
+            if num < 20:
+                words.append(ones[num])
+            elif num < 100:
+                words.append(tens[num // 10] + (' ' + ones[num % 10] if num % 10 != 0 else ''))
+            else:
+                words.append(ones[num // 100] + ' hundred' + (' ' + words[num % 100] if num % 100 != 0 else ''))
+        return tuple(words)
+    
+    @staticmethod
+    def numbers_to_words(text: str) -> str:
+        """Đọc mọi số trong văn bản bằng chữ trong một lượt quét.
         
-        if num == 0:
-            return ''
-        if num < 20:
-            return ones[num]
-        if num < 100:
-            return tens[num // 10] + (' ' + ones[num % 10] if num % 10 != 0 else '')
-        return ones[num // 100] + ' hundred' + (' ' + TextProcessor._convert_less_than_thousand(num % 100) if num % 100 != 0 else '')
+        Dùng cho tài liệu nhiều số (bảng giá, lịch trình): mỗi số khác nhau chỉ được chuyển đổi
+        một lần nhờ memo của _number_to_words.
+        """
+        return TextProcessor.RE_NUMBER.sub(lambda m: TextProcessor._number_to_words(m.group(0)), text)
 
     @staticmethod
-    def split_sentences(text: str) -> List[str]:
-        re_special_cases = re.compile(r'(?<!\w)([A-Z][a-z]*\.)(?=\s)')
-        re_sentence_split = re.compile(r'(?<=[.!?])\s+')
-        
-        sentences = []
-        for line in text.split('\n'):
+    def iter_lines(source) -> Iterator[str]:
+        """Từng dòng của text (str) hoặc file-like (text/binary), đọc dần không nạp cả nội dung"""
+        if isinstance(source, str):
+            start = 0
+            while True:
+                end = source.find('\n', start)
+                if end < 0:
+                    yield source[start:]
+                    return
+                yield source[start:end]
+                start = end + 1
+        for line in source:
+            if isinstance(line, bytes):
+                line = line.decode("utf-8", errors="ignore")
+            yield line.rstrip('\n')
+
+    @staticmethod
+    def iter_sentences(source) -> Iterator[str]:
+        """Tách câu lazily: caller chỉ cần N câu đầu thì phần còn lại không bị đọc/tách"""
+        for line in TextProcessor.iter_lines(source):
             stripped = line.strip()
-            if stripped:
-                stripped = re_special_cases.sub(r'\1Ⓝ', stripped)
-                parts = re_sentence_split.split(stripped)
-                for part in parts:
-                    part = part.replace('Ⓝ', '')
-                    if part:
-                        sentences.append(part)
-        return sentences
+            if not stripped:
+                continue
+            stripped = TextProcessor.RE_ABBREVIATION.sub(r'\1Ⓝ', stripped)
+            start = 0
+            for match in TextProcessor.RE_SENTENCE_SPLIT.finditer(stripped):
+                part = stripped[start:match.start()].replace('Ⓝ', '')
+                if part:
+                    yield part
+                start = match.end()
+            part = stripped[start:].replace('Ⓝ', '')
+            if part:
+                yield part
 
     @staticmethod
-    def parse_dialogues(text: str, prefixes: List[str]) -> List[Tuple[str, str]]:
-        """Phân tích nội dung hội thoại với các prefix chỉ định"""
-        dialogues = []
+    def iter_unique_sentences(source) -> Iterator[str]:
+        """Như iter_sentences nhưng bỏ câu trùng; chỉ nhớ digest của câu đã gặp"""
+        seen = set()
+        for sentence in TextProcessor.iter_sentences(source):
+            digest = hashlib.blake2b(sentence.encode("utf-8"), digest_size=16).digest()
+            if digest not in seen:
+                seen.add(digest)
+                yield sentence
+
+    @staticmethod
+    def split_sentences(text: str) -> List[str]:
+        return list(TextProcessor.iter_sentences(text))
+
+    @staticmethod
+    def iter_dialogues(source, prefixes: List[str]) -> Iterator[Tuple[str, str]]:
+        """Từng lượt hội thoại (đã chuẩn hóa) ngay khi gặp prefix của lượt tiếp theo"""
         current = None
         
-        for line in text.split('\n'):
+        for line in TextProcessor.iter_lines(source):
             line = line.strip()
             if not line:
                 continue
@@ -1013,89 +1866,874 @@ class TextProcessor:
                     
             if found_prefix:
                 if current:
-                    processed_content = TextProcessor._process_special_cases(current[1])
-                    dialogues.append((current[0], processed_content))
+                    yield current[0], TextProcessor._process_special_cases(' '.join(current[1]))
                 
                 speaker = found_prefix
                 content = line[len(found_prefix)+1:].strip()
-                current = (speaker, content)
+                current = (speaker, [content])
             elif current:
-                current = (current[0], current[1] + ' ' + line)
+                current[1].append(line)
                 
         if current:
-            processed_content = TextProcessor._process_special_cases(current[1])
-            dialogues.append((current[0], processed_content))
-            
-        return dialogues
+            yield current[0], TextProcessor._process_special_cases(' '.join(current[1]))
 
-# ==================== AUDIO CACHE MANAGER ====================
-class AudioCacheManager:
-    def __init__(self):
-        self.cache_dir = "audio_cache"
-        self.max_cache_size = 50  # Giảm cache size cho Render
-        os.makedirs(self.cache_dir, exist_ok=True)
+    @staticmethod
+    def parse_dialogues(text: str, prefixes: List[str]) -> List[Tuple[str, str]]:
+        """Phân tích nội dung hội thoại với các prefix chỉ định"""
+        return list(TextProcessor.iter_dialogues(text, prefixes))
+
+# ==================== CACHE INDEX ====================
+class CacheIndex:
+    """Index SQLite (WAL) lưu metadata và thống kê hit/miss của audio cache"""
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                key TEXT PRIMARY KEY,
+                voice TEXT,
+                text_preview TEXT,
+                size INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                hit_count INTEGER NOT NULL DEFAULT 0,
+                ttl_class TEXT NOT NULL DEFAULT 'default'
+            );
+            CREATE INDEX IF NOT EXISTS idx_cache_entries_last_access
+                ON cache_entries (last_access);
+            CREATE TABLE IF NOT EXISTS phrase_units (
+                settings_key TEXT NOT NULL,
+                cache_key TEXT NOT NULL,
+                head TEXT NOT NULL,
+                words TEXT NOT NULL,
+                PRIMARY KEY (settings_key, cache_key)
+            );
+            CREATE INDEX IF NOT EXISTS idx_phrase_units_head
+                ON phrase_units (settings_key, head);
+            CREATE TABLE IF NOT EXISTS cache_counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL DEFAULT 0
+            );
+        """)
     
-    def get_cache_key(self, text: str, voice_id: str, rate: int, pitch: int, volume: int) -> str:
-        """Tạo cache key từ các tham số"""
-        import hashlib
-        key_string = f"{text}_{voice_id}_{rate}_{pitch}_{volume}"
-        return hashlib.md5(key_string.encode()).hexdigest()[:12]  # Giới hạn độ dài
+    def _execute(self, sql: str, params: tuple = ()):
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
     
-    def get_cached_audio(self, cache_key: str) -> Optional[str]:
-        """Lấy file audio từ cache nếu tồn tại"""
-        cache_file = os.path.join(self.cache_dir, f"{cache_key}.mp3")
-        if os.path.exists(cache_file):
-            # Kiểm tra thời gian cache (không quá 1 ngày)
-            file_age = time.time() - os.path.getmtime(cache_file)
-            if file_age < 86400:  # 24 giờ
-                return cache_file
-        return None
+    def get_entry(self, key: str) -> Optional[dict]:
+        rows = self._execute("SELECT * FROM cache_entries WHERE key = ?", (key,))
+        return dict(rows[0]) if rows else None
     
-    def save_to_cache(self, cache_key: str, audio_file: str):
-        """Lưu audio vào cache"""
-        try:
-            # Giới hạn số file trong cache
-            cache_files = os.listdir(self.cache_dir)
-            if len(cache_files) >= self.max_cache_size:
-                # Xóa file cũ nhất
-                oldest_file = min(
-                    [os.path.join(self.cache_dir, f) for f in cache_files],
-                    key=os.path.getmtime
-                )
-                try:
-                    os.remove(oldest_file)
-                except:
-                    pass
+    def record_insert(self, key: str, voice: str = None, size: int = 0,
+                      ttl_class: str = "default", text: str = None, created_at: float = None):
+        now = time.time()
+        created_at = created_at or now
+        preview = text[:80] if text else None
+        self._execute("""
+            INSERT INTO cache_entries (key, voice, text_preview, size, created_at, last_access, hit_count, ttl_class)
+            VALUES (?, ?, ?, ?, ?, ?, 0, ?)
+            ON CONFLICT(key) DO UPDATE SET
+                voice = COALESCE(excluded.voice, voice),
+                text_preview = COALESCE(excluded.text_preview, text_preview),
+                size = excluded.size,
+                created_at = excluded.created_at,
+                last_access = excluded.last_access,
+                ttl_class = CASE WHEN ttl_class = 'pinned' THEN ttl_class ELSE excluded.ttl_class END
+        """, (key, voice, preview, size, created_at, now, ttl_class))
+    
+    def record_hit(self, key: str):
+        with self.lock:
+            self.conn.execute("BEGIN")
+            self.conn.execute(
+                "UPDATE cache_entries SET hit_count = hit_count + 1, last_access = ? WHERE key = ?",
+                (time.time(), key)
+            )
+            self._bump_counter("hits")
+            self.conn.execute("COMMIT")
+    
+    def record_miss(self):
+        with self.lock:
+            self._bump_counter("misses")
+    
+    def _bump_counter(self, name: str):
+        self.conn.execute("""
+            INSERT INTO cache_counters (name, value) VALUES (?, 1)
+            ON CONFLICT(name) DO UPDATE SET value = value + 1
+        """, (name,))
+    
+    def all_entries(self) -> List[dict]:
+        rows = self._execute("SELECT * FROM cache_entries ORDER BY hit_count DESC, last_access DESC")
+        return [dict(row) for row in rows]
+    
+    def import_entry(self, entry: dict):
+        """Ghi metadata của entry nhập từ snapshot (giữ nguyên thời gian và hit count)"""
+        self._execute("""
+            INSERT OR REPLACE INTO cache_entries
+                (key, voice, text_preview, size, created_at, last_access, hit_count, ttl_class)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (entry["key"], entry.get("voice"), entry.get("text_preview"), entry.get("size", 0),
+              entry["created_at"], entry.get("last_access", entry["created_at"]),
+              entry.get("hit_count", 0), entry.get("ttl_class", "default")))
+    
+    def record_phrase_units(self, settings_key: str, cache_key: str, head: str, words: List[dict]):
+        """Lưu word boundaries (ms) của một câu đã cache để ghép lại về sau"""
+        self._execute("""
+            INSERT OR REPLACE INTO phrase_units (settings_key, cache_key, head, words)
+            VALUES (?, ?, ?, ?)
+        """, (settings_key, cache_key, head, json.dumps(words, ensure_ascii=False)))
+    
+    def find_phrase_units(self, settings_key: str, head: str) -> List[dict]:
+        rows = self._execute("""
+            SELECT p.cache_key, p.words FROM phrase_units p
+            JOIN cache_entries e ON e.key = p.cache_key
+            WHERE p.settings_key = ? AND p.head = ?
+        """, (settings_key, head))
+        return [{"cache_key": row["cache_key"], "words": json.loads(row["words"])} for row in rows]
+    
+    def set_ttl_class(self, key: str, ttl_class: str) -> bool:
+        with self.lock:
+            cursor = self.conn.execute(
+                "UPDATE cache_entries SET ttl_class = ? WHERE key = ?", (ttl_class, key)
+            )
+            return cursor.rowcount > 0
+    
+    def delete(self, key: str):
+        self._execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+        self._execute("DELETE FROM phrase_units WHERE cache_key = ?", (key,))
+    
+    def eviction_candidates(self, accessed_before: float, limit: int) -> List[str]:
+        """Entry ít được truy cập gần đây nhất, tối đa limit (bỏ qua entry pinned và entry truy cập sau accessed_before)"""
+        rows = self._execute("""
+            SELECT key FROM cache_entries WHERE ttl_class != 'pinned' AND last_access < ?
+            ORDER BY last_access ASC LIMIT ?
+        """, (accessed_before, limit))
+        return [row["key"] for row in rows]
+    
+    def clear(self):
+        self._execute("DELETE FROM cache_entries")
+        self._execute("DELETE FROM phrase_units")
+    
+    def stats(self, top_n: int = 20) -> dict:
+        counters = {row["name"]: row["value"] for row in self._execute("SELECT * FROM cache_counters")}
+        hits = counters.get("hits", 0)
+        misses = counters.get("misses", 0)
+        totals = self._execute("SELECT COUNT(*) AS entries, COALESCE(SUM(size), 0) AS bytes FROM cache_entries")[0]
+        top_keys = self._execute("""
+            SELECT key, voice, text_preview, size, hit_count, ttl_class, created_at, last_access
+            FROM cache_entries ORDER BY hit_count DESC, last_access DESC LIMIT ?
+        """, (top_n,))
+        by_voice = self._execute("""
+            SELECT COALESCE(voice, 'unknown') AS voice, COUNT(*) AS entries,
+                   SUM(size) AS bytes, SUM(hit_count) AS hits
+            FROM cache_entries GROUP BY COALESCE(voice, 'unknown') ORDER BY bytes DESC
+        """)
+        by_ttl_class = self._execute("""
+            SELECT ttl_class, COUNT(*) AS entries, SUM(size) AS bytes
+            FROM cache_entries GROUP BY ttl_class
+        """)
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+            "entries": totals["entries"],
+            "bytes": totals["bytes"],
+            "top_keys": [dict(row) for row in top_keys],
+            "bytes_by_voice": [dict(row) for row in by_voice],
+            "by_ttl_class": [dict(row) for row in by_ttl_class]
+        }
+
+# ==================== CACHE BACKENDS ====================
+CACHE_KEY_PATTERN = re.compile(r'^[0-9a-f]{6,64}$')
+
+class LocalCacheBackend:
+    """Lưu cache trong thư mục local, ghi bằng atomic rename, lock file cho từng key"""
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+    
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.mp3")
+    
+    def fetch(self, key: str) -> Optional[str]:
+        """Trả về đường dẫn local (read-only) của entry, None nếu không có"""
+        path = self.path_for(key)
+        return path if os.path.exists(path) else None
+    
+    def store(self, key: str, source_file: str) -> str:
+        """Ghi entry bằng hard link + os.replace, không bao giờ lộ file ghi dở"""
+        cache_file = self.path_for(key)
+        staging_file = f"{cache_file}.{uuid.uuid4().hex[:8]}.tmp"
+        try:
+            # Hard link: không ghi thêm dữ liệu lên đĩa
+            os.link(source_file, staging_file)
+        except OSError:
+            # Khác filesystem hoặc không hỗ trợ hard link
+            shutil.copy(source_file, staging_file)
+        os.replace(staging_file, cache_file)
+        return cache_file
+    
+    def remove(self, key: str):
+        try:
+            os.remove(self.path_for(key))
+        except OSError:
+            pass
+    
+    def keys(self) -> List[str]:
+        return [f[:-len(".mp3")] for f in os.listdir(self.cache_dir) if f.endswith(".mp3")]
+    
+    def try_lock(self, key: str) -> bool:
+        """Giành quyền tạo entry (dùng chung giữa các process qua O_EXCL)"""
+        lock_file = os.path.join(self.cache_dir, f"{key}.lock")
+        try:
+            fd = os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            os.write(fd, str(os.getpid()).encode())
+            os.close(fd)
+            return True
+        except FileExistsError:
+            # Lock bị bỏ rơi (process chết giữa chừng)
+            try:
+                if time.time() - os.path.getmtime(lock_file) > TTSConfig.CACHE_LOCK_TIMEOUT:
+                    os.remove(lock_file)
+                    return self.try_lock(key)
+            except OSError:
+                pass
+            return False
+    
+    def is_locked(self, key: str) -> bool:
+        return os.path.exists(os.path.join(self.cache_dir, f"{key}.lock"))
+    
+    def unlock(self, key: str):
+        try:
+            os.remove(os.path.join(self.cache_dir, f"{key}.lock"))
+        except OSError:
+            pass
+    
+    def clear(self):
+        if os.path.exists(self.cache_dir):
+            shutil.rmtree(self.cache_dir)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+class HTTPCacheBackend(LocalCacheBackend):
+    """Cache dùng chung qua HTTP key/value server, thư mục local làm L1"""
+    def __init__(self, cache_dir: str, base_url: str, timeout: float = TTSConfig.CACHE_REMOTE_TIMEOUT):
+        super().__init__(cache_dir)
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+    
+    def _url(self, key: str) -> str:
+        return f"{self.base_url}/cache/{key}"
+    
+    def fetch(self, key: str) -> Optional[str]:
+        path = super().fetch(key)
+        if path:
+            return path
+        
+        staging_file = f"{self.path_for(key)}.{uuid.uuid4().hex[:8]}.tmp"
+        try:
+            with urllib.request.urlopen(self._url(key), timeout=self.timeout) as response:
+                with open(staging_file, "wb") as f:
+                    shutil.copyfileobj(response, f)
+                created_at = response.headers.get("X-Created-At")
+            if created_at:
+                os.utime(staging_file, (time.time(), float(created_at)))
+            os.replace(staging_file, self.path_for(key))
+            return self.path_for(key)
+        except urllib.error.HTTPError as e:
+            if e.code != 404:
+                print(f"Error fetching {key} from cache server: {e}")
+        except Exception as e:
+            print(f"Error fetching {key} from cache server: {e}")
+        
+        try:
+            os.remove(staging_file)
+        except OSError:
+            pass
+        return None
+    
+    def store(self, key: str, source_file: str) -> str:
+        cache_file = super().store(key, source_file)
+        try:
+            with open(cache_file, "rb") as f:
+                headers = {"Content-Type": "audio/mpeg"}
+                if TTSConfig.CACHE_REMOTE_TOKEN:
+                    headers["X-Cache-Token"] = TTSConfig.CACHE_REMOTE_TOKEN
+                request = urllib.request.Request(self._url(key), data=f.read(), method="PUT",
+                                                 headers=headers)
+            urllib.request.urlopen(request, timeout=self.timeout).close()
+        except Exception as e:
+            print(f"Error uploading {key} to cache server: {e}")
+        return cache_file
+    
+    # remove/clear chỉ tác động L1 local: cache server dùng chung cho mọi node
+
+def create_cache_backend(cache_dir: str):
+    """Tạo cache backend theo cấu hình"""
+    if TTSConfig.CACHE_BACKEND == "http":
+        return HTTPCacheBackend(cache_dir, TTSConfig.CACHE_REMOTE_URL)
+    return LocalCacheBackend(cache_dir)
+
+class CacheServerHandler(BaseHTTPRequestHandler):
+    """Key/value server tối giản cho cache dùng chung: GET/HEAD/PUT/DELETE /cache/{key}.
+    
+    PUT/DELETE cần header X-Cache-Token khớp token của server (khi có token).
+    """
+    backend: LocalCacheBackend = None
+    max_entries: int = 10000
+    token: str = ""
+    
+    def _authorized(self) -> bool:
+        if self.token and not hmac.compare_digest(self.headers.get("X-Cache-Token", ""), self.token):
+            self.send_error(401, "Invalid cache token")
+            return False
+        return True
+    
+    def _key(self) -> Optional[str]:
+        parts = self.path.split("?")[0].strip("/").split("/")
+        if len(parts) == 2 and parts[0] == "cache" and CACHE_KEY_PATTERN.match(parts[1]):
+            return parts[1]
+        self.send_error(400, "Invalid cache key")
+        return None
+    
+    def _send_entry(self, include_body: bool):
+        key = self._key()
+        if not key:
+            return
+        path = self.backend.fetch(key)
+        if not path:
+            self.send_error(404, "Not found")
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/mpeg")
+        self.send_header("Content-Length", str(os.path.getsize(path)))
+        self.send_header("X-Created-At", str(os.path.getmtime(path)))
+        self.end_headers()
+        if include_body:
+            with open(path, "rb") as f:
+                shutil.copyfileobj(f, self.wfile)
+    
+    def do_GET(self):
+        self._send_entry(include_body=True)
+    
+    def do_HEAD(self):
+        self._send_entry(include_body=False)
+    
+    def do_PUT(self):
+        if not self._authorized():
+            return
+        key = self._key()
+        if not key:
+            return
+        try:
+            length = int(self.headers["Content-Length"])
+        except (KeyError, TypeError, ValueError):
+            self.send_error(411, "Content-Length required")
+            return
+        if length < 0 or length > TTSConfig.CACHE_SERVER_MAX_ENTRY_BYTES:
+            self.send_error(413, "Entry too large")
+            return
+        staging_file = os.path.join(self.backend.cache_dir, f"{key}.{uuid.uuid4().hex[:8]}.upload")
+        with open(staging_file, "wb") as f:
+            f.write(self.rfile.read(length))
+        self.backend.store(key, staging_file)
+        os.remove(staging_file)
+        
+        keys = self.backend.keys()
+        if len(keys) > self.max_entries:
+            oldest = min(keys, key=lambda k: os.path.getmtime(self.backend.path_for(k)))
+            self.backend.remove(oldest)
+        
+        self.send_response(204)
+        self.end_headers()
+    
+    def do_DELETE(self):
+        if not self._authorized():
+            return
+        key = self._key()
+        if not key:
+            return
+        self.backend.remove(key)
+        self.send_response(204)
+        self.end_headers()
+
+def run_cache_server(directory: str, host: str, port: int, max_entries: int = 10000,
+                     token: str = TTSConfig.CACHE_REMOTE_TOKEN):
+    """Chạy cache server dùng chung (cũng dùng làm stand-in khi test)"""
+    if not token and host not in ("127.0.0.1", "localhost", "::1"):
+        raise SystemExit(f"Refusing to serve the cache on {host} without a token (set TTS_CACHE_TOKEN)")
+    handler = type("BoundCacheServerHandler", (CacheServerHandler,), {
+        "backend": LocalCacheBackend(directory),
+        "max_entries": max_entries,
+        "token": token
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    print(f"Cache server listening on http://{host}:{port} (dir: {directory})")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+class _StreamBuffer:
+    """File-like chỉ ghi, gom dữ liệu để generator trả về từng phần"""
+    def __init__(self):
+        self.chunks = []
+    
+    def write(self, data: bytes) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+# ==================== AUDIO CACHE MANAGER ====================
+class AudioCacheManager:
+    def __init__(self):
+        self.cache_dir = "audio_cache"
+        self.max_cache_size = 50  # Giảm cache size cho Render
+        self.backend = create_cache_backend(self.cache_dir)
+        self.index = CacheIndex(TTSConfig.CACHE_INDEX_FILE)
+    
+    def get_cache_key(self, text: str, voice_id: str, rate: int, pitch: int, volume: int) -> str:
+        """Tạo cache key từ các tham số"""
+        import hashlib
+        key_string = f"{text}_{voice_id}_{rate}_{pitch}_{volume}"
+        return hashlib.md5(key_string.encode()).hexdigest()[:12]  # Giới hạn độ dài
+    
+    def get_cached_audio(self, cache_key: str, record_stats: bool = True) -> Optional[str]:
+        """Lấy file audio từ cache nếu tồn tại (read-only path, không copy).
+        
+        Lần đọc cập nhật last_access trong index (record_hit), nên entry không bị process
+        nào evict trong CACHE_EVICTION_GRACE giây sau đó, đủ để người gọi dùng xong file.
+        """
+        return self._lookup(cache_key, record_stats)
+    
+    def has_cached_audio(self, cache_key: str) -> bool:
+        """Entry còn hạn có trong cache (không tính hit/miss)"""
+        return self._lookup(cache_key, False) is not None
+    
+    def _lookup(self, cache_key: str, record_stats: bool) -> Optional[str]:
+        """Đường dẫn của entry còn hạn trong cache, None nếu không có"""
+        cache_file = self.backend.fetch(cache_key)
+        if cache_file:
+            entry = self.index.get_entry(cache_key)
+            if entry:
+                created_at = entry["created_at"]
+                ttl = TTSConfig.CACHE_TTL_CLASSES.get(entry["ttl_class"], 86400)
+            else:
+                # File chưa có trong index (file cũ hoặc từ node khác): dùng mtime
+                created_at = os.path.getmtime(cache_file)
+                ttl = TTSConfig.CACHE_TTL_CLASSES["default"]
+                self.index.record_insert(cache_key, size=os.path.getsize(cache_file),
+                                         created_at=created_at)
             
-            cache_file = os.path.join(self.cache_dir, f"{cache_key}.mp3")
-            shutil.copy(audio_file, cache_file)
+            if ttl is None or time.time() - created_at < ttl:
+                if record_stats:
+                    self.index.record_hit(cache_key)
+                return cache_file
+        if record_stats:
+            self.index.record_miss()
+        return None
+    
+    def save_to_cache(self, cache_key: str, audio_file: str, voice_id: str = None,
+                      text: str = None, ttl_class: str = "default"):
+        """Lưu audio vào cache"""
+        try:
+            # Giới hạn số file trong cache: evict tới khi còn chỗ cho entry mới (cache từng vượt
+            # giới hạn sau một đợt ghi dồn dập sẽ co lại ngay khi entry ra khỏi grace)
+            cache_keys = self.backend.keys()
+            excess = len(cache_keys) - self.max_cache_size + 1
+            if excess > 0:
+                # Entry ít dùng nhất theo index (trừ entry vừa được đọc/ghi),
+                # fallback về file cũ nhất chưa có trong index
+                victims = self.index.eviction_candidates(time.time() - TTSConfig.CACHE_EVICTION_GRACE, excess)
+                if len(victims) < excess:
+                    unindexed = sorted((k for k in cache_keys if self.index.get_entry(k) is None),
+                                       key=lambda k: os.path.getmtime(self.backend.path_for(k)))
+                    victims += unindexed[:excess - len(victims)]
+                for victim_key in victims:
+                    self.backend.remove(victim_key)
+                    self.index.delete(victim_key)
+                if len(victims) < excess:
+                    # Mọi entry còn lại đều vừa được dùng: không cache thêm, không evict entry đang đọc
+                    return None
+            
+            cache_file = self.backend.store(cache_key, audio_file)
+            self.index.record_insert(
+                cache_key, voice=voice_id, size=os.path.getsize(cache_file),
+                ttl_class=ttl_class, text=text
+            )
             return cache_file
         except Exception as e:
             print(f"Error saving to cache: {e}")
             return None
     
+    def claim(self, cache_key: str) -> bool:
+        """Giành quyền synthesize một key, tránh nhiều worker tạo cùng một entry"""
+        return self.backend.try_lock(cache_key)
+    
+    def release_claim(self, cache_key: str):
+        self.backend.unlock(cache_key)
+    
+    async def wait_for_entry(self, cache_key: str, timeout: float = TTSConfig.CACHE_LOCK_TIMEOUT) -> Optional[str]:
+        """Chờ worker khác tạo xong entry đang bị lock"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            # Lock là local nên entry sẽ xuất hiện ở thư mục local trước
+            if os.path.exists(self.backend.path_for(cache_key)):
+                cached_file = await asyncio.to_thread(self.get_cached_audio, cache_key, False)
+                if cached_file:
+                    self.index.record_hit(cache_key)
+                    return cached_file
+            if not self.backend.is_locked(cache_key):
+                return None
+            await asyncio.sleep(0.25)
+        return None
+    
+    def get_stats(self, top_n: int = 20) -> dict:
+        """Thống kê cache: hit ratio, top keys, dung lượng theo voice"""
+        return self.index.stats(top_n)
+    
+    def set_ttl_class(self, cache_key: str, ttl_class: str) -> bool:
+        """Đổi TTL class của một entry (vd: pinned)"""
+        if ttl_class not in TTSConfig.CACHE_TTL_CLASSES:
+            raise ValueError(f"Unknown TTL class: {ttl_class}")
+        return self.index.set_ttl_class(cache_key, ttl_class)
+    
+    def export_snapshot(self):
+        """Xuất cache thành tar stream: manifest.json + entries/{key}.mp3"""
+        entries = []
+        for entry in self.index.all_entries():
+            path = self.backend.path_for(entry["key"])
+            if not os.path.exists(path):
+                continue
+            sha256 = hashlib.sha256()
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(65536), b""):
+                    sha256.update(block)
+            entry["size"] = os.path.getsize(path)
+            entry["sha256"] = sha256.hexdigest()
+            entries.append(entry)
+        
+        manifest = json.dumps({
+            "format": "free_tts-cache-snapshot",
+            "cache_format_version": TTSConfig.CACHE_FORMAT_VERSION,
+            "created_at": time.time(),
+            "entries": entries
+        }, ensure_ascii=False).encode("utf-8")
+        
+        buffer = _StreamBuffer()
+        with tarfile.open(fileobj=buffer, mode="w|") as tar:
+            info = tarfile.TarInfo("manifest.json")
+            info.size = len(manifest)
+            info.mtime = int(time.time())
+            tar.addfile(info, io.BytesIO(manifest))
+            yield buffer.drain()
+            
+            for entry in entries:
+                path = self.backend.path_for(entry["key"])
+                try:
+                    with open(path, "rb") as f:
+                        info = tarfile.TarInfo(f"entries/{entry['key']}.mp3")
+                        info.size = entry["size"]
+                        info.mtime = int(entry["created_at"])
+                        tar.addfile(info, f)
+                except OSError:
+                    # Entry bị evict trong lúc export
+                    continue
+                yield buffer.drain()
+        yield buffer.drain()
+    
+    def import_snapshot(self, fileobj) -> dict:
+        """Nhập snapshot từ stream, kiểm tra sha256 và bỏ qua entry cũ/hết hạn"""
+        summary = {"imported": 0, "stale": 0, "corrupt": 0, "skipped": 0}
+        manifest = None
+        now = time.time()
+        
+        with tarfile.open(fileobj=fileobj, mode="r|*") as tar:
+            for member in tar:
+                if member.name == "manifest.json":
+                    manifest = json.loads(tar.extractfile(member).read().decode("utf-8"))
+                    if manifest.get("cache_format_version") != TTSConfig.CACHE_FORMAT_VERSION:
+                        summary["stale"] = len(manifest.get("entries", []))
+                        summary["message"] = "Snapshot cache format version does not match"
+                        return summary
+                    manifest = {entry["key"]: entry for entry in manifest.get("entries", [])}
+                    continue
+                
+                if manifest is None or not member.isfile():
+                    continue
+                
+                key = os.path.basename(member.name)[:-len(".mp3")]
+                entry = manifest.get(key)
+                if not entry or not CACHE_KEY_PATTERN.match(key):
+                    summary["skipped"] += 1
+                    continue
+                
+                ttl = TTSConfig.CACHE_TTL_CLASSES.get(entry.get("ttl_class"), 86400)
+                local_entry = self.index.get_entry(key)
+                if ttl is not None and now - entry["created_at"] >= ttl:
+                    summary["stale"] += 1
+                    continue
+                if local_entry and local_entry["created_at"] >= entry["created_at"] \
+                        and os.path.exists(self.backend.path_for(key)):
+                    summary["skipped"] += 1
+                    continue
+                if len(self.backend.keys()) >= self.max_cache_size:
+                    summary["skipped"] += 1
+                    continue
+                
+                staging_file = os.path.join(self.cache_dir, f"{key}.{uuid.uuid4().hex[:8]}.import")
+                sha256 = hashlib.sha256()
+                source = tar.extractfile(member)
+                with open(staging_file, "wb") as f:
+                    for block in iter(lambda: source.read(65536), b""):
+                        sha256.update(block)
+                        f.write(block)
+                
+                try:
+                    if sha256.hexdigest() != entry.get("sha256") or os.path.getsize(staging_file) != entry.get("size"):
+                        summary["corrupt"] += 1
+                        continue
+                    self.backend.store(key, staging_file)
+                    self.index.import_entry(entry)
+                    summary["imported"] += 1
+                finally:
+                    os.remove(staging_file)
+        
+        if manifest is None:
+            raise ValueError("Snapshot has no manifest.json")
+        return summary
+    
+    def import_snapshot_from(self, source: str) -> dict:
+        """Nhập snapshot từ đường dẫn file hoặc URL"""
+        if source.startswith(("http://", "https://")):
+            with urllib.request.urlopen(source, timeout=60) as response:
+                return self.import_snapshot(response)
+        with open(source, "rb") as f:
+            return self.import_snapshot(f)
+    
+    def is_cache_file(self, file_path: str) -> bool:
+        """Kiểm tra file có nằm trong thư mục cache hay không"""
+        cache_dir = os.path.abspath(self.cache_dir)
+        return os.path.dirname(os.path.abspath(file_path)) == cache_dir
+    
     def clear_cache(self):
         """Xóa toàn bộ cache"""
         try:
-            if os.path.exists(self.cache_dir):
-                shutil.rmtree(self.cache_dir)
-            os.makedirs(self.cache_dir, exist_ok=True)
+            self.backend.clear()
+            self.index.clear()
             return True
         except Exception as e:
             print(f"Error clearing cache: {e}")
             return False
 
+# ==================== JOB CHECKPOINT ====================
+class JobCheckpoint:
+    """Checkpoint của job dài: audio từng unit đã xong và manifest các unit đó.
+    
+    Job chạy lại (worker restart, lease hết hạn) đọc manifest và chỉ tạo lại các unit
+    còn thiếu. Unit khớp theo vị trí và cache key (text + giọng + setting), nên
+    checkpoint cũ không bị dùng nhầm cho nội dung khác.
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.manifest_file = os.path.join(directory, "manifest.json")
+        self.units = {}
+        self.restored = 0
+        # save() được gọi song song từ nhiều thread (asyncio.to_thread của từng unit)
+        self.lock = threading.Lock()
+        try:
+            with open(self.manifest_file, "r", encoding="utf-8") as f:
+                self.units = json.load(f).get("units", {})
+        except (OSError, ValueError):
+            pass
+    
+    @classmethod
+    def for_task(cls, task_id: str) -> "JobCheckpoint":
+        return cls(os.path.join(TTSConfig.CHECKPOINT_DIR, task_id))
+    
+    def child(self, name: str) -> "JobCheckpoint":
+        """Checkpoint con (ví dụ từng item của batch), bị xóa cùng checkpoint cha"""
+        return JobCheckpoint(os.path.join(self.directory, name))
+    
+    def load(self, index: int, signature: str) -> Optional[Tuple[str, List[dict]]]:
+        unit = self.units.get(str(index))
+        if not unit or unit["signature"] != signature:
+            return None
+        audio_file = os.path.join(self.directory, unit["file"])
+        if not os.path.exists(audio_file):
+            return None
+        self.restored += 1
+        return audio_file, [dict(sub) for sub in unit["subtitles"]]
+    
+    def save(self, index: int, signature: str, audio_file: str, subtitles: List[dict]):
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"unit_{index:05d}{os.path.splitext(audio_file)[1]}"
+        target = os.path.join(self.directory, name)
+        if os.path.exists(target):
+            os.remove(target)
+        # Hard link khi được (file cache/temp cùng filesystem), không thì copy
+        try:
+            os.link(audio_file, target)
+        except OSError:
+            shutil.copyfile(audio_file, target)
+        unit = {
+            "signature": signature,
+            "file": name,
+            "subtitles": [dict(sub) for sub in subtitles if isinstance(sub, dict)]
+        }
+        # Lock giữ qua cả lần ghi: manifest ghi sau luôn chứa đủ các unit đã lưu trước đó
+        with self.lock:
+            self.units[str(index)] = unit
+            units = dict(self.units)
+            # Ghi manifest atomic qua file tạm riêng (mkstemp): restart giữa chừng không để lại
+            # manifest hỏng, worker khác cùng thư mục không ghi đè file tạm này
+            fd, temp_manifest = tempfile.mkstemp(prefix="manifest.", suffix=".tmp", dir=self.directory)
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump({"units": units, "updated_at": time.time()}, f, ensure_ascii=False)
+                os.replace(temp_manifest, self.manifest_file)
+            except BaseException:
+                try:
+                    os.remove(temp_manifest)
+                except OSError:
+                    pass
+                raise
+    
+    @staticmethod
+    def is_checkpoint_file(file_path: str) -> bool:
+        root = os.path.abspath(TTSConfig.CHECKPOINT_DIR) + os.sep
+        return os.path.abspath(file_path).startswith(root)
+    
+    def discard(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+def job_upload_path(task_id: str) -> str:
+    return os.path.join(TTSConfig.UPLOAD_DIR, f"{task_id}.txt")
+
+async def save_job_upload(task_id: str, upload: UploadFile, prefix: str = "") -> str:
+    """Ghi file tải lên xuống đĩa theo từng khối (không nạp cả file); trả về sha256 nội dung"""
+    digest = hashlib.sha256()
+    with open(job_upload_path(task_id), "wb") as f:
+        if prefix.strip():
+            chunk = f"{prefix}\n".encode("utf-8")
+            digest.update(chunk)
+            f.write(chunk)
+        while True:
+            chunk = await upload.read(TTSConfig.UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            await asyncio.to_thread(f.write, chunk)
+    return digest.hexdigest()
+
+def open_job_upload(task_id: str):
+    return open(job_upload_path(task_id), "r", encoding="utf-8", errors="ignore", newline="\n")
+
+def discard_job_upload(task_id: str):
+    try:
+        os.remove(job_upload_path(task_id))
+    except FileNotFoundError:
+        pass
+
+# ==================== PROGRESSIVE OUTPUT ====================
+def strip_id3(data: bytes) -> bytes:
+    """Bỏ tag ID3v2 ở đầu file mp3 để nối nhiều file thành một stream"""
+    if len(data) >= 10 and data[:3] == b"ID3":
+        size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        return data[10 + size:]
+    return data
+
+_silence_cache: Dict[int, bytes] = {}
+
+def silence_mp3(duration_ms: int) -> bytes:
+    """Khoảng lặng mp3 (24 kHz mono như audio edge-tts), encode một lần cho mỗi độ dài"""
+    if duration_ms not in _silence_cache:
+        buffer = io.BytesIO()
+        AudioSegment.silent(duration=duration_ms, frame_rate=24000).export(
+            buffer, format="mp3", bitrate="192k"
+        )
+        _silence_cache[duration_ms] = strip_id3(buffer.getvalue())
+    return _silence_cache[duration_ms]
+
+class ProgressiveOutput:
+    """Output lớn dần của job đang chạy: file mp3 nối các unit đã xong theo thứ tự.
+    
+    Client tải/phát file này (hoặc /api/task/{task_id}/stream) trong khi các câu sau
+    còn đang được tạo; trạng thái task báo phần đã phát được. Unit được nối nguyên
+    bản (không fade, không lặp lại), output cuối cùng của job vẫn export như cũ.
+    """
+    def __init__(self, task_id: str, output_dir: str, total: int):
+        self.task_id = task_id
+        self.path = os.path.join(output_dir, f"progressive_{task_id}.mp3")
+        self.total = total
+        self.units = 0
+        self.duration_ms = 0
+        self.size = 0
+        self.pause_ms = 0
+        open(self.path, "wb").close()
+        self._publish()
+    
+    def append(self, audio_file: str, duration_ms: int, pause_after_ms: int = 0):
+        """Nối unit tiếp theo; pause_after_ms là khoảng lặng trước unit kế tiếp"""
+        try:
+            with open(audio_file, "rb") as f:
+                data = strip_id3(f.read())
+            if self.units and self.pause_ms > 0:
+                data = silence_mp3(self.pause_ms) + data
+            with open(self.path, "ab") as f:
+                f.write(data)
+        except OSError as e:
+            # Chỉ ảnh hưởng bản nghe trước, output cuối cùng của job không đổi
+            print(f"Error appending progressive output: {e}")
+            return
+        if self.units:
+            self.duration_ms += self.pause_ms
+        self.units += 1
+        self.duration_ms += duration_ms
+        self.size += len(data)
+        self.pause_ms = pause_after_ms
+        self._publish()
+    
+    def _publish(self):
+        if task_manager:
+            task_manager.update_task(self.task_id, playable={
+                "url": f"/download/{os.path.basename(self.path)}",
+                "stream_url": f"/api/task/{self.task_id}/stream",
+                "units": self.units,
+                "total": self.total,
+                "duration_ms": self.duration_ms,
+                "bytes": self.size
+            })
+
 # ==================== TTS PROCESSOR ====================
 class TTSProcessor:
     def __init__(self):
         self.text_processor = TextProcessor()
         self.cache_manager = AudioCacheManager()
+        self.upstream_limiter = UpstreamLimiter()
+        self.circuit_breaker = CircuitBreaker()
+        # Negative cache: cache_key -> thời điểm được phép thử lại upstream
+        self.negative_cache = {}
+        # task_id -> thư mục output của job đang chạy (để dọn khi job bị hủy)
+        self.job_dirs = {}
+        # client_id -> câu bị bỏ lại sau deadline, chạy tiếp để lấp cache
+        self.background_units = {}
         self.load_settings()
         self.initialize_directories()
     
     def initialize_directories(self):
         """Khởi tạo các thư mục cần thiết"""
-        directories = ["outputs", "temp", "audio_cache", "static", "templates"]
+        directories = ["outputs", "temp", "audio_cache", "static", "templates", TTSConfig.CHECKPOINT_DIR,
+                       TTSConfig.UPLOAD_DIR]
         for directory in directories:
             os.makedirs(directory, exist_ok=True)
     
@@ -1157,19 +2795,284 @@ class TTSProcessor:
         with open(TTSConfig.SETTINGS_FILE, 'w', encoding='utf-8') as f:
             json.dump(self.settings, f, indent=2, ensure_ascii=False)
     
-    async def generate_speech(self, text: str, voice_id: str, rate: int = 0, pitch: int = 0, volume: int = 100, task_id: str = None):
+    async def generate_speech(self, text: str, voice_id: str, rate: int = 0, pitch: int = 0, volume: int = 100,
+                              task_id: str = None, priority: int = UpstreamLimiter.PRIORITY_INTERACTIVE,
+                              phrase_reuse: bool = False, client_id: str = None, deadline: float = None,
+                              word_boundaries: bool = False):
         """Generate speech using edge-tts with cache optimization"""
         try:
             # Kiểm tra cache trước
             cache_key = self.cache_manager.get_cache_key(text, voice_id, rate, pitch, volume)
-            cached_file = self.cache_manager.get_cached_audio(cache_key)
+            cached_file = await asyncio.to_thread(self.cache_manager.get_cached_audio, cache_key)
             
             if cached_file:
-                # Tạo file tạm từ cache
-                temp_file = f"temp/cache_{uuid.uuid4().hex[:8]}.mp3"
-                shutil.copy(cached_file, temp_file)
-                return temp_file, []
+                # Dùng trực tiếp file cache (read-only), không copy ra temp
+                return cached_file, []
+            
+            # Chỉ một worker synthesize mỗi key, các worker khác chờ kết quả
+            claimed = self.cache_manager.claim(cache_key)
+            if not claimed:
+                cached_file = await self.cache_manager.wait_for_entry(cache_key)
+                if cached_file:
+                    return cached_file, []
             
+            try:
+                phrase_reuse = phrase_reuse and self.phrase_reuse_allowed(voice_id, rate, pitch)
+                if phrase_reuse:
+                    spliced = await self._splice_from_phrases(text, voice_id, rate, pitch, volume,
+                                                              cache_key, priority, client_id, deadline)
+                    if spliced:
+                        return spliced
+                return await self._synthesize(text, voice_id, rate, pitch, volume, cache_key, priority,
+                                              word_boundaries=phrase_reuse or word_boundaries,
+                                              client_id=client_id, deadline=deadline)
+            finally:
+                if claimed:
+                    self.cache_manager.release_claim(cache_key)
+        
+        except UpstreamUnavailableError:
+            raise
+        except Exception as e:
+            print(f"Error generating speech: {e}")
+            return None, []
+    
+    def is_fully_cached(self, text: str, voice_id: str, rate: int, pitch: int, volume: int) -> bool:
+        """Mọi câu của text đã có trong cache (job chỉ cần ghép audio, không gọi upstream)"""
+        for sentence in self.text_processor.iter_sentences(text):
+            cache_key = self.cache_manager.get_cache_key(sentence, voice_id, rate, pitch, volume)
+            if not self.cache_manager.has_cached_audio(cache_key):
+                return False
+        return True
+    
+    async def generate_unit(self, checkpoint: Optional[JobCheckpoint], index: int, text: str,
+                            voice_id: str, rate: int, pitch: int, volume: int, **kwargs):
+        """generate_speech cho unit thứ index của job; unit đã có trong checkpoint không tạo lại"""
+        if checkpoint is None:
+            return await self.generate_speech(text, voice_id, rate, pitch, volume, **kwargs)
+        signature = self.cache_manager.get_cache_key(text, voice_id, rate, pitch, volume)
+        restored = checkpoint.load(index, signature)
+        if restored:
+            return restored
+        audio_file, subtitles = await self.generate_speech(text, voice_id, rate, pitch, volume, **kwargs)
+        if audio_file:
+            try:
+                await asyncio.to_thread(checkpoint.save, index, signature, audio_file, subtitles)
+            except Exception as e:
+                # Checkpoint chỉ để chạy lại nhanh hơn: lỗi ghi không làm hỏng unit vừa tạo
+                print(f"Error saving checkpoint: {e}")
+        return audio_file, subtitles
+    
+    @staticmethod
+    def assembly_margin(units: int, budget: float) -> float:
+        """Giây cần để ghép/export units câu đã xong trước deadline (budget: tổng giây của request)"""
+        return min(TTSConfig.DEADLINE_ASSEMBLY_MARGIN + units * TTSConfig.DEADLINE_ASSEMBLY_PER_UNIT,
+                   budget * TTSConfig.DEADLINE_ASSEMBLY_MAX_SHARE)
+    
+    async def _gather_until(self, deadline: float, coroutines: list, budget: float,
+                            client_id: str = None) -> list:
+        """Như gather(return_exceptions=True) nhưng ngừng chờ khi chỉ còn đủ thời gian
+        ghép các câu đã xong trước deadline (assembly_margin tăng theo số câu đã xong).
+        
+        Câu chưa xong nhận DeadlineExceededError và tiếp tục chạy ở background
+        (limiter đã hạ chúng xuống lane background) để lần sau có sẵn trong cache;
+        mỗi client giữ tối đa DEADLINE_MAX_BACKGROUND_UNITS câu như vậy, phần vượt bị hủy.
+        """
+        tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+        if not tasks:
+            return []
+        done, pending = set(), set(tasks)
+        try:
+            while pending:
+                timeout = deadline - self.assembly_margin(len(done), budget) - time.monotonic()
+                if timeout <= 0:
+                    break
+                finished, pending = await asyncio.wait(pending, timeout=timeout,
+                                                       return_when=asyncio.FIRST_COMPLETED)
+                if not finished:
+                    break
+                done |= finished
+        except asyncio.CancelledError:
+            pending = tasks
+            raise
+        finally:
+            background = self.background_units.setdefault(client_id, set())
+            for task in pending:
+                if task.done():
+                    continue
+                if len(background) >= TTSConfig.DEADLINE_MAX_BACKGROUND_UNITS:
+                    task.cancel()
+                    continue
+                background.add(task)
+                task.add_done_callback(functools.partial(self._finish_background_unit, client_id))
+            if not background:
+                del self.background_units[client_id]
+        
+        results = []
+        for task in tasks:
+            if task not in done or task.cancelled():
+                results.append(DeadlineExceededError())
+            elif task.exception() is not None:
+                results.append(task.exception())
+            else:
+                results.append(task.result())
+        return results
+    
+    def _finish_background_unit(self, client_id: Optional[str], task: asyncio.Task):
+        background = self.background_units.get(client_id)
+        if background is not None:
+            background.discard(task)
+            if not background:
+                del self.background_units[client_id]
+        if task.cancelled() or task.exception() is not None:
+            return
+        audio_file, _ = task.result()
+        self.release_audio_file(audio_file)
+    
+    @staticmethod
+    def _report_resume(task_id: Optional[str], checkpoint: Optional[JobCheckpoint], total: int):
+        """Báo job tiếp tục từ checkpoint của lần chạy trước"""
+        if not task_id or not task_manager or checkpoint is None or not checkpoint.units:
+            return
+        done = min(len(checkpoint.units), total)
+        task_manager.update_task(task_id, message=f"Resuming from checkpoint ({done}/{total} units done)")
+        task_manager.add_event(task_id, "resume", {"done": done, "total": total})
+    
+    def is_negatively_cached(self, cache_key: str) -> bool:
+        """Câu vừa lỗi gần đây thì không gọi lại upstream ngay"""
+        retry_at = self.negative_cache.get(cache_key)
+        if retry_at is None:
+            return False
+        if time.time() >= retry_at:
+            del self.negative_cache[cache_key]
+            return False
+        return True
+    
+    def remember_failure(self, cache_key: str):
+        now = time.time()
+        # Dọn các entry hết hạn để dict không phình to
+        if len(self.negative_cache) > 1000:
+            self.negative_cache = {k: t for k, t in self.negative_cache.items() if t > now}
+        self.negative_cache[cache_key] = now + TTSConfig.NEGATIVE_CACHE_TTL
+    
+    def phrase_reuse_allowed(self, voice_id: str, rate: int, pitch: int) -> bool:
+        """Chỉ ghép audio cho voice/setting mà chỗ nối nghe chấp nhận được"""
+        voices = TTSConfig.PHRASE_REUSE_VOICES
+        return (("*" in voices or voice_id in voices)
+                and abs(rate) <= TTSConfig.PHRASE_REUSE_MAX_RATE
+                and abs(pitch) <= TTSConfig.PHRASE_REUSE_MAX_PITCH)
+    
+    @staticmethod
+    def _phrase_tokens(words: List[str]) -> List[Tuple[int, str]]:
+        """Chuẩn hóa từ để so khớp: (vị trí gốc, từ thường bỏ dấu câu)"""
+        tokens = []
+        for position, word in enumerate(words):
+            normalized = re.sub(r"[^\w']+", "", word.lower())
+            if normalized:
+                tokens.append((position, normalized))
+        return tokens
+    
+    def _record_phrase_units(self, text: str, voice_id: str, rate: int, pitch: int, volume: int,
+                             cache_key: str, boundaries: List[dict]):
+        """Index word boundaries (ms) của câu vừa cache"""
+        words = []
+        for boundary in boundaries:
+            normalized = re.sub(r"[^\w']+", "", boundary["text"].lower())
+            if normalized:
+                words.append({
+                    "word": normalized,
+                    "start": boundary["start"],
+                    "end": boundary["end"]
+                })
+        if len(words) < TTSConfig.PHRASE_REUSE_MIN_WORDS:
+            return
+        head = " ".join(w["word"] for w in words[:TTSConfig.PHRASE_REUSE_MIN_WORDS])
+        self.cache_manager.index.record_phrase_units(
+            f"{voice_id}_{rate}_{pitch}_{volume}", cache_key, head, words
+        )
+    
+    async def _splice_from_phrases(self, text: str, voice_id: str, rate: int, pitch: int, volume: int,
+                                   cache_key: str, priority: int, client_id: str = None,
+                                   deadline: float = None):
+        """Ghép câu mới từ prefix đã cache + phần mới gọi upstream"""
+        min_words = TTSConfig.PHRASE_REUSE_MIN_WORDS
+        original_words = text.split()
+        tokens = self._phrase_tokens(original_words)
+        if len(tokens) <= min_words:
+            return None
+        
+        head = " ".join(token for _, token in tokens[:min_words])
+        candidates = self.cache_manager.index.find_phrase_units(f"{voice_id}_{rate}_{pitch}_{volume}", head)
+        
+        # Chọn câu đã cache có prefix chung dài nhất
+        best, best_length = None, 0
+        for candidate in candidates:
+            length = 0
+            for (_, token), unit in zip(tokens, candidate["words"]):
+                if token != unit["word"]:
+                    break
+                length += 1
+            if best_length < length < len(tokens):
+                best, best_length = candidate, length
+        if not best:
+            return None
+        
+        prefix_file = await asyncio.to_thread(self.cache_manager.get_cached_audio, best["cache_key"])
+        if not prefix_file:
+            return None
+        
+        remainder = " ".join(original_words[tokens[best_length][0]:])
+        suffix_file, suffix_subs = await self.generate_speech(
+            remainder, voice_id, rate, pitch, volume, priority=priority, phrase_reuse=False,
+            client_id=client_id, deadline=deadline, word_boundaries=True
+        )
+        if not suffix_file:
+            self.release_audio_file(prefix_file)
+            return None
+        
+        try:
+            prefix_audio = AudioSegment.from_file(prefix_file)
+            suffix_audio = AudioSegment.from_file(suffix_file)
+            
+            # Cắt ở giữa khoảng lặng sau từ cuối cùng của prefix chung
+            units = best["words"]
+            cut = units[best_length - 1]["end"]
+            if best_length < len(units):
+                cut = (cut + units[best_length]["start"]) / 2
+            prefix_audio = prefix_audio[:int(cut)]
+            
+            crossfade = min(TTSConfig.PHRASE_REUSE_CROSSFADE, len(prefix_audio), len(suffix_audio))
+            combined = prefix_audio.append(suffix_audio, crossfade=crossfade)
+            
+            temp_file = f"temp/splice_{uuid.uuid4().hex[:8]}_{int(time.time())}.mp3"
+            combined.export(temp_file, format="mp3", bitrate="256k")
+        except Exception as e:
+            print(f"Error splicing cached phrases: {e}")
+            return None
+        finally:
+            self.release_audio_file(prefix_file)
+            self.release_audio_file(suffix_file)
+        
+        # Subtitles/boundaries tính bằng ms, giữ nguyên chữ gốc của câu (không phải token đã chuẩn hóa)
+        offset = len(prefix_audio) - crossfade
+        subtitles = [
+            {"text": original_words[tokens[k][0]], "start": unit["start"], "end": unit["end"]}
+            for k, unit in enumerate(units[:best_length])
+        ]
+        for sub in suffix_subs:
+            subtitles.append(dict(sub, start=sub["start"] + offset, end=sub["end"] + offset))
+        
+        await self._save_result_to_cache(cache_key, temp_file, voice_id, text)
+        if suffix_subs:
+            self._record_phrase_units(text, voice_id, rate, pitch, volume, cache_key, subtitles)
+        
+        print(f"Spliced sentence from cached phrase ({best_length} words reused)")
+        return temp_file, subtitles
+    
+    async def _synthesize(self, text: str, voice_id: str, rate: int, pitch: int, volume: int,
+                          cache_key: str, priority: int, word_boundaries: bool = False,
+                          client_id: str = None, deadline: float = None):
+        """Gọi edge-tts, xử lý audio và lưu vào cache"""
+        try:
             # Tạo unique ID để tránh cache
             unique_id = uuid.uuid4().hex[:8]
             
@@ -1178,26 +3081,51 @@ class TTSProcessor:
             pitch_str = f"+{pitch}Hz" if pitch >= 0 else f"{pitch}Hz"
             
             # Tạo communicate object
+            communicate_options = {"boundary": "WordBoundary"} if word_boundaries else {}
             communicate = edge_tts.Communicate(
                 text, 
                 voice_id, 
                 rate=rate_str, 
-                pitch=pitch_str
+                pitch=pitch_str,
+                **communicate_options
             )
             
             audio_chunks = []
             subtitles = []
             
+            if self.is_negatively_cached(cache_key):
+                return None, []
+            if self.circuit_breaker.is_open():
+                raise UpstreamUnavailableError("Upstream TTS is unavailable")
+            
             # Stream audio data
-            async for chunk in communicate.stream():
-                if chunk["type"] == "audio":
-                    audio_chunks.append(chunk["data"])
-                elif chunk["type"] == "WordBoundary":
-                    subtitles.append({
-                        "text": chunk["text"],
-                        "start": chunk["offset"],
-                        "end": chunk["offset"] + chunk["duration"]
-                    })
+            async with self.upstream_limiter.slot(priority, client_id, deadline):
+                if not self.circuit_breaker.allow_request():
+                    raise UpstreamUnavailableError("Upstream TTS is unavailable")
+                try:
+                    async for chunk in communicate.stream():
+                        if chunk["type"] == "audio":
+                            audio_chunks.append(chunk["data"])
+                        elif chunk["type"] == "WordBoundary":
+                            # offset/duration của edge-tts tính bằng 100ns, subtitles dùng ms
+                            subtitles.append({
+                                "text": chunk["text"],
+                                "start": chunk["offset"] / 10000,
+                                "end": (chunk["offset"] + chunk["duration"]) / 10000
+                            })
+                except edge_tts.exceptions.NoAudioReceived:
+                    # Upstream vẫn phản hồi, lỗi do nội dung câu
+                    self.circuit_breaker.record_success()
+                    self.remember_failure(cache_key)
+                    return None, []
+                except asyncio.CancelledError:
+                    self.circuit_breaker.release_probe()
+                    raise
+                except Exception:
+                    self.circuit_breaker.record_failure()
+                    self.remember_failure(cache_key)
+                    raise
+                self.circuit_breaker.record_success()
             
             if not audio_chunks:
                 return None, []
@@ -1211,21 +3139,13 @@ class TTSProcessor:
             
             # Xử lý audio
             try:
-                audio = AudioSegment.from_file(temp_file)
-                
-                # Điều chỉnh volume
-                volume_adjustment = min(max(volume - 100, -50), 10)
-                audio = audio + volume_adjustment
-                
-                # Áp dụng các hiệu ứng audio cơ bản
-                audio = normalize(audio)
-                audio = compress_dynamic_range(audio, threshold=-20.0, ratio=4.0)
-                
-                # Xuất với chất lượng cao
-                audio.export(temp_file, format="mp3", bitrate="256k")
+                # ffmpeg/pydub chạy trong thread, không chặn event loop (và deadline của request khác)
+                await asyncio.to_thread(self._postprocess_audio, temp_file, volume)
                 
                 # Lưu vào cache
-                self.cache_manager.save_to_cache(cache_key, temp_file)
+                cache_file = await self._save_result_to_cache(cache_key, temp_file, voice_id, text)
+                if cache_file and word_boundaries and subtitles:
+                    self._record_phrase_units(text, voice_id, rate, pitch, volume, cache_key, subtitles)
                 
                 return temp_file, subtitles
             except Exception as e:
@@ -1233,10 +3153,27 @@ class TTSProcessor:
                 # Trả về file gốc nếu xử lý lỗi
                 return temp_file, subtitles
             
+        except UpstreamUnavailableError:
+            raise
         except Exception as e:
             print(f"Error generating speech: {e}")
             return None, []
     
+    @staticmethod
+    def _postprocess_audio(temp_file: str, volume: int):
+        audio = AudioSegment.from_file(temp_file)
+        
+        # Điều chỉnh volume
+        volume_adjustment = min(max(volume - 100, -50), 10)
+        audio = audio + volume_adjustment
+        
+        # Áp dụng các hiệu ứng audio cơ bản
+        audio = normalize(audio)
+        audio = compress_dynamic_range(audio, threshold=-20.0, ratio=4.0)
+        
+        # Xuất với chất lượng cao
+        audio.export(temp_file, format="mp3", bitrate="256k")
+    
     def generate_srt(self, subtitles: List[dict], output_path: str):
         """Generate SRT file from subtitles"""
         if not subtitles:
@@ -1259,23 +3196,37 @@ class TTSProcessor:
             return None
     
     async def process_single_voice(self, text: str, voice_id: str, rate: int, pitch: int, 
-                                 volume: int, pause: int, output_format: str = "mp3", task_id: str = None):
-        """Process text with single voice - Optimized version"""
+                                 volume: int, pause: int, output_format: str = "mp3", task_id: str = None,
+                                 report: dict = None, phrase_reuse: bool = False,
+                                 priority: int = UpstreamLimiter.PRIORITY_INTERACTIVE, client_id: str = None,
+                                 output_dir: str = None, checkpoint: JobCheckpoint = None,
+                                 deadline: float = None):
+        """Process text with single voice - Optimized version.
+        
+        With a deadline (time.monotonic), all sentences are dispatched at once and the
+        audio is built from those finished in time to assemble it before the deadline;
+        the rest are reported as missing.
+        """
         # Xóa cache và file cũ trước khi bắt đầu
         self.cleanup_temp_files()
         
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-        output_dir = f"outputs/single_{timestamp}"
+        if not output_dir:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+            output_dir = f"outputs/single_{timestamp}"
         os.makedirs(output_dir, exist_ok=True)
+        if task_id:
+            self.job_dirs[task_id] = output_dir
         
         # Xử lý text
-        sentences = self.text_processor.split_sentences(text)
-        
         # Giới hạn số lượng câu để xử lý nhanh hơn
-        MAX_SENTENCES = 50  # Giảm cho Render
+        MAX_SENTENCES = TTSConfig.MAX_SENTENCES
+        # Chỉ tách tới câu thứ MAX_SENTENCES + 1 (đủ để biết có bị cắt hay không)
+        sentences = list(itertools.islice(self.text_processor.iter_sentences(text), MAX_SENTENCES + 1))
         if len(sentences) > MAX_SENTENCES:
             sentences = sentences[:MAX_SENTENCES]
             print(f"Processing {MAX_SENTENCES} sentences only for performance")
+        self._report_resume(task_id, checkpoint, len(sentences))
+        progressive = ProgressiveOutput(task_id, output_dir, len(sentences)) if task_id else None
         
         # Tạo semaphore để giới hạn concurrent requests
         SEMAPHORE = asyncio.Semaphore(2)  # Giảm concurrent requests
@@ -1288,27 +3239,46 @@ class TTSProcessor:
                     task_manager.update_task(task_id, progress=progress, 
                                            message=f"Processing sentence {index+1}/{len(sentences)}")
                 
-                return await self.generate_speech(sentence, voice_id, rate, pitch, volume)
+                return await self.generate_unit(checkpoint, index, sentence, voice_id, rate, pitch, volume,
+                                                priority=priority, phrase_reuse=phrase_reuse,
+                                                client_id=client_id)
         
         # Xử lý các câu theo batch
         audio_segments = []
         all_subtitles = []
-        
-        for i in range(0, len(sentences), 2):  # Batch size = 2 (giảm cho Render)
-            batch = sentences[i:i+2]
-            batch_tasks = [bounded_generate(s, i+j) for j, s in enumerate(batch)]
-            batch_results = await asyncio.gather(*batch_tasks, return_exceptions=True)
+        missing = []
+        
+        # Có deadline: gửi mọi câu cùng lúc, limiter xếp theo deadline
+        batch_size = max(1, len(sentences)) if deadline is not None else 2  # Batch size = 2 (giảm cho Render)
+        if deadline is not None:
+            budget = deadline - time.monotonic()
+            unit_deadline = deadline - self.assembly_margin(0, budget)
+        for i in range(0, len(sentences), batch_size):
+            batch = sentences[i:i+batch_size]
+            if deadline is None:
+                batch_tasks = [bounded_generate(s, i+j) for j, s in enumerate(batch)]
+                batch_results = await asyncio.gather(*batch_tasks, return_exceptions=True)
+            else:
+                batch_results = await self._gather_until(deadline, [
+                    self.generate_unit(checkpoint, i + j, s, voice_id, rate, pitch, volume,
+                                       priority=priority, phrase_reuse=phrase_reuse,
+                                       client_id=client_id, deadline=unit_deadline)
+                    for j, s in enumerate(batch)
+                ], budget, client_id)
             
-            for result in batch_results:
+            for j, result in enumerate(batch_results):
                 if isinstance(result, tuple) and len(result) == 2:
                     temp_file, subs = result
                     if temp_file and os.path.exists(temp_file):
                         try:
-                            audio = AudioSegment.from_file(temp_file)
+                            audio = await asyncio.to_thread(AudioSegment.from_file, temp_file)
                             audio_segments.append(audio)
+                            if progressive:
+                                progressive.append(temp_file, len(audio), pause)
                             
-                            # Điều chỉnh thời gian cho subtitles
-                            current_time = sum(len(a) for a in audio_segments[:-1])
+                            # Điều chỉnh thời gian cho subtitles (ms): các segment trước và pause giữa chúng
+                            current_time = (sum(len(a) for a in audio_segments[:-1])
+                                            + pause * (len(audio_segments) - 1))
                             for sub in subs:
                                 if isinstance(sub, dict):
                                     sub["start"] += current_time
@@ -1316,36 +3286,29 @@ class TTSProcessor:
                                     all_subtitles.append(sub)
                             
                             # Xóa file tạm ngay
-                            try:
-                                os.remove(temp_file)
-                            except:
-                                pass
+                            self.release_audio_file(temp_file)
+                            self._report_unit(task_id, i + j, len(sentences), batch[j])
+                            continue
                         except Exception as e:
                             print(f"Error processing audio segment: {e}")
+                
+                unit = self._missing_unit(i + j, batch[j], result)
+                missing.append(unit)
+                self._report_unit(task_id, i + j, len(sentences), batch[j], unit)
+        
+        if report is not None:
+            report["missing"] = missing
         
         if not audio_segments:
             return None, None
         
-        # Kết hợp các audio segment với pause
-        combined = AudioSegment.empty()
-        current_time = 0
-        
-        for i, audio in enumerate(audio_segments):
-            audio = audio.fade_in(50).fade_out(50)
-            combined += audio
-            current_time += len(audio)
-            
-            if i < len(audio_segments) - 1:
-                combined += AudioSegment.silent(duration=pause)
-                current_time += pause
-        
-        # Xuất file audio
+        # Xuất file audio (ghép/encode trong thread, không chặn event loop)
         file_id = uuid.uuid4().hex
         output_file = os.path.join(
             output_dir,
             f"single_voice_{file_id}.{output_format}"
         )
-        combined.export(output_file, format=output_format, bitrate="192k")  # Giảm bitrate
+        await asyncio.to_thread(self._export_single_voice, audio_segments, pause, output_file, output_format)
         
         # Tạo file subtitle
         srt_file = self.generate_srt(all_subtitles, output_file)
@@ -1357,14 +3320,93 @@ class TTSProcessor:
         
         return output_file, srt_file
     
+    @staticmethod
+    def _export_single_voice(audio_segments: list, pause: int, output_file: str, output_format: str):
+        """Kết hợp các audio segment với pause và ghi ra output_file"""
+        combined = AudioSegment.empty()
+        for i, audio in enumerate(audio_segments):
+            combined += audio.fade_in(50).fade_out(50)
+            if i < len(audio_segments) - 1:
+                combined += AudioSegment.silent(duration=pause)
+        combined.export(output_file, format=output_format, bitrate="192k")  # Giảm bitrate
+    
+    async def process_batch(self, items: List[dict], task_id: str = None,
+                            priority: int = UpstreamLimiter.PRIORITY_BULK, client_id: str = None,
+                            checkpoint: JobCheckpoint = None):
+        """Process many single-voice items in one job; identical items are generated once"""
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        output_dir = f"outputs/batch_{timestamp}"
+        os.makedirs(output_dir, exist_ok=True)
+        if task_id:
+            self.job_dirs[task_id] = output_dir
+        
+        # Gom item trùng nhau (cùng text, voice, setting và format)
+        groups = {}
+        for index, item in enumerate(items):
+            key = (item["text"], item["voice"], item["rate"], item["pitch"],
+                   item["volume"], item["pause"], item["format"])
+            groups.setdefault(key, []).append(index)
+        
+        manifest = [None] * len(items)
+        semaphore = asyncio.Semaphore(TTSConfig.BATCH_ITEM_CONCURRENCY)
+        completed = 0
+        
+        async def run_group(indexes: List[int]):
+            nonlocal completed
+            item = items[indexes[0]]
+            report = {}
+            async with semaphore:
+                try:
+                    audio_file, srt_file = await self.process_single_voice(
+                        item["text"], item["voice"], item["rate"], item["pitch"], item["volume"],
+                        item["pause"], item["format"], report=report,
+                        priority=priority, client_id=client_id, output_dir=output_dir,
+                        checkpoint=checkpoint.child(f"item_{indexes[0]:05d}") if checkpoint else None
+                    )
+                except Exception as e:
+                    print(f"Error processing batch item {indexes[0]}: {e}")
+                    audio_file, srt_file = None, None
+            
+            entry = {"status": "completed" if audio_file else "failed"}
+            if audio_file:
+                entry["audio_url"] = f"/download/{os.path.basename(audio_file)}"
+                entry["srt_url"] = f"/download/{os.path.basename(srt_file)}" if srt_file else None
+            if report.get("missing"):
+                entry["missing_sentences"] = report["missing"]
+            for position, index in enumerate(indexes):
+                manifest[index] = dict(entry, index=index)
+                if position:
+                    manifest[index]["duplicate_of"] = indexes[0]
+            
+            completed += 1
+            if task_id and task_manager:
+                task_manager.update_task(task_id, progress=int(completed / len(groups) * 95),
+                                       message=f"Processed item {completed}/{len(groups)}")
+                task_manager.add_event(task_id, "item", dict(entry, indexes=indexes))
+        
+        await asyncio.gather(*(run_group(indexes) for indexes in groups.values()))
+        
+        manifest_file = os.path.join(output_dir, f"manifest_{task_id or timestamp}.json")
+        with open(manifest_file, "w", encoding="utf-8") as f:
+            json.dump({"items": manifest, "unique_items": len(groups)}, f, ensure_ascii=False, indent=2)
+        
+        if task_id and task_manager:
+            task_manager.update_task(task_id, progress=100, message="Batch generation completed")
+        
+        return manifest, manifest_file, len(groups)
+    
     async def process_multi_voice(self, text: str, voices_config: dict, pause: int, 
-                                repeat: int, output_format: str = "mp3", task_id: str = None):
+                                repeat: int, output_format: str = "mp3", task_id: str = None,
+                                report: dict = None, priority: int = UpstreamLimiter.PRIORITY_INTERACTIVE,
+                                client_id: str = None, checkpoint: JobCheckpoint = None):
         """Process text with multiple voices"""
         self.cleanup_temp_files()
         
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
         output_dir = f"outputs/multi_{timestamp}"
         os.makedirs(output_dir, exist_ok=True)
+        if task_id:
+            self.job_dirs[task_id] = output_dir
         
         # Phân tích dialogue
         dialogues = []
@@ -1376,7 +3418,7 @@ class TTSProcessor:
             if not line:
                 continue
             
-            char_match = re.match(r'^(CHAR\d+|NARRATOR):\s*(.+)', line, re.IGNORECASE)
+            char_match = TextProcessor.RE_MULTI_VOICE_TURN.match(line)
             if char_match:
                 if current_char:
                     dialogues.append((current_char, ' '.join(current_text)))
@@ -1392,13 +3434,16 @@ class TTSProcessor:
             return None, None
         
         # Giới hạn số dialogues
-        MAX_DIALOGUES = 20
+        MAX_DIALOGUES = TTSConfig.MAX_DIALOGUES
         if len(dialogues) > MAX_DIALOGUES:
             dialogues = dialogues[:MAX_DIALOGUES]
+        self._report_resume(task_id, checkpoint, len(dialogues))
+        progressive = ProgressiveOutput(task_id, output_dir, len(dialogues)) if task_id else None
         
         # Tạo audio cho mỗi dialogue
         audio_segments = []
         all_subtitles = []
+        missing = []
         
         for i, (char, dialogue_text) in enumerate(dialogues):
             if task_id and task_manager:
@@ -1413,23 +3458,40 @@ class TTSProcessor:
             else:  # NARRATOR or others
                 config = voices_config["char1"]
             
-            temp_file, subs = await self.generate_speech(
-                dialogue_text, 
-                config["voice"], 
-                config["rate"], 
-                config["pitch"], 
-                config["volume"]
-            )
+            try:
+                temp_file, subs = await self.generate_unit(
+                    checkpoint,
+                    i,
+                    dialogue_text, 
+                    config["voice"], 
+                    config["rate"], 
+                    config["pitch"], 
+                    config["volume"],
+                    priority=priority,
+                    client_id=client_id
+                )
+            except UpstreamUnavailableError as e:
+                temp_file, subs = None, e
             
             if temp_file:
                 audio = AudioSegment.from_file(temp_file)
                 audio_segments.append((char, audio))
+                if progressive:
+                    progressive.append(temp_file, len(audio), pause)
                 
                 for sub in subs:
                     sub["speaker"] = char
                     all_subtitles.append(sub)
                 
-                os.remove(temp_file)
+                self.release_audio_file(temp_file)
+                self._report_unit(task_id, i, len(dialogues), dialogue_text)
+            else:
+                unit = dict(self._missing_unit(i, dialogue_text, subs), speaker=char)
+                missing.append(unit)
+                self._report_unit(task_id, i, len(dialogues), dialogue_text, unit)
+        
+        if report is not None:
+            report["missing"] = missing
         
         if not audio_segments:
             return None, None
@@ -1479,13 +3541,17 @@ class TTSProcessor:
         return output_file, srt_file
     
     async def process_qa_dialogue(self, text: str, qa_config: dict, pause_q: int, 
-                                pause_a: int, repeat: int, output_format: str = "mp3", task_id: str = None):
+                                pause_a: int, repeat: int, output_format: str = "mp3", task_id: str = None,
+                                report: dict = None, priority: int = UpstreamLimiter.PRIORITY_INTERACTIVE,
+                                client_id: str = None, checkpoint: JobCheckpoint = None):
         """Process Q&A dialogue"""
         self.cleanup_temp_files()
         
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
         output_dir = f"outputs/qa_{timestamp}"
         os.makedirs(output_dir, exist_ok=True)
+        if task_id:
+            self.job_dirs[task_id] = output_dir
         
         # Phân tích Q&A
         dialogues = []
@@ -1497,7 +3563,7 @@ class TTSProcessor:
             if not line:
                 continue
             
-            speaker_match = re.match(r'^(Q|A):\s*(.+)', line, re.IGNORECASE)
+            speaker_match = TextProcessor.RE_QA_TURN.match(line)
             if speaker_match:
                 if current_speaker:
                     dialogues.append((current_speaker, ' '.join(current_text)))
@@ -1513,13 +3579,16 @@ class TTSProcessor:
             return None, None
         
         # Giới hạn số dialogues
-        MAX_DIALOGUES = 10
+        MAX_DIALOGUES = TTSConfig.MAX_QA_DIALOGUES
         if len(dialogues) > MAX_DIALOGUES:
             dialogues = dialogues[:MAX_DIALOGUES]
+        self._report_resume(task_id, checkpoint, len(dialogues))
+        progressive = ProgressiveOutput(task_id, output_dir, len(dialogues)) if task_id else None
         
         # Tạo audio
         audio_segments = []
         all_subtitles = []
+        missing = []
         
         for i, (speaker, dialogue_text) in enumerate(dialogues):
             if task_id and task_manager:
@@ -1534,23 +3603,40 @@ class TTSProcessor:
                 config = qa_config["answer"]
                 pause = pause_a
             
-            temp_file, subs = await self.generate_speech(
-                dialogue_text,
-                config["voice"],
-                config["rate"],
-                config["pitch"],
-                config["volume"]
-            )
+            try:
+                temp_file, subs = await self.generate_unit(
+                    checkpoint,
+                    i,
+                    dialogue_text,
+                    config["voice"],
+                    config["rate"],
+                    config["pitch"],
+                    config["volume"],
+                    priority=priority,
+                    client_id=client_id
+                )
+            except UpstreamUnavailableError as e:
+                temp_file, subs = None, e
             
             if temp_file:
                 audio = AudioSegment.from_file(temp_file)
                 audio_segments.append((speaker, audio, pause))
+                if progressive:
+                    progressive.append(temp_file, len(audio), pause)
                 
                 for sub in subs:
                     sub["speaker"] = speaker
                     all_subtitles.append(sub)
                 
-                os.remove(temp_file)
+                self.release_audio_file(temp_file)
+                self._report_unit(task_id, i, len(dialogues), dialogue_text)
+            else:
+                unit = dict(self._missing_unit(i, dialogue_text, subs), speaker=speaker)
+                missing.append(unit)
+                self._report_unit(task_id, i, len(dialogues), dialogue_text, unit)
+        
+        if report is not None:
+            report["missing"] = missing
         
         if not audio_segments:
             return None, None
@@ -1599,37 +3685,687 @@ class TTSProcessor:
         
         return output_file, srt_file
     
-    def cleanup_temp_files(self):
-        """Dọn dẹp file tạm"""
-        try:
-            temp_files = glob.glob("temp/*.mp3")
-            for file in temp_files:
-                try:
-                    if os.path.exists(file):
-                        file_age = time.time() - os.path.getmtime(file)
-                        if file_age > 3600:  # Xóa file cũ hơn 1 giờ
-                            os.remove(file)
-                except:
-                    pass
-        except Exception as e:
-            print(f"Error cleaning temp files: {e}")
+    async def warm_cache(self, text, voice_id: str, rate: int = 0, pitch: int = 0,
+                         volume: int = 100, task_id: str = None, client_id: str = None) -> dict:
+        """Tạo sẵn cache cho danh sách câu với độ ưu tiên thấp.
+        
+        text là str hoặc file đã mở (tài liệu tải lên): câu được tách dần khi xử lý,
+        không giữ cả tài liệu trong bộ nhớ.
+        """
+        # Lượt đầu chỉ đếm câu (bỏ câu trùng lặp, giữ nguyên thứ tự) để báo tiến độ
+        total = await asyncio.to_thread(count_units, text, True)
+        if not isinstance(text, str):
+            text.seek(0)
+        summary = {"total": total, "cached": 0, "generated": 0, "failed": 0}
+        
+        for index, sentence in enumerate(self.text_processor.iter_unique_sentences(text)):
+            cache_key = self.cache_manager.get_cache_key(sentence, voice_id, rate, pitch, volume)
+            if await asyncio.to_thread(self.cache_manager.has_cached_audio, cache_key):
+                summary["cached"] += 1
+            else:
+                try:
+                    audio_file, _ = await self.generate_speech(
+                        sentence, voice_id, rate, pitch, volume,
+                        priority=UpstreamLimiter.PRIORITY_BACKGROUND,
+                        client_id=client_id
+                    )
+                except UpstreamUnavailableError:
+                    audio_file = None
+                if audio_file:
+                    summary["generated"] += 1
+                    self.release_audio_file(audio_file)
+                else:
+                    summary["failed"] += 1
+            
+            message = f"Warming cache {index+1}/{total}"
+            if task_id and task_manager:
+                task_manager.update_task(task_id, progress=int(((index + 1) / total) * 100),
+                                       message=message)
+            elif (index + 1) % 10 == 0 or index + 1 == total:
+                print(message)
+        
+        return summary
+    
+    @staticmethod
+    def _missing_unit(index: int, text: str, result) -> dict:
+        """Mô tả một câu không tạo được audio (để báo cáo trong kết quả task)"""
+        if isinstance(result, UpstreamUnavailableError):
+            reason = "upstream_unavailable"
+        elif isinstance(result, DeadlineExceededError):
+            reason = "deadline"
+        else:
+            reason = "synthesis_failed"
+        return {"index": index, "text": text, "reason": reason}
+    
+    @staticmethod
+    def _report_unit(task_id: Optional[str], index: int, total: int, text: str, missing: dict = None):
+        """Sự kiện hoàn thành từng câu cho stream /api/task/{task_id}/events"""
+        if not task_id or not task_manager:
+            return
+        event = {"index": index, "total": total, "text": text[:80], "status": "done"}
+        if missing:
+            event["status"] = "missing"
+            event["reason"] = missing["reason"]
+        task_manager.add_event(task_id, "sentence", event)
+    
+    def discard_job_files(self, task_id: str):
+        """Xóa output, checkpoint và file tải lên của job bị hủy"""
+        output_dir = self.job_dirs.pop(task_id, None)
+        if output_dir and os.path.isdir(output_dir):
+            shutil.rmtree(output_dir, ignore_errors=True)
+        JobCheckpoint.for_task(task_id).discard()
+        discard_job_upload(task_id)
+    
+    def prune_checkpoints(self) -> int:
+        """Xóa checkpoint của job không còn chờ/chạy (ví dụ hết số lần thử sau khi worker chết)"""
+        # Liệt kê thư mục trước rồi mới đọc trạng thái: job bắt đầu sau đó không bị xóa nhầm
+        names = os.listdir(TTSConfig.CHECKPOINT_DIR)
+        active = {task["id"] for task in task_manager.get_tasks(names)
+                  if task["status"] not in TaskManager.TERMINAL_STATES}
+        removed = 0
+        for name in names:
+            if name not in active:
+                shutil.rmtree(os.path.join(TTSConfig.CHECKPOINT_DIR, name), ignore_errors=True)
+                removed += 1
+        return removed
+    
+    def prune_uploads(self) -> int:
+        """Xóa file tải lên của job đã kết thúc hoặc không còn tồn tại"""
+        # File vừa ghi có thể thuộc request chưa kịp tạo task: bỏ qua file mới
+        cutoff = time.time() - TTSConfig.TASK_SWEEP_INTERVAL
+        names = []
+        for name in os.listdir(TTSConfig.UPLOAD_DIR):
+            try:
+                if os.path.getmtime(os.path.join(TTSConfig.UPLOAD_DIR, name)) < cutoff:
+                    names.append(name)
+            except FileNotFoundError:
+                # Job vừa kết thúc và đã tự xóa file của nó
+                continue
+        task_ids = [os.path.splitext(name)[0] for name in names]
+        active = {task["id"] for task in task_manager.get_tasks(task_ids)
+                  if task["status"] not in TaskManager.TERMINAL_STATES}
+        removed = 0
+        for task_id in task_ids:
+            if task_id not in active:
+                discard_job_upload(task_id)
+                removed += 1
+        return removed
+    
+    async def _save_result_to_cache(self, cache_key: str, temp_file: str, voice_id: str, text: str):
+        """Lưu vào cache; nếu job bị hủy giữa chừng vẫn lưu xong rồi mới xóa file tạm"""
+        future = asyncio.ensure_future(
+            asyncio.to_thread(self.cache_manager.save_to_cache, cache_key, temp_file, voice_id, text)
+        )
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            future.add_done_callback(lambda _: self.release_audio_file(temp_file))
+            raise
+    
+    def release_audio_file(self, file_path: str):
+        """Xóa file tạm sau khi dùng, bỏ qua file thuộc cache hoặc checkpoint"""
+        if (not file_path or self.cache_manager.is_cache_file(file_path)
+                or JobCheckpoint.is_checkpoint_file(file_path)):
+            return
+        try:
+            os.remove(file_path)
+        except OSError:
+            pass
+    
+    def cleanup_temp_files(self):
+        """Dọn dẹp file tạm"""
+        try:
+            temp_files = glob.glob("temp/*.mp3")
+            for file in temp_files:
+                try:
+                    if os.path.exists(file):
+                        file_age = time.time() - os.path.getmtime(file)
+                        if file_age > 3600:  # Xóa file cũ hơn 1 giờ
+                            os.remove(file)
+                except:
+                    pass
+        except Exception as e:
+            print(f"Error cleaning temp files: {e}")
+    
+    def cleanup_old_outputs(self, hours_old: int = 24):
+        """Dọn dẹp outputs cũ"""
+        try:
+            if os.path.exists("outputs"):
+                now = time.time()
+                for folder_name in os.listdir("outputs"):
+                    folder_path = os.path.join("outputs", folder_name)
+                    if os.path.isdir(folder_path):
+                        folder_age = now - os.path.getmtime(folder_path)
+                        if folder_age > hours_old * 3600:
+                            try:
+                                shutil.rmtree(folder_path)
+                            except:
+                                pass
+        except Exception as e:
+            print(f"Error cleaning old outputs: {e}")
+
+# ==================== JOB WORKER ====================
+def attach_missing_report(result: dict, report: dict) -> dict:
+    """Thêm danh sách câu không tạo được audio vào kết quả task"""
+    missing = report.get("missing") or []
+    if missing:
+        degraded = any(unit["reason"] == "upstream_unavailable" for unit in missing)
+        result["missing_sentences"] = missing
+        result["degraded"] = degraded
+        result["partial"] = any(unit["reason"] == "deadline" for unit in missing)
+        if result["success"]:
+            result["message"] += f" ({len(missing)} sentence(s) missing)"
+        elif degraded:
+            result["message"] = "Upstream TTS is unavailable and no cached audio was found"
+        elif result["partial"]:
+            result["message"] = "No sentence finished before the deadline"
+    return result
+
+def build_audio_result(audio_file: Optional[str], srt_file: Optional[str], message: str) -> dict:
+    """Kết quả task cho job tạo audio"""
+    if audio_file:
+        return {
+            "success": True,
+            "audio_url": f"/download/{os.path.basename(audio_file)}",
+            "srt_url": f"/download/{os.path.basename(srt_file)}" if srt_file else None,
+            "message": message
+        }
+    return {
+        "success": False,
+        "message": "Failed to generate audio"
+    }
+
+async def run_single_voice_job(job: TaskRecord) -> dict:
+    task_id, params = job.id, job.params
+    report = {}
+    audio_file, srt_file = await tts_processor.process_single_voice(
+        params["text"], params["voice_id"], params["rate"], params["pitch"], params["volume"],
+        params["pause"], params["output_format"], task_id,
+        report=report, phrase_reuse=params.get("phrase_reuse", False),
+        priority=job.priority, client_id=job.client_id, checkpoint=JobCheckpoint.for_task(task_id) if task_id else None
+    )
+    result = build_audio_result(audio_file, srt_file, "Audio generated successfully")
+    return attach_missing_report(result, report)
+
+async def run_multi_voice_job(job: TaskRecord) -> dict:
+    task_id, params = job.id, job.params
+    report = {}
+    audio_file, srt_file = await tts_processor.process_multi_voice(
+        params["text"], params["voices_config"], params["pause"], params["repeat"],
+        params["output_format"], task_id, report=report,
+        priority=job.priority, client_id=job.client_id, checkpoint=JobCheckpoint.for_task(task_id) if task_id else None
+    )
+    result = build_audio_result(audio_file, srt_file, "Multi-voice audio generated successfully")
+    return attach_missing_report(result, report)
+
+async def run_qa_dialogue_job(job: TaskRecord) -> dict:
+    task_id, params = job.id, job.params
+    report = {}
+    audio_file, srt_file = await tts_processor.process_qa_dialogue(
+        params["text"], params["qa_config"], params["pause_q"], params["pause_a"],
+        params["repeat"], params["output_format"], task_id, report=report,
+        priority=job.priority, client_id=job.client_id, checkpoint=JobCheckpoint.for_task(task_id) if task_id else None
+    )
+    result = build_audio_result(audio_file, srt_file, "Q&A dialogue audio generated successfully")
+    return attach_missing_report(result, report)
+
+async def run_cache_warmup_job(job: TaskRecord) -> dict:
+    task_id, params = job.id, job.params
+    # Tài liệu tải lên được đọc dần từ đĩa thay vì lưu trong params
+    source = open_job_upload(task_id) if params.get("text_upload") else nullcontext(params["text"])
+    with source as text:
+        summary = await tts_processor.warm_cache(
+            text, params["voice_id"], params["rate"], params["pitch"], params["volume"], task_id,
+            client_id=job.client_id
+        )
+    return {
+        "success": True,
+        "summary": summary,
+        "message": f"Cache warm-up finished: {summary['generated']} generated, "
+                   f"{summary['cached']} already cached, {summary['failed']} failed"
+    }
+
+async def run_batch_job(job: TaskRecord) -> dict:
+    task_id, params = job.id, job.params
+    manifest, manifest_file, unique_items = await tts_processor.process_batch(
+        params["items"], task_id, priority=job.priority, client_id=job.client_id,
+        checkpoint=JobCheckpoint.for_task(task_id) if task_id else None
+    )
+    succeeded = sum(1 for entry in manifest if entry["status"] == "completed")
+    # Item có audio nhưng thiếu câu (lỗi synthesis, upstream) không được tính là đủ
+    partial = sum(1 for entry in manifest if entry["status"] == "completed" and entry.get("missing_sentences"))
+    message = f"Batch finished: {succeeded}/{len(manifest)} items generated"
+    if partial:
+        message += f", {partial} with missing sentences"
+    return {
+        "success": succeeded > 0,
+        "total": len(manifest),
+        "succeeded": succeeded,
+        "partial": partial,
+        "failed": len(manifest) - succeeded,
+        "unique_items": unique_items,
+        "manifest_url": f"/download/{os.path.basename(manifest_file)}",
+        "archive_url": f"/api/task/{task_id}/archive",
+        "message": message
+    }
+
+# Loại job -> handler; params được lưu trong job store nên job chạy lại được sau restart
+JOB_HANDLERS = {
+    "single_voice": run_single_voice_job,
+    "multi_voice": run_multi_voice_job,
+    "qa_dialogue": run_qa_dialogue_job,
+    "cache_warmup": run_cache_warmup_job,
+    "batch": run_batch_job
+}
+
+class JobWorker:
+    """Lấy job từ TaskManager, chạy handler theo loại job và giữ lease bằng heartbeat"""
+    def __init__(self, task_manager: TaskManager, concurrency: int = TTSConfig.JOB_CONCURRENCY,
+                 reserved_interactive: int = TTSConfig.JOB_RESERVED_INTERACTIVE):
+        self.task_manager = task_manager
+        self.concurrency = concurrency
+        # Job bulk/background không chiếm hết slot, job ngắn luôn được nhận ngay
+        self.max_bulk = max(1, concurrency - reserved_interactive)
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.running: Dict[str, asyncio.Task] = {}
+        self.cancelled = set()
+        self.wakeup = None
+    
+    def notify(self):
+        """Báo có job mới để không phải chờ tới lần poll tiếp theo"""
+        if self.wakeup is not None:
+            self.wakeup.set()
+    
+    async def run(self):
+        self.wakeup = asyncio.Event()
+        heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+        self._publish_status()
+        try:
+            while True:
+                self.wakeup.clear()
+                while len(self.running) < self.concurrency:
+                    max_priority = None
+                    if len(self.running) >= self.max_bulk:
+                        max_priority = UpstreamLimiter.PRIORITY_INTERACTIVE
+                    job = self.task_manager.claim_next(self.worker_id, max_priority=max_priority)
+                    if job is None:
+                        break
+                    self.running[job.id] = asyncio.create_task(self._execute(job))
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), TTSConfig.JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                # Job bị hủy từ process khác (API) được phát hiện qua job store
+                if self.running:
+                    for task_id in self.task_manager.cancelled_jobs(self.worker_id):
+                        self.cancel(task_id)
+        finally:
+            heartbeat_task.cancel()
+            await self._release_running()
+            self.task_manager.remove_worker(self.worker_id)
+    
+    def cancel(self, task_id: str) -> bool:
+        """Dừng job đang chạy: hủy asyncio task, các stream upstream và câu đang chờ slot"""
+        task = self.running.get(task_id)
+        if task is None or task_id in self.cancelled:
+            return False
+        self.cancelled.add(task_id)
+        task.cancel()
+        return True
+    
+    async def _execute(self, job: TaskRecord):
+        task_id = job.id
+        try:
+            handler = JOB_HANDLERS.get(job.type)
+            if handler is None:
+                raise ValueError(f"Unknown job type: {job.type}")
+            result = await handler(job)
+            self.task_manager.update_task(task_id, status="completed", result=result)
+        except asyncio.CancelledError:
+            if task_id not in self.cancelled:
+                # Worker dừng: giữ checkpoint để lần chạy sau tiếp tục
+                raise
+            # Job bị người dùng hủy: dọn file của job, không chạy lại
+            await asyncio.to_thread(tts_processor.discard_job_files, task_id)
+            self.task_manager.mark_cancelled(task_id)
+        except Exception as e:
+            self.task_manager.update_task(task_id, status="failed", 
+                                   message=f"Error: {str(e)}")
+            await self._finish_job_files(task_id)
+        else:
+            await self._finish_job_files(task_id)
+        finally:
+            self.running.pop(task_id, None)
+            self.cancelled.discard(task_id)
+            tts_processor.job_dirs.pop(task_id, None)
+            self.wakeup.set()
+    
+    async def _finish_job_files(self, task_id: str):
+        """Dọn checkpoint và file tải lên của job đã kết thúc"""
+        task = self.task_manager.get_task(task_id)
+        if task is not None and task.status == "cancelled":
+            # Hủy tới khi handler đã xong (update_task không ghi đè task đã hủy):
+            # hoàn tất việc hủy như job bị dừng giữa chừng
+            await asyncio.to_thread(tts_processor.discard_job_files, task_id)
+            self.task_manager.mark_cancelled(task_id)
+            return
+        await asyncio.to_thread(JobCheckpoint.for_task(task_id).discard)
+        await asyncio.to_thread(discard_job_upload, task_id)
+    
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(TTSConfig.JOB_HEARTBEAT_INTERVAL)
+            try:
+                for task_id in list(self.running):
+                    self.task_manager.heartbeat(task_id, self.worker_id)
+                self._publish_status()
+                recovered = self.task_manager.recover_expired_leases()
+                if recovered:
+                    print(f"Recovered {recovered} job(s) with expired leases")
+                    self.wakeup.set()
+            except Exception as e:
+                print(f"Job heartbeat error: {e}")
+    
+    def status(self) -> dict:
+        return {
+            "pid": os.getpid(),
+            "running_jobs": len(self.running),
+            "concurrency": self.concurrency,
+            "scheduler": tts_processor.upstream_limiter.snapshot() if tts_processor else None
+        }
+    
+    def _publish_status(self):
+        """Ghi trạng thái worker/scheduler vào job store để API process đọc được"""
+        self.task_manager.record_worker_status(self.worker_id, self.status())
+    
+    async def _release_running(self):
+        """Dừng job đang chạy và trả chúng về hàng đợi cho lần khởi động sau"""
+        running = dict(self.running)
+        for task in running.values():
+            task.cancel()
+        await asyncio.gather(*running.values(), return_exceptions=True)
+        for task_id in running:
+            self.task_manager.release(task_id, self.worker_id)
+
+@functools.lru_cache(maxsize=1)
+def trusted_proxy_networks() -> tuple:
+    return tuple(ipaddress.ip_network(proxy, strict=False) for proxy in TTSConfig.TRUSTED_PROXIES)
+
+def is_trusted_proxy(host: str) -> bool:
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in trusted_proxy_networks())
+
+def get_client_id(request: Request) -> str:
+    """Client dùng cho fair-share và admission: IP kết nối.
+    
+    Header do client tự đặt không được tin (đổi giá trị là vượt được giới hạn); chỉ khi request
+    tới từ proxy tin cậy mới dùng X-Client-ID của proxy, hoặc hop ngoài cùng của X-Forwarded-For.
+    """
+    host = request.client.host if request.client else "anonymous"
+    if not is_trusted_proxy(host):
+        return host
+    client_id = request.headers.get("X-Client-ID", "").strip()
+    if client_id:
+        return client_id[:64]
+    # Hop phải nhất không phải proxy tin cậy là client thật (các hop bên trái do client tự khai)
+    hops = [hop.strip() for hop in request.headers.get("X-Forwarded-For", "").split(",") if hop.strip()]
+    for hop in reversed(hops):
+        if not is_trusted_proxy(hop):
+            return hop
+    return host
+
+def resolve_job_priority(priority: str, units: int) -> int:
+    """Lane của job: theo tham số priority, mặc định theo số câu"""
+    if priority in UpstreamLimiter.LANES:
+        return UpstreamLimiter.LANES[priority]
+    if priority:
+        raise HTTPException(status_code=400, detail=f"Unknown priority: {priority}")
+    if units <= TTSConfig.SCHEDULER_INTERACTIVE_MAX_SENTENCES:
+        return UpstreamLimiter.PRIORITY_INTERACTIVE
+    return UpstreamLimiter.PRIORITY_BULK
+
+def count_units(text, unique: bool = False, limit: int = None) -> int:
+    """Số câu của job (ước lượng khối lượng công việc cho scheduler/admission); text là str hoặc file.
+    
+    limit: số câu tối đa job thực sự xử lý (ngừng đếm khi tới).
+    """
+    sentences = TextProcessor.iter_unique_sentences(text) if unique else TextProcessor.iter_sentences(text)
+    return sum(1 for _ in itertools.islice(sentences, limit))
+
+def count_dialogue_turns(text, turn_pattern, limit: int) -> int:
+    """Số lượt hội thoại của job multi-voice / Q&A (mỗi lượt một lần gọi upstream), tối đa limit"""
+    turns = (line for line in TextProcessor.iter_lines(text) if turn_pattern.match(line.strip()))
+    return sum(1 for _ in itertools.islice(turns, limit))
+
+def admission_status(client_id: str = None) -> dict:
+    load = task_manager.load(client_id)
+    return {
+        **load,
+        "sentences_per_second": round(task_manager.throughput(), 3),
+        "limits": {
+            "queued_jobs": TTSConfig.ADMISSION_MAX_QUEUED_JOBS,
+            "queued_sentences": TTSConfig.ADMISSION_MAX_QUEUED_SENTENCES,
+            "client_jobs": TTSConfig.ADMISSION_MAX_CLIENT_JOBS
+        }
+    }
+
+def check_admission(client_id: str, units: int):
+    """Từ chối job mới (429) khi hàng đợi vượt giới hạn thay vì nhận việc vô hạn"""
+    load = task_manager.load(client_id)
+    # Job đang chạy ngay trong request (fast path, deadline_ms) cũng tính vào giới hạn của client
+    load["client_jobs"] += inline_jobs.get(client_id, 0)
+    # Job lớn hơn cả giới hạn vẫn được nhận khi hàng đợi trống
+    units = min(units, TTSConfig.ADMISSION_MAX_QUEUED_SENTENCES)
+    if load["queued_jobs"] + 1 > TTSConfig.ADMISSION_MAX_QUEUED_JOBS:
+        reason = f"Too many queued jobs ({load['queued_jobs']})"
+    elif load["queued_sentences"] + units > TTSConfig.ADMISSION_MAX_QUEUED_SENTENCES:
+        reason = f"Too many queued sentences ({load['queued_sentences']})"
+    elif load["client_jobs"] + 1 > TTSConfig.ADMISSION_MAX_CLIENT_JOBS:
+        reason = f"Too many jobs in flight for this client ({load['client_jobs']})"
+    else:
+        return
+    
+    # Thời gian để hàng đợi xả đủ chỗ cho job này ở throughput hiện tại
+    throughput = task_manager.throughput()
+    if throughput > 0:
+        excess = max(load["queued_sentences"] + units - TTSConfig.ADMISSION_MAX_QUEUED_SENTENCES, units, 1)
+        retry_after = math.ceil(excess / throughput)
+    else:
+        retry_after = TTSConfig.ADMISSION_DEFAULT_RETRY_AFTER
+    retry_after = min(max(retry_after, 1), TTSConfig.ADMISSION_MAX_RETRY_AFTER)
     
-    def cleanup_old_outputs(self, hours_old: int = 24):
-        """Dọn dẹp outputs cũ"""
+    raise HTTPException(
+        status_code=429,
+        detail=f"{reason}, retry in {retry_after}s",
+        headers={"Retry-After": str(retry_after)}
+    )
+
+def get_idempotency_key(request: Request) -> Optional[str]:
+    key = request.headers.get("Idempotency-Key", "").strip()
+    if len(key) > 255:
+        raise HTTPException(status_code=400, detail="Idempotency-Key is too long")
+    return key or None
+
+def enqueue_job(task_id: str, task_type: str, params: dict,
+                priority: int = UpstreamLimiter.PRIORITY_INTERACTIVE, client_id: str = None,
+                units: int = 0, idempotency_key: str = None) -> Optional[TaskRecord]:
+    """Lưu job vào queue; worker trong process này (nếu có) được đánh thức ngay.
+    
+    Với idempotency_key đã dùng (cùng loại job, cùng tham số) trả về task gốc thay vì
+    tạo job mới; None khi job mới được tạo.
+    """
+    scoped_key = request_hash = None
+    if idempotency_key:
+        # Key chỉ có nghĩa trong phạm vi một endpoint. Không gắn với client: IP đổi giữa hai lần
+        # retry (wifi -> 4G) vẫn nhận lại task gốc; key trùng nhưng tham số khác -> 409 nhờ request_hash
+        scoped_key = f"{task_type}:{idempotency_key}"
+        request_hash = hashlib.sha256(
+            json.dumps(params, sort_keys=True, ensure_ascii=False).encode("utf-8")
+        ).hexdigest()
+    
+    try:
+        # Retry không bị admission control từ chối: nó không thêm việc mới
+        if scoped_key:
+            existing = task_manager.find_idempotent(scoped_key, request_hash)
+            if existing is not None:
+                return task_manager.get_task(existing)
+        check_admission(client_id, units)
+        created = task_manager.create_task(task_id, task_type, params=params, priority=priority,
+                                           client_id=client_id, units=units,
+                                           idempotency_key=scoped_key, request_hash=request_hash)
+    except IdempotencyConflictError as e:
+        raise HTTPException(status_code=422,
+                            detail=f"Idempotency-Key was already used for a different request (task {e})")
+    if created != task_id:
+        return task_manager.get_task(created)
+    
+    if job_worker is not None:
+        job_worker.notify()
+    return None
+
+AUDIO_MEDIA_TYPES = {"mp3": "audio/mpeg", "wav": "audio/wav"}
+
+async def should_run_inline(request: Request, sync: str, units: int, cache_check: dict = None) -> bool:
+    """Fast path: job nhỏ, hoặc mọi câu đã có trong cache, chạy ngay trong request"""
+    if sync not in ("auto", "off"):
+        raise HTTPException(status_code=400, detail=f"Unknown sync mode: {sync}")
+    # Request có Idempotency-Key cần task để retry trả lại đúng kết quả
+    if sync == "off" or get_idempotency_key(request):
+        return False
+    if units <= TTSConfig.SYNC_MAX_UNITS:
+        return True
+    if cache_check is None or units > TTSConfig.SYNC_MAX_CACHED_UNITS:
+        return False
+    return await asyncio.to_thread(tts_processor.is_fully_cached, **cache_check)
+
+# client_id -> số job đang chạy ngay trong request (không có trong job store)
+inline_jobs: Dict[str, int] = {}
+
+@contextmanager
+def inline_admission(client_id: str, units: int):
+    """Admission cho job chạy trong request; job được đếm vào inline_jobs tới khi xong"""
+    check_admission(client_id, units)
+    inline_jobs[client_id] = inline_jobs.get(client_id, 0) + 1
+    try:
+        yield
+    finally:
+        inline_jobs[client_id] -= 1
+        if not inline_jobs[client_id]:
+            del inline_jobs[client_id]
+
+async def run_inline_job(request: Request, task_type: str, params: dict, priority: int, client_id: str,
+                         units: int):
+    """Chạy handler của job ngay trong request và trả kết quả"""
+    with inline_admission(client_id, units):
+        result = await JOB_HANDLERS[task_type](TaskRecord.transient(task_type, params, priority, client_id))
+    return inline_response(request, result)
+
+async def run_single_voice_with_deadline(request: Request, params: dict, client_id: str, units: int,
+                                         deadline_ms: int, started: float):
+    """Trả về phần audio đã xong khi tới deadline kèm danh sách câu bị bỏ;
+    các câu đó vẫn được tạo tiếp ở background để lấp cache"""
+    report = {}
+    with inline_admission(client_id, units):
+        audio_file, srt_file = await tts_processor.process_single_voice(
+            params["text"], params["voice_id"], params["rate"], params["pitch"], params["volume"],
+            params["pause"], params["output_format"], report=report,
+            phrase_reuse=params["phrase_reuse"], client_id=client_id,
+            deadline=started + deadline_ms / 1000
+        )
+    result = attach_missing_report(
+        build_audio_result(audio_file, srt_file, "Audio generated successfully"), report
+    )
+    result["partial"] = result.get("partial", False)
+    result["deadline_ms"] = deadline_ms
+    result["elapsed_ms"] = round((time.monotonic() - started) * 1000)
+    return inline_response(request, result)
+
+def inline_response(request: Request, result: dict):
+    """Kết quả job chạy ngay trong request (hoặc file audio khi Accept: audio/*)"""
+    if "audio/" in request.headers.get("Accept", "") and result.get("audio_url"):
+        audio_file = find_output_file(os.path.basename(result["audio_url"]))
+        if audio_file:
+            headers = {}
+            if result.get("srt_url"):
+                headers["X-Srt-Url"] = result["srt_url"]
+            if result.get("missing_sentences"):
+                headers["X-Missing-Sentences"] = str(len(result["missing_sentences"]))
+            return FileResponse(audio_file, media_type=AUDIO_MEDIA_TYPES.get(
+                os.path.splitext(audio_file)[1].lstrip("."), "application/octet-stream"
+            ), headers=headers)
+    
+    return {
+        "success": result["success"],
+        "inline": True,
+        "task_id": None,
+        "result": result,
+        "message": result["message"]
+    }
+
+def idempotent_replay(task: TaskRecord) -> JSONResponse:
+    """Response cho request lặp lại: task gốc và kết quả hiện có, không chạy lại job"""
+    return JSONResponse(
+        {"success": True, **format_task_status(task), "idempotent_replay": True},
+        headers={"Idempotent-Replayed": "true"}
+    )
+
+async def run_job_worker():
+    """Worker process: chỉ chạy job từ queue, không phục vụ HTTP"""
+    global tts_processor, task_manager, job_worker
+    tts_processor = TTSProcessor()
+    task_manager = TaskManager()
+    job_worker = JobWorker(task_manager)
+    
+    recovered = task_manager.recover_expired_leases()
+    if recovered:
+        print(f"Recovered {recovered} job(s) with expired leases")
+    
+    worker_task = asyncio.create_task(job_worker.run())
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        # Dừng có kiểm soát: job đang chạy được trả lại hàng đợi
+        loop.add_signal_handler(sig, worker_task.cancel)
+    
+    print(f"Worker {job_worker.worker_id} started")
+    try:
+        await worker_task
+    except asyncio.CancelledError:
+        pass
+    print(f"Worker {job_worker.worker_id} stopped")
+
+def job_worker_process():
+    asyncio.run(run_job_worker())
+
+def start_worker_processes(count: int) -> list:
+    processes = []
+    for index in range(count):
+        process = multiprocessing.Process(target=job_worker_process, name=f"tts-worker-{index + 1}")
+        process.start()
+        processes.append(process)
+    return processes
+
+def stop_worker_processes(processes: list, timeout: float = 30):
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+    for process in processes:
+        process.join(timeout)
+
+async def sweep_tasks_periodically():
+    """Xóa task đã kết thúc quá TASK_TTL định kỳ (không chỉ lúc khởi động hay /api/cleanup)"""
+    while True:
+        await asyncio.sleep(TTSConfig.TASK_SWEEP_INTERVAL)
         try:
-            if os.path.exists("outputs"):
-                now = time.time()
-                for folder_name in os.listdir("outputs"):
-                    folder_path = os.path.join("outputs", folder_name)
-                    if os.path.isdir(folder_path):
-                        folder_age = now - os.path.getmtime(folder_path)
-                        if folder_age > hours_old * 3600:
-                            try:
-                                shutil.rmtree(folder_path)
-                            except:
-                                pass
+            deleted = await asyncio.to_thread(task_manager.sweep_expired)
+            if deleted:
+                print(f"Expired {deleted} finished task(s)")
+            await asyncio.to_thread(tts_processor.prune_checkpoints)
+            await asyncio.to_thread(tts_processor.prune_uploads)
         except Exception as e:
-            print(f"Error cleaning old outputs: {e}")
+            print(f"Error sweeping tasks: {e}")
 
 # ==================== LIFESPAN MANAGER ====================
 @asynccontextmanager
@@ -1639,14 +4375,40 @@ async def lifespan(app: FastAPI):
     print("Starting up TTS Generator...")
     
     # Initialize TTS processor
-    global tts_processor, task_manager
+    global tts_processor, task_manager, job_worker
     tts_processor = TTSProcessor()
     task_manager = TaskManager()
     
+    # Import cache snapshot để node mới khởi động với cache nóng
+    if TTSConfig.CACHE_SNAPSHOT:
+        try:
+            summary = await asyncio.to_thread(
+                tts_processor.cache_manager.import_snapshot_from, TTSConfig.CACHE_SNAPSHOT
+            )
+            print(f"Cache snapshot imported: {summary}")
+        except Exception as e:
+            print(f"Error importing cache snapshot: {e}")
+    
     # Cleanup old files on startup
     tts_processor.cleanup_temp_files()
     tts_processor.cleanup_old_outputs(24)
-    task_manager.cleanup_old_tasks(1)
+    task_manager.sweep_expired()
+    sweeper_task = asyncio.create_task(sweep_tasks_periodically())
+    
+    # Job của process trước bị chết giữa chừng được đưa lại hàng đợi
+    recovered = task_manager.recover_expired_leases()
+    if recovered:
+        print(f"Recovered {recovered} job(s) with expired leases")
+    tts_processor.prune_checkpoints()
+    tts_processor.prune_uploads()
+    
+    # Không có worker process riêng thì chạy job ngay trong process API
+    worker_task = None
+    if TTSConfig.WORKER_PROCESSES == 0:
+        job_worker = JobWorker(task_manager)
+        worker_task = asyncio.create_task(job_worker.run())
+    else:
+        print("Jobs are processed by dedicated worker processes")
     
     # Create template file if not exists
     create_template_file()
@@ -1655,6 +4417,13 @@ async def lifespan(app: FastAPI):
     
     # Shutdown
     print("Shutting down TTS Generator...")
+    sweeper_task.cancel()
+    if worker_task is not None:
+        worker_task.cancel()
+        try:
+            await worker_task
+        except asyncio.CancelledError:
+            pass
     tts_processor.cleanup_temp_files()
     if hasattr(task_manager, 'executor'):
         task_manager.executor.shutdown(wait=False)
@@ -1669,6 +4438,7 @@ app = FastAPI(
 # Global instances (sẽ được khởi tạo trong lifespan)
 tts_processor = None
 task_manager = None
+job_worker = None
 
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -1706,15 +4476,25 @@ async def get_voices(language: str = None):
 
 @app.post("/api/generate/single")
 async def generate_single_voice(
+    request: Request,
     text: str = Form(...),
     voice_id: str = Form(...),
     rate: int = Form(0),
     pitch: int = Form(0),
     volume: int = Form(100),
     pause: int = Form(500),
-    output_format: str = Form("mp3")
+    output_format: str = Form("mp3"),
+    phrase_reuse: bool = Form(False),
+    priority: str = Form(""),
+    sync: str = Form("auto"),
+    deadline_ms: int = Form(0)
 ):
-    """Generate single voice TTS with task system"""
+    """Generate single voice TTS; small or fully cached requests are answered inline.
+    
+    With deadline_ms the request always answers inline within that budget, returning the
+    sentences finished in time and listing the omitted ones.
+    """
+    started = time.monotonic()
     try:
         if not text.strip():
             raise HTTPException(status_code=400, detail="Text is required")
@@ -1724,7 +4504,8 @@ async def generate_single_voice(
         
         # Tạo task ID
         task_id = f"single_{int(time.time())}_{random.randint(1000, 9999)}"
-        task_manager.create_task(task_id, "single_voice")
+        job_units = count_units(text, limit=TTSConfig.MAX_SENTENCES)
+        job_priority = resolve_job_priority(priority, job_units)
         
         # Lưu settings
         tts_processor.settings["single_voice"] = {
@@ -1736,34 +4517,39 @@ async def generate_single_voice(
         }
         tts_processor.save_settings()
         
-        # Chạy trong background
-        async def background_task():
-            try:
-                audio_file, srt_file = await tts_processor.process_single_voice(
-                    text, voice_id, rate, pitch, volume, pause, output_format, task_id
-                )
-                
-                if audio_file:
-                    result = {
-                        "success": True,
-                        "audio_url": f"/download/{os.path.basename(audio_file)}",
-                        "srt_url": f"/download/{os.path.basename(srt_file)}" if srt_file else None,
-                        "message": "Audio generated successfully"
-                    }
-                else:
-                    result = {
-                        "success": False,
-                        "message": "Failed to generate audio"
-                    }
-                
-                task_manager.update_task(task_id, status="completed", result=result)
-                
-            except Exception as e:
-                task_manager.update_task(task_id, status="failed", 
-                                       message=f"Error: {str(e)}")
-        
-        # Start background task
-        asyncio.create_task(background_task())
+        params = {
+            "text": text,
+            "voice_id": voice_id,
+            "rate": rate,
+            "pitch": pitch,
+            "volume": volume,
+            "pause": pause,
+            "output_format": output_format,
+            "phrase_reuse": phrase_reuse
+        }
+        client_id = get_client_id(request)
+        if deadline_ms < 0:
+            raise HTTPException(status_code=400, detail="deadline_ms must be positive")
+        if deadline_ms > TTSConfig.MAX_DEADLINE_MS:
+            raise HTTPException(status_code=400,
+                                detail=f"deadline_ms must be at most {TTSConfig.MAX_DEADLINE_MS}")
+        if deadline_ms:
+            # Kết quả deadline_ms trả thẳng trong response, không có task để retry nhận lại
+            if get_idempotency_key(request):
+                raise HTTPException(status_code=400,
+                                    detail="Idempotency-Key cannot be combined with deadline_ms")
+            return await run_single_voice_with_deadline(request, params, client_id, job_units,
+                                                        deadline_ms, started)
+        cache_check = {"text": text, "voice_id": voice_id, "rate": rate, "pitch": pitch, "volume": volume}
+        if await should_run_inline(request, sync, job_units, cache_check):
+            return await run_inline_job(request, "single_voice", params, job_priority, client_id, job_units)
+        
+        # Đưa vào job queue, worker sẽ chạy
+        replayed = enqueue_job(task_id, "single_voice", params=params,
+                               priority=job_priority, client_id=client_id, units=job_units,
+                               idempotency_key=get_idempotency_key(request))
+        if replayed is not None:
+            return idempotent_replay(replayed)
         
         return {
             "success": True,
@@ -1771,11 +4557,14 @@ async def generate_single_voice(
             "message": "Audio generation started. Check task status."
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/generate/multi")
 async def generate_multi_voice(
+    request: Request,
     text: str = Form(...),
     char1_language: str = Form(...),
     char1_voice: str = Form(...),
@@ -1789,7 +4578,9 @@ async def generate_multi_voice(
     char2_volume: int = Form(100),
     pause: int = Form(500),
     repeat: int = Form(1),
-    output_format: str = Form("mp3")
+    output_format: str = Form("mp3"),
+    priority: str = Form(""),
+    sync: str = Form("auto")
 ):
     """Generate multi-voice TTS"""
     try:
@@ -1798,7 +4589,8 @@ async def generate_multi_voice(
         
         # Tạo task ID
         task_id = f"multi_{int(time.time())}_{random.randint(1000, 9999)}"
-        task_manager.create_task(task_id, "multi_voice")
+        job_units = count_dialogue_turns(text, TextProcessor.RE_MULTI_VOICE_TURN, TTSConfig.MAX_DIALOGUES)
+        job_priority = resolve_job_priority(priority, job_units)
         
         voices_config = {
             "char1": {
@@ -1826,33 +4618,23 @@ async def generate_multi_voice(
         }
         tts_processor.save_settings()
         
-        # Background task
-        async def background_task():
-            try:
-                audio_file, srt_file = await tts_processor.process_multi_voice(
-                    text, voices_config, pause, repeat, output_format, task_id
-                )
-                
-                if audio_file:
-                    result = {
-                        "success": True,
-                        "audio_url": f"/download/{os.path.basename(audio_file)}",
-                        "srt_url": f"/download/{os.path.basename(srt_file)}" if srt_file else None,
-                        "message": "Multi-voice audio generated successfully"
-                    }
-                else:
-                    result = {
-                        "success": False,
-                        "message": "Failed to generate audio"
-                    }
-                
-                task_manager.update_task(task_id, status="completed", result=result)
-                
-            except Exception as e:
-                task_manager.update_task(task_id, status="failed", 
-                                       message=f"Error: {str(e)}")
+        params = {
+            "text": text,
+            "voices_config": voices_config,
+            "pause": pause,
+            "repeat": repeat,
+            "output_format": output_format
+        }
+        client_id = get_client_id(request)
+        if await should_run_inline(request, sync, job_units):
+            return await run_inline_job(request, "multi_voice", params, job_priority, client_id, job_units)
         
-        asyncio.create_task(background_task())
+        # Đưa vào job queue
+        replayed = enqueue_job(task_id, "multi_voice", params=params,
+                               priority=job_priority, client_id=client_id, units=job_units,
+                               idempotency_key=get_idempotency_key(request))
+        if replayed is not None:
+            return idempotent_replay(replayed)
         
         return {
             "success": True,
@@ -1860,11 +4642,14 @@ async def generate_multi_voice(
             "message": "Multi-voice audio generation started"
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/generate/qa")
 async def generate_qa_dialogue(
+    request: Request,
     text: str = Form(...),
     question_language: str = Form(...),
     question_voice: str = Form(...),
@@ -1879,7 +4664,9 @@ async def generate_qa_dialogue(
     pause_q: int = Form(200),
     pause_a: int = Form(500),
     repeat: int = Form(2),
-    output_format: str = Form("mp3")
+    output_format: str = Form("mp3"),
+    priority: str = Form(""),
+    sync: str = Form("auto")
 ):
     """Generate Q&A dialogue TTS"""
     try:
@@ -1888,7 +4675,8 @@ async def generate_qa_dialogue(
         
         # Tạo task ID
         task_id = f"qa_{int(time.time())}_{random.randint(1000, 9999)}"
-        task_manager.create_task(task_id, "qa_dialogue")
+        job_units = count_dialogue_turns(text, TextProcessor.RE_QA_TURN, TTSConfig.MAX_QA_DIALOGUES)
+        job_priority = resolve_job_priority(priority, job_units)
         
         qa_config = {
             "question": {
@@ -1917,33 +4705,24 @@ async def generate_qa_dialogue(
         }
         tts_processor.save_settings()
         
-        # Background task
-        async def background_task():
-            try:
-                audio_file, srt_file = await tts_processor.process_qa_dialogue(
-                    text, qa_config, pause_q, pause_a, repeat, output_format, task_id
-                )
-                
-                if audio_file:
-                    result = {
-                        "success": True,
-                        "audio_url": f"/download/{os.path.basename(audio_file)}",
-                        "srt_url": f"/download/{os.path.basename(srt_file)}" if srt_file else None,
-                        "message": "Q&A dialogue audio generated successfully"
-                    }
-                else:
-                    result = {
-                        "success": False,
-                        "message": "Failed to generate audio"
-                    }
-                
-                task_manager.update_task(task_id, status="completed", result=result)
-                
-            except Exception as e:
-                task_manager.update_task(task_id, status="failed", 
-                                       message=f"Error: {str(e)}")
+        params = {
+            "text": text,
+            "qa_config": qa_config,
+            "pause_q": pause_q,
+            "pause_a": pause_a,
+            "repeat": repeat,
+            "output_format": output_format
+        }
+        client_id = get_client_id(request)
+        if await should_run_inline(request, sync, job_units):
+            return await run_inline_job(request, "qa_dialogue", params, job_priority, client_id, job_units)
         
-        asyncio.create_task(background_task())
+        # Đưa vào job queue
+        replayed = enqueue_job(task_id, "qa_dialogue", params=params,
+                               priority=job_priority, client_id=client_id, units=job_units,
+                               idempotency_key=get_idempotency_key(request))
+        if replayed is not None:
+            return idempotent_replay(replayed)
         
         return {
             "success": True,
@@ -1951,8 +4730,171 @@ async def generate_qa_dialogue(
             "message": "Q&A audio generation started"
         }
         
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def normalize_batch_item(item, index: int) -> dict:
+    """Kiểm tra và chuẩn hóa một item của batch (text, voice, rate, pitch, volume, format)"""
+    if not isinstance(item, dict):
+        raise HTTPException(status_code=400, detail=f"Item {index}: expected an object")
+    text = str(item.get("text") or "").strip()
+    voice = item.get("voice") or item.get("voice_id")
+    output_format = item.get("format") or item.get("output_format") or "mp3"
+    if not text or not voice:
+        raise HTTPException(status_code=400, detail=f"Item {index}: text and voice are required")
+    if output_format not in TTSConfig.OUTPUT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Item {index}: unsupported format {output_format}")
+    try:
+        return {
+            "text": text,
+            "voice": str(voice),
+            "rate": int(item.get("rate", 0)),
+            "pitch": int(item.get("pitch", 0)),
+            "volume": int(item.get("volume", 100)),
+            "pause": int(item.get("pause", 500)),
+            "format": output_format
+        }
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"Item {index}: rate, pitch, volume and pause must be integers")
+
+def parse_batch_jsonl(content: str) -> list:
+    items = []
+    for line_number, line in enumerate(content.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            items.append(json.loads(line))
+        except json.JSONDecodeError:
+            raise HTTPException(status_code=400, detail=f"Invalid JSON on line {line_number}")
+    return items
+
+@app.post("/api/generate/batch")
+async def generate_batch(request: Request):
+    """Generate many texts in one job: JSON array body or uploaded JSONL file ("file")"""
+    try:
+        content_type = request.headers.get("content-type", "")
+        if content_type.startswith("multipart/form-data"):
+            form = await request.form()
+            upload = form.get("file")
+            if upload is None or isinstance(upload, str):
+                raise HTTPException(status_code=400, detail="JSONL file is required")
+            raw_items = parse_batch_jsonl((await upload.read()).decode("utf-8", errors="ignore"))
+            priority = form.get("priority", "")
+        else:
+            try:
+                body = await request.json()
+            except json.JSONDecodeError:
+                raise HTTPException(status_code=400, detail="Invalid JSON body")
+            raw_items = body.get("items") if isinstance(body, dict) else body
+            priority = request.query_params.get("priority", "")
+        
+        if not isinstance(raw_items, list) or not raw_items:
+            raise HTTPException(status_code=400, detail="At least one item is required")
+        if len(raw_items) > TTSConfig.BATCH_MAX_ITEMS:
+            raise HTTPException(status_code=400,
+                                detail=f"At most {TTSConfig.BATCH_MAX_ITEMS} items per batch")
+        items = [normalize_batch_item(item, index) for index, item in enumerate(raw_items)]
+        
+        task_id = f"batch_{int(time.time())}_{random.randint(1000, 9999)}"
+        unique_texts = {item["text"] for item in items}
+        job_units = sum(count_units(text, limit=TTSConfig.MAX_SENTENCES) for text in unique_texts)
+        job_priority = resolve_job_priority(priority or "bulk", job_units)
+        
+        # Cả batch là một job: chung một phần fair-share của client trong scheduler
+        replayed = enqueue_job(task_id, "batch", params={"items": items},
+                               priority=job_priority, client_id=get_client_id(request),
+                               units=job_units, idempotency_key=get_idempotency_key(request))
+        if replayed is not None:
+            return idempotent_replay(replayed)
+        
+        return {
+            "success": True,
+            "task_id": task_id,
+            "items": len(items),
+            "message": "Batch generation started"
+        }
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/cache/warmup")
+async def warmup_cache(
+    request: Request,
+    voice_id: str = Form(...),
+    text: str = Form(""),
+    file: Optional[UploadFile] = File(None),
+    rate: int = Form(0),
+    pitch: int = Form(0),
+    volume: int = Form(100)
+):
+    """Pre-populate the audio cache from a phrase list or document (low priority)"""
+    task_id = f"warmup_{int(time.time())}_{random.randint(1000, 9999)}"
+    params = {
+        "text": text,
+        "voice_id": voice_id,
+        "rate": rate,
+        "pitch": pitch,
+        "volume": volume
+    }
+    created = False
+    try:
+        if file is not None:
+            # Tài liệu được ghi xuống đĩa và job đọc dần, params chỉ giữ digest nội dung
+            params["text"] = ""
+            params["text_upload"] = True
+            params["text_sha256"] = await save_job_upload(task_id, file, text)
+            with open_job_upload(task_id) as source:
+                units = await asyncio.to_thread(count_units, source, True)
+        else:
+            units = count_units(text, True)
+        
+        if not units:
+            raise HTTPException(status_code=400, detail="Text or file is required")
+        
+        replayed = enqueue_job(task_id, "cache_warmup", params=params,
+                               priority=UpstreamLimiter.PRIORITY_BACKGROUND, client_id=get_client_id(request),
+                               units=units, idempotency_key=get_idempotency_key(request))
+        created = replayed is None
+        if replayed is not None:
+            return idempotent_replay(replayed)
+        
+        return {
+            "success": True,
+            "task_id": task_id,
+            "message": "Cache warm-up started"
+        }
+    
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if file is not None and not created:
+            discard_job_upload(task_id)
+
+def format_task_status(task: TaskRecord) -> dict:
+    return {
+        "task_id": task.id,
+        "status": task.status,
+        "progress": task.progress,
+        "message": task.message,
+        "result": task.result,
+        "playable": task.playable,
+        "created_at": datetime.fromtimestamp(task.created_at).isoformat(),
+        "updated_at": datetime.fromtimestamp(task.updated_at).isoformat()
+    }
+
+def format_sse(event: str, data: dict, event_id: int = None) -> str:
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return "\n".join(lines) + "\n\n"
 
 @app.get("/api/task/{task_id}")
 async def get_task_status(task_id: str):
@@ -1961,26 +4903,218 @@ async def get_task_status(task_id: str):
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
     
+    return format_task_status(task)
+
+@app.post("/api/tasks/status")
+async def get_tasks_status(
+    ids: str = Form(""),
+    since: str = Form(""),
+    limit: int = Form(200),
+    include_result: bool = Form(False)
+):
+    """Batched task status: comma-separated task IDs, or tasks changed since a cursor"""
+    limit = min(max(limit, 1), TTSConfig.TASK_STATUS_BATCH_LIMIT)
+    task_ids = list(dict.fromkeys(t.strip() for t in ids.split(",") if t.strip()))
+    
+    if task_ids:
+        if len(task_ids) > TTSConfig.TASK_STATUS_BATCH_LIMIT:
+            raise HTTPException(status_code=400,
+                                detail=f"At most {TTSConfig.TASK_STATUS_BATCH_LIMIT} task IDs per request")
+        tasks = task_manager.get_tasks(task_ids, include_result)
+        found = {task["id"] for task in tasks}
+        return {
+            "tasks": tasks,
+            "missing": [task_id for task_id in task_ids if task_id not in found]
+        }
+    
+    # Cursor "updated_at:task_id" (client lưu next_cursor cho lần gọi sau)
+    updated_at, _, last_id = since.partition(":")
+    try:
+        updated_at = float(updated_at) if updated_at else 0.0
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    tasks = task_manager.tasks_changed_since(updated_at, last_id, limit, include_result)
+    next_cursor = f"{tasks[-1]['updated_at']!r}:{tasks[-1]['id']}" if tasks else since
+    return {
+        "tasks": tasks,
+        "next_cursor": next_cursor,
+        "has_more": len(tasks) == limit
+    }
+
+@app.get("/api/task/{task_id}/archive")
+async def download_batch_archive(task_id: str):
+    """Stream a ZIP with every item of a finished batch plus its manifest"""
+    task = task_manager.get_task(task_id)
+    if not task or task.type != "batch":
+        raise HTTPException(status_code=404, detail="Batch task not found")
+    result = task.result
+    if task.status != "completed" or not result:
+        raise HTTPException(status_code=409, detail=f"Batch is {task.status}")
+    
+    manifest_name = os.path.basename(result["manifest_url"])
+    manifest_files = glob.glob(os.path.join("outputs", "*", manifest_name))
+    if not manifest_files:
+        raise HTTPException(status_code=404, detail="Batch files have expired")
+    manifest_file = manifest_files[0]
+    output_dir = os.path.dirname(manifest_file)
+    with open(manifest_file, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    
+    def archive_stream():
+        buffer = _StreamBuffer()
+        # Audio đã nén sẵn nên chỉ lưu (ZIP_STORED), không nén lại
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+            archive.write(manifest_file, "manifest.json")
+            yield buffer.drain()
+            for entry in manifest["items"]:
+                for url_field in ("audio_url", "srt_url"):
+                    if not entry.get(url_field):
+                        continue
+                    path = os.path.join(output_dir, os.path.basename(entry[url_field]))
+                    if os.path.exists(path):
+                        extension = os.path.splitext(path)[1]
+                        archive.write(path, f"{entry['index']:05d}{extension}")
+                        yield buffer.drain()
+        yield buffer.drain()
+    
+    return StreamingResponse(
+        archive_stream(),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{task_id}.zip"'}
+    )
+
+@app.get("/api/task/{task_id}/events")
+async def stream_task_events(task_id: str, request: Request):
+    """Stream task progress, per-sentence completion and the final result (Server-Sent Events)"""
+    if not task_manager.get_task(task_id):
+        raise HTTPException(status_code=404, detail="Task not found")
+    
+    # Kết nối lại (EventSource tự gửi Last-Event-ID) không nhận lại sự kiện câu đã gửi
+    try:
+        last_event_id = int(request.headers.get("Last-Event-ID", "0"))
+    except ValueError:
+        last_event_id = 0
+    
+    async def event_stream(last_event_id: int):
+        last_update = None
+        last_sent = time.monotonic()
+        yield "retry: 2000\n\n"
+        
+        while not await request.is_disconnected():
+            task = task_manager.get_task(task_id)
+            if task is None:
+                yield format_sse("error", {"message": "Task not found"})
+                return
+            
+            for event in task_manager.get_events(task_id, last_event_id):
+                last_event_id = event["id"]
+                yield format_sse(event["event"], event["data"], event["id"])
+            
+            status = format_task_status(task)
+            if task.status in TaskManager.TERMINAL_STATES:
+                # Sự kiện cuối: completed / failed / cancelled kèm kết quả
+                yield format_sse(task.status, status)
+                return
+            
+            now = time.monotonic()
+            if status["updated_at"] != last_update:
+                last_update = status["updated_at"]
+                last_sent = now
+                yield format_sse("progress", status)
+            elif now - last_sent >= TTSConfig.TASK_EVENTS_KEEPALIVE:
+                last_sent = now
+                yield ": keepalive\n\n"
+            
+            await asyncio.sleep(TTSConfig.TASK_EVENTS_INTERVAL)
+    
+    return StreamingResponse(
+        event_stream(last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/task/{task_id}/stream")
+async def stream_task_audio(task_id: str, request: Request):
+    """Stream the playable prefix of a job's audio (MP3), growing until the job finishes"""
+    task = task_manager.get_task(task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if task.type not in ("single_voice", "multi_voice", "qa_dialogue") or (
+            task.status in TaskManager.TERMINAL_STATES and not task.playable):
+        raise HTTPException(status_code=404, detail="No progressive output for this task")
+    
+    async def audio_stream():
+        file_path = None
+        offset = 0
+        while not await request.is_disconnected():
+            task = task_manager.get_task(task_id)
+            if task is None:
+                return
+            playable = task.playable
+            if playable:
+                filename = os.path.basename(playable["url"])
+                if file_path is None or os.path.basename(file_path) != filename:
+                    # Job chạy lại tạo file mới: chỉ tiếp tục nếu chưa gửi gì
+                    if offset:
+                        return
+                    file_path = await asyncio.to_thread(find_output_file, filename)
+                if file_path:
+                    try:
+                        with open(file_path, "rb") as f:
+                            f.seek(offset)
+                            while True:
+                                chunk = f.read(64 * 1024)
+                                if not chunk:
+                                    break
+                                offset += len(chunk)
+                                yield chunk
+                    except OSError:
+                        return
+            # Đọc file sau khi thấy trạng thái kết thúc: mọi unit đã được ghi trước đó
+            if task.status in TaskManager.TERMINAL_STATES:
+                return
+            await asyncio.sleep(TTSConfig.TASK_EVENTS_INTERVAL)
+    
+    return StreamingResponse(
+        audio_stream(),
+        media_type="audio/mpeg",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.delete("/api/task/{task_id}")
+async def cancel_task(task_id: str):
+    """Cancel a pending or running task and discard its files"""
+    previous_status = task_manager.request_cancel(task_id)
+    if previous_status is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if previous_status not in ("pending", "running"):
+        raise HTTPException(status_code=409, detail=f"Task already {previous_status}")
+
+    # Job chạy trong process này được dừng ngay, worker process khác tự phát hiện qua job store
+    if previous_status == "running" and job_worker is not None:
+        job_worker.cancel(task_id)
+    elif previous_status == "pending":
+        task_manager.mark_cancelled(task_id)
+
     return {
+        "success": True,
         "task_id": task_id,
-        "status": task["status"],
-        "progress": task["progress"],
-        "message": task["message"],
-        "result": task.get("result"),
-        "created_at": task["created_at"].isoformat(),
-        "updated_at": task["updated_at"].isoformat()
+        "status": "cancelled",
+        "message": "Task cancelled"
     }
 
+def find_output_file(filename: str) -> Optional[str]:
+    """Tìm file trong outputs directory"""
+    for root, dirs, files in os.walk("outputs"):
+        if filename in files:
+            return os.path.join(root, filename)
+    return None
+
 @app.get("/download/{filename}")
 async def download_file(filename: str):
     """Download generated files"""
-    file_path = None
-    
-    # Tìm file trong outputs directory
-    for root, dirs, files in os.walk("outputs"):
-        if filename in files:
-            file_path = os.path.join(root, filename)
-            break
+    file_path = find_output_file(filename)
     
     if not file_path or not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="File not found")
@@ -2031,8 +5165,8 @@ async def cleanup_all():
         # Xóa toàn bộ cache
         tts_processor.cache_manager.clear_cache()
         
-        # Xóa task cache
-        task_manager.tasks.clear()
+        # Xóa task đã kết thúc
+        task_manager.clear_finished()
         
         return {
             "success": True, 
@@ -2041,6 +5175,65 @@ async def cleanup_all():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/admin/cache/stats")
+async def get_cache_stats(top: int = 20):
+    """Cache statistics: hit ratio, top keys, bytes by voice"""
+    return tts_processor.cache_manager.get_stats(top_n=max(1, min(top, 500)))
+
+@app.post("/api/admin/cache/{cache_key}/ttl")
+async def set_cache_ttl(cache_key: str, ttl_class: str = Form(...)):
+    """Change TTL class of a cache entry (e.g. pin hot content)"""
+    try:
+        updated = tts_processor.cache_manager.set_ttl_class(cache_key, ttl_class)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if not updated:
+        raise HTTPException(status_code=404, detail="Cache entry not found")
+    
+    return {"success": True, "cache_key": cache_key, "ttl_class": ttl_class}
+
+@app.get("/api/admin/cache/export")
+async def export_cache():
+    """Stream the audio cache as a tar snapshot"""
+    filename = f"cache_snapshot_{datetime.now().strftime('%Y%m%d_%H%M%S')}.tar"
+    return StreamingResponse(
+        tts_processor.cache_manager.export_snapshot(),
+        media_type="application/x-tar",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+@app.post("/api/admin/cache/import")
+async def import_cache(file: UploadFile = File(...)):
+    """Import a cache snapshot produced by /api/admin/cache/export"""
+    try:
+        summary = await asyncio.to_thread(tts_processor.cache_manager.import_snapshot, file.file)
+        return {"success": True, "summary": summary}
+    except (tarfile.TarError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid snapshot: {e}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/admin/upstream")
+async def get_upstream_status():
+    """Circuit breaker state of the edge-tts upstream"""
+    now = time.time()
+    return {
+        "circuit_breaker": tts_processor.circuit_breaker.snapshot(),
+        "negative_cache_entries": sum(1 for t in tts_processor.negative_cache.values() if t > now)
+    }
+
+@app.get("/api/admin/scheduler")
+async def get_scheduler_status():
+    """Job queue per lane and per-worker upstream scheduler state"""
+    return {
+        "policy": TTSConfig.SCHEDULER_POLICY,
+        "interactive_max_sentences": TTSConfig.SCHEDULER_INTERACTIVE_MAX_SENTENCES,
+        "queue": task_manager.queue_stats(),
+        "admission": admission_status(),
+        "workers": task_manager.worker_statuses()
+    }
+
 # Health check endpoint for Render
 @app.get("/health")
 async def health_check():
@@ -2701,6 +5894,7 @@ def create_template_file():
         // Global variables
         let currentTaskId = null;
         let taskCheckInterval = null;
+        let taskEventSource = null;
         
         // Initialize
         document.addEventListener('DOMContentLoaded', async function() {
@@ -3096,7 +6290,9 @@ def create_template_file():
                 
                 const result = await response.json();
                 
-                if (result.success) {
+                if (result.inline) {
+                    showInlineResult('single', result.result);
+                } else if (result.success) {
                     currentTaskId = result.task_id;
                     showTaskStatus('single', result.task_id);
                     showToast('Audio generation started');
@@ -3174,7 +6370,9 @@ def create_template_file():
                 
                 const result = await response.json();
                 
-                if (result.success) {
+                if (result.inline) {
+                    showInlineResult('multi', result.result);
+                } else if (result.success) {
                     currentTaskId = result.task_id;
                     showTaskStatus('multi', result.task_id);
                     showToast('Multi-voice audio generation started');
@@ -3253,7 +6451,9 @@ def create_template_file():
                 
                 const result = await response.json();
                 
-                if (result.success) {
+                if (result.inline) {
+                    showInlineResult('qa', result.result);
+                } else if (result.success) {
                     currentTaskId = result.task_id;
                     showTaskStatus('qa', result.task_id);
                     showToast('Q&A audio generation started');
@@ -3268,7 +6468,7 @@ def create_template_file():
             }
         }
         
-        // Show task status and poll for updates
+        // Show task status and follow updates via Server-Sent Events
         function showTaskStatus(type, taskId) {
             const statusDiv = document.getElementById(`${type}TaskStatus`);
             const progressBar = document.getElementById(`${type}ProgressBar`);
@@ -3280,43 +6480,86 @@ def create_template_file():
             progressText.textContent = '0%';
             taskMessage.textContent = 'Starting...';
             
-            // Clear existing interval
+            // Close existing stream / interval
+            if (taskEventSource) {
+                taskEventSource.close();
+                taskEventSource = null;
+            }
             if (taskCheckInterval) {
                 clearInterval(taskCheckInterval);
             }
             
-            // Poll for task updates
+            const updateProgress = (task) => {
+                progressBar.style.width = `${task.progress}%`;
+                progressText.textContent = `${task.progress}%`;
+                taskMessage.textContent = task.message;
+            };
+            
+            // Returns true when the task has finished
+            const handleTask = (task) => {
+                updateProgress(task);
+                
+                if (task.status === 'completed') {
+                    if (task.result && task.result.success) {
+                        showToast(task.result.message);
+                        
+                        // Show output
+                        showOutput(type, task.result);
+                    }
+                    
+                    // Hide status after 5 seconds
+                    setTimeout(() => {
+                        statusDiv.style.display = 'none';
+                    }, 5000);
+                    return true;
+                } else if (task.status === 'failed' || task.status === 'cancelled') {
+                    showToast(task.message, 'error');
+                    
+                    // Hide status after 3 seconds
+                    setTimeout(() => {
+                        statusDiv.style.display = 'none';
+                    }, 3000);
+                    return true;
+                }
+                return false;
+            };
+            
+            if (!window.EventSource) {
+                pollTaskStatus(taskId, handleTask);
+                return;
+            }
+            
+            const source = new EventSource(`/api/task/${taskId}/events`);
+            taskEventSource = source;
+            
+            source.addEventListener('progress', (event) => {
+                updateProgress(JSON.parse(event.data));
+            });
+            ['completed', 'failed', 'cancelled'].forEach((name) => {
+                source.addEventListener(name, (event) => {
+                    source.close();
+                    taskEventSource = null;
+                    handleTask(JSON.parse(event.data));
+                });
+            });
+            source.onerror = () => {
+                // Stream bị đóng hẳn (proxy không hỗ trợ SSE) -> quay về polling
+                if (source.readyState === EventSource.CLOSED && taskEventSource === source) {
+                    taskEventSource = null;
+                    pollTaskStatus(taskId, handleTask);
+                }
+            };
+        }
+        
+        // Fallback: poll for task updates
+        function pollTaskStatus(taskId, handleTask) {
             taskCheckInterval = setInterval(async () => {
                 try {
                     const response = await fetch(`/api/task/${taskId}`);
                     const task = await response.json();
                     
-                    progressBar.style.width = `${task.progress}%`;
-                    progressText.textContent = `${task.progress}%`;
-                    taskMessage.textContent = task.message;
-                    
-                    if (task.status === 'completed') {
-                        clearInterval(taskCheckInterval);
-                        
-                        if (task.result && task.result.success) {
-                            showToast(task.result.message);
-                            
-                            // Show output
-                            showOutput(type, task.result);
-                        }
-                        
-                        // Hide status after 5 seconds
-                        setTimeout(() => {
-                            statusDiv.style.display = 'none';
-                        }, 5000);
-                    } else if (task.status === 'failed') {
+                    if (handleTask(task)) {
                         clearInterval(taskCheckInterval);
-                        showToast(task.message, 'error');
-                        
-                        // Hide status after 3 seconds
-                        setTimeout(() => {
-                            statusDiv.style.display = 'none';
-                        }, 3000);
                     }
                 } catch (error) {
                     console.error('Error checking task status:', error);
@@ -3324,6 +6567,16 @@ def create_template_file():
             }, 2000); // Poll every 2 seconds
         }
         
+        // Request nhỏ được server xử lý ngay, không cần task
+        function showInlineResult(type, result) {
+            if (result.success) {
+                showToast(result.message);
+                showOutput(type, result);
+            } else {
+                showToast(result.message || 'Generation failed', 'error');
+            }
+        }
+        
         // Show output based on type
         function showOutput(type, result) {
             const outputDiv = document.getElementById(`${type}Output`);
@@ -3493,12 +6746,29 @@ def create_gunicorn_conf():
     """Create gunicorn configuration for Render"""
     gunicorn_conf = """# gunicorn_config.py
 import multiprocessing
+import os
+import subprocess
+import sys
+
+# Web worker chỉ nhận request và đưa job vào queue,
+# synthesis chạy trong các process "python app.py worker" riêng
+os.environ.setdefault("TTS_WORKER_PROCESSES", str(max(multiprocessing.cpu_count() - 1, 1)))
 
 bind = "0.0.0.0:10000"
-workers = 1  # Render sets WEB_CONCURRENCY
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))  # Render sets WEB_CONCURRENCY
 worker_class = "uvicorn.workers.UvicornWorker"
 timeout = 120
 keepalive = 5
+
+synthesis_workers = []
+
+def on_starting(server):
+    synthesis_workers.append(subprocess.Popen([sys.executable, "app.py", "worker"]))
+
+def on_exit(server):
+    for process in synthesis_workers:
+        process.terminate()
+        process.wait(timeout=30)
 """
     
     with open("gunicorn_config.py", "w") as f:
@@ -3506,8 +6776,187 @@ keepalive = 5
     
     print("gunicorn_config.py created")
 
+def run_warmup_cli(args):
+    """Warm up the audio cache from the command line"""
+    texts = []
+    for path in args.files:
+        with open(path, "r", encoding="utf-8") as f:
+            texts.append(f.read())
+    if args.text:
+        texts.append(args.text)
+    
+    if not texts:
+        print("Nothing to warm up: pass phrase files or --text")
+        return
+    
+    processor = TTSProcessor()
+    summary = asyncio.run(processor.warm_cache(
+        "\n".join(texts), args.voice, args.rate, args.pitch, args.volume
+    ))
+    print(f"Warm-up finished: {json.dumps(summary)}")
+
+def run_worker_cli(args):
+    """Run synthesis worker processes consuming the job queue"""
+    count = args.processes or max(TTSConfig.WORKER_PROCESSES, 1)
+    if count == 1:
+        job_worker_process()
+        return
+    
+    def handle_sigterm(signum, frame):
+        raise SystemExit(0)
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    
+    processes = start_worker_processes(count)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_worker_processes(processes)
+
+def run_cache_server_cli(args):
+    """Run the shared cache key/value server"""
+    run_cache_server(args.dir, args.host, args.port, args.max_entries)
+
+def run_cache_export_cli(args):
+    """Export the audio cache to a snapshot file"""
+    cache_manager = AudioCacheManager()
+    with open(args.output, "wb") as f:
+        for chunk in cache_manager.export_snapshot():
+            f.write(chunk)
+    print(f"Cache snapshot written to {args.output}")
+
+def run_cache_import_cli(args):
+    """Import a cache snapshot from a file or URL"""
+    cache_manager = AudioCacheManager()
+    summary = cache_manager.import_snapshot_from(args.source)
+    print(f"Cache snapshot imported: {json.dumps(summary)}")
+
+def normalize_check_cases(size: int) -> Dict[str, str]:
+    """Đầu vào đối kháng cho normalizer (dãy dấu chấm/gạch, số rất dài, email/URL bệnh lý, log...)"""
+    rng = random.Random(size)
+    token_limit = TTSConfig.NORMALIZE_MAX_TOKEN
+    # Token dài vừa đúng giới hạn: vẫn đi qua mọi lượt, kể cả email/website
+    hostile_tokens = {
+        "digits": "1" * token_limit,
+        "decimals": "1." * (token_limit // 2),
+        "email local parts": "a." * (token_limit // 2 - 2) + "@b",
+        "email domains": "x@" + "a." * (token_limit // 2 - 2) + "1",
+        "url paths": "x.com/" + "a-/" * (token_limit // 3 - 2),
+        "ranges": "1-" * (token_limit // 2),
+        "currency": "$" + "9" * (token_limit - 2) + "x",
+        "dashes": "-" * token_limit
+    }
+    alphabet = ["1", "a", ".", "-", "@", "/", "x.com", "%", "°", "$", ":", " ", "_", "#", "?", "=", "&"]
+    log_line = "2024-05-01 12:30:45 GET /api/v1/items?id=42&x=y 200 10.0.0.1 user@example.com 5ms\n"
+    
+    def tokens(pool):
+        parts, length = [], 0
+        while length < size:
+            part = rng.choice(pool)
+            parts.append(part)
+            length += len(part) + 1
+        return " ".join(parts)
+    
+    cases = {
+        "digit run": "1" * size,
+        "dot run": "." * size,
+        "dash run": "-" * size,
+        "dotted words": "a." * (size // 2),
+        "email local part": "a." * (size // 2) + "@b",
+        "email domain": "x@" + "a." * (size // 2) + "1",
+        "url path": "x.com/" + "a-/" * (size // 3),
+        "whitespace run": "1" + " " * size + "x",
+        "number ranges": "1-" * (size // 2),
+        "spaced numbers": "1 " * (size // 2) + "-",
+        "hostile tokens": tokens(list(hostile_tokens.values())),
+        "random symbols": "".join(rng.choice(alphabet) for _ in range(size // 2)),
+        "log file": log_line * (size // len(log_line) + 1)
+    }
+    for name, token in hostile_tokens.items():
+        cases["max-length " + name] = tokens([token])
+    return cases
+
+def run_normalize_check_cli(args):
+    """Check that text normalization stays linear on adversarial input"""
+    failures = 0
+    small_cases = normalize_check_cases(args.size // 4)
+    for name, text in normalize_check_cases(args.size).items():
+        start = time.perf_counter()
+        TextProcessor.clean_text(small_cases[name])
+        small_elapsed = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        TextProcessor.clean_text(text)
+        elapsed = time.perf_counter() - start
+        
+        # Input gấp 4 lần: tuyến tính thì thời gian ~x4, bậc hai ~x16
+        growth = elapsed / max(small_elapsed, 1e-3)
+        ok = elapsed <= args.budget and (growth <= 8 or elapsed < 0.05)
+        failures += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {name:28s} {len(text):>9} chars {elapsed:7.3f}s  x{growth:.1f}")
+    
+    if failures:
+        print(f"{failures} normalizer check(s) failed")
+        raise SystemExit(1)
+    print("Normalizer check passed")
+
+def build_arg_parser():
+    """Command line interface"""
+    parser = argparse.ArgumentParser(description="Professional TTS Generator")
+    subparsers = parser.add_subparsers(dest="command")
+    
+    subparsers.add_parser("serve", help="Run the web server (default)")
+    
+    warmup = subparsers.add_parser("warmup", help="Pre-populate the audio cache")
+    warmup.add_argument("files", nargs="*", help="Phrase list or document files")
+    warmup.add_argument("--text", default="", help="Inline text to warm up")
+    warmup.add_argument("--voice", required=True, help="Voice ID, e.g. vi-VN-HoaiMyNeural")
+    warmup.add_argument("--rate", type=int, default=0)
+    warmup.add_argument("--pitch", type=int, default=0)
+    warmup.add_argument("--volume", type=int, default=100)
+    
+    worker = subparsers.add_parser("worker", help="Run synthesis worker processes for the job queue")
+    worker.add_argument("--processes", type=int, default=0,
+                        help="Number of worker processes (default: TTS_WORKER_PROCESSES or 1)")
+    
+    cache_server = subparsers.add_parser("cache-server", help="Run the shared cache key/value server")
+    cache_server.add_argument("--dir", default="shared_cache", help="Storage directory")
+    cache_server.add_argument("--host", default="127.0.0.1",
+                              help="Bind address; non-loopback addresses require TTS_CACHE_TOKEN")
+    cache_server.add_argument("--port", type=int, default=8100)
+    cache_server.add_argument("--max-entries", type=int, default=10000)
+    
+    cache_export = subparsers.add_parser("cache-export", help="Export the audio cache as a snapshot")
+    cache_export.add_argument("output", help="Snapshot file (.tar)")
+    
+    cache_import = subparsers.add_parser("cache-import", help="Import an audio cache snapshot")
+    cache_import.add_argument("source", help="Snapshot file or export URL of another node")
+    
+    normalize_check = subparsers.add_parser("normalize-check",
+                                            help="Run adversarial inputs through the text normalizer")
+    normalize_check.add_argument("--size", type=int, default=200000, help="Characters per input")
+    normalize_check.add_argument("--budget", type=float, default=2.0, help="Seconds allowed per input")
+    
+    return parser
+
 # ==================== RUN APPLICATION ====================
 if __name__ == "__main__":
+    args = build_arg_parser().parse_args()
+    
+    cli_commands = {
+        "warmup": run_warmup_cli,
+        "worker": run_worker_cli,
+        "cache-server": run_cache_server_cli,
+        "cache-export": run_cache_export_cli,
+        "cache-import": run_cache_import_cli,
+        "normalize-check": run_normalize_check_cli
+    }
+    if args.command in cli_commands:
+        cli_commands[args.command](args)
+        raise SystemExit(0)
+    
     # Create necessary files for deployment
     create_requirements_txt()
     create_runtime_txt()
@@ -3516,6 +6965,9 @@ if __name__ == "__main__":
     # Get port from environment variable (for Render)
     port = int(os.environ.get("PORT", 8000))
     
+    # Worker process cho synthesis (TTS_WORKER_PROCESSES > 0)
+    worker_processes = start_worker_processes(TTSConfig.WORKER_PROCESSES)
+    
     print("=" * 60)
     print("PROFESSIONAL TTS GENERATOR v2.0")
     print("=" * 60)
@@ -3532,3 +6984,4 @@ if __name__ == "__main__":
         log_level="info",
         reload=False  # Disable reload for production
     )
+    stop_worker_processes(worker_processes)